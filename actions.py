@@ -0,0 +1,81 @@
+#
+# Hotkey actions off the input path.
+#
+# Input callbacks only submit an intent and return. Intents for the same
+# action are merged while they wait, so five quick volume-up presses become
+# one mixer write to the final value and a toggle pressed twice cancels out.
+# Whatever is left runs in the order the actions were first requested,
+# wherever drain() is called, so slow actions never hold up button edges.
+#
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import stats
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+# Merge rules, merge(queued, new) returns the combined value or None to drop
+# the intent altogether
+def latest(queued, new):
+    return new
+
+
+def accumulate(queued, new):
+    return (queued + new) or None
+
+
+def toggle(queued, new):
+    return None
+
+
+class ActionQueue(object):
+
+    # notify() is called whenever an intent is queued, so the owner knows to
+    # drain()
+    def __init__(self, notify=None):
+        self.notify = notify
+        self.actions = {}
+        self.pending = OrderedDict()
+        self.submitted = {}  # name: when the pending intent was first submitted
+        self.lock = threading.Lock()
+
+    # action(value) runs in drain() with the merged value
+    def register(self, name, action, merge=latest):
+        self.actions[name] = (action, merge)
+
+    # Never blocks on the action itself
+    def submit(self, name, value=True):
+        merge = self.actions[name][1]
+        with self.lock:
+            if name in self.pending:
+                value = merge(self.pending[name], value)
+                if value is None:
+                    del self.pending[name]
+                    return
+            else:
+                self.submitted[name] = clock()
+            self.pending[name] = value
+        if self.notify:
+            self.notify()
+
+    # Run everything that is queued right now, returns the number of actions
+    def drain(self):
+        count = 0
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return count
+                name, value = self.pending.popitem(last=False)
+                submitted = self.submitted.pop(name)
+            self.execute(name, value, submitted)
+            count += 1
+
+    def execute(self, name, value, submitted):
+        try:
+            self.actions[name][0](value)
+        except Exception as e:
+            logging.info("Action " + name + ": " + str(e))
+        stats.record('action.' + name, clock() - submitted)
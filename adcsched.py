@@ -0,0 +1,444 @@
+#
+# Single owner of the ADS1015.
+#
+# The stick and the battery share one ADC and one I2C bus. The scheduler is
+# the only code talking to the device, so conversions never interleave, and
+# it hands out conversion slots by priority:
+#
+#   stick    high rate, fixed period. With the ALERT/RDY pin wired up the ADC
+#            runs in continuous mode and every conversion-ready edge fetches
+#            a sample and points the multiplexer at the next axis, otherwise
+#            a worker thread converts the stick channels on a steady clock.
+#            When the edges stop coming (wrong READY_PIN, a missed edge) the
+#            requests waiting for a slot run out of time, the scheduler logs
+#            it and goes back to polling for good.
+#            The rate adapts: full rate while the stick moves, the idle rate
+#            once it has been still for the quiet time.
+#   others   (battery, ...) requested with request() and converted in the
+#            gaps: after a full stick cycle in continuous mode, in the idle
+#            time before the next stick deadline when polling, right away
+#            while the stick is off.
+#   guard    one channel watched against a lower limit (battery brownout).
+#            While the stick doesn't need ALERT/RDY the ADS1015 window
+#            comparator watches it between the other conversions and the
+#            ALERT edge reports a drop within a conversion or two. Otherwise
+#            the channel is converted every guard interval like a request.
+#
+# Gain and data rate are set per channel, so the stick can convert fast while
+# the battery is read slowly for less noise.
+#
+import collections
+import logging
+import threading
+import time
+
+import stats
+
+clock = getattr(time, 'monotonic', time.time)
+
+# ADS1x15 register pointers
+POINTER_CONVERSION = 0x00
+POINTER_CONFIG = 0x01
+POINTER_LOW_THRESHOLD = 0x02
+POINTER_HIGH_THRESHOLD = 0x03
+
+# Setting the MSB of Hi_thresh and clearing the MSB of Lo_thresh turns
+# ALERT/RDY into a conversion-ready pulse (about 8us, active low).
+RDY_HIGH_THRESHOLD = 0x8000
+RDY_LOW_THRESHOLD = 0x0000
+# Top of the window for the guard, only the lower limit can be crossed
+GUARD_HIGH_THRESHOLD = 0x7FF0
+
+# Config register fields
+CONFIG_MUX_SINGLE = 0x4000  # AIN0 single ended, add channel << 12
+CONFIG_MODE_CONTINUOUS = 0x0000
+CONFIG_COMP_WINDOW = 0x0010
+CONFIG_COMP_LATCHING = 0x0004
+CONFIG_COMP_QUE_1CONV = 0x0000
+CONFIG_GAIN = {
+    2 / 3: 0x0000,
+    1: 0x0200,
+    2: 0x0400,
+    4: 0x0600,
+    8: 0x0800,
+    16: 0x0A00
+}
+CONFIG_DR = {
+    128: 0x0000,
+    250: 0x0020,
+    490: 0x0040,
+    920: 0x0060,
+    1600: 0x0080,
+    2400: 0x00A0,
+    3300: 0x00C0
+}
+
+# I2C transfers around one single-shot conversion, used to decide whether a
+# request fits into the gap before the next stick deadline
+I2C_OVERHEAD = 0.001
+# Requests that never fit a gap go right after a stick sample once they
+# waited this long (s)
+MAX_WAIT = 0.25
+# Guard conversions while the comparator can't be used (s)
+GUARD_INTERVAL = 0.5
+# Requests still waiting for a conversion-ready slot this long mean the
+# ALERT/RDY edges aren't coming (s)
+READY_TIMEOUT = 1.0
+
+
+class AdcScheduler(object):
+
+    # stick(*samples) gets one sample per stick channel each cycle and
+    # returns True when the stick moved
+    def __init__(self, adc, stick, channels=(1, 2), rate=200, idleRate=20, quietTime=2.0, gpio=None,
+                 readyPin=-1):
+        self.adc = adc
+        self.stick = stick
+        self.channels = tuple(channels)
+        self.activePeriod = 1.0 / rate
+        self.idlePeriod = 1.0 / idleRate
+        self.quietTime = quietTime
+        self.period = self.activePeriod
+        self.lastMotion = float('-inf')
+        self.gpio = gpio
+        self.readyPin = readyPin
+        self.readyLost = False
+        self.config = {}
+        self.configured = {}  # config before the stick rate picked a data rate
+        self.requests = collections.deque()
+        self.sampling = False
+        self.running = False
+        self.detecting = False
+        self.guarded = None
+        self.guardInterval = GUARD_INTERVAL
+        self.guardDue = 0.0
+        self.comparing = False
+        self.samples = [0] * len(self.channels)
+        self.index = 0
+        self.slot = None
+        self.deadline = 0.0
+        self.bus = threading.Lock()
+        self.condition = threading.Condition()
+        for channel in range(4):
+            self.configure(channel)
+
+    def configure(self, channel, gain=1, dataRate=1600):
+        if gain not in CONFIG_GAIN:
+            raise ValueError("Unsupported ADS1015 gain: {}".format(gain))
+        if dataRate not in CONFIG_DR:
+            raise ValueError("Unsupported ADS1015 data rate: {}".format(dataRate))
+        self.config[channel] = self.configured[channel] = (gain, dataRate)
+
+    def readyDriven(self):
+        return self.gpio is not None and self.readyPin != -1 and not self.readyLost
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        worker = threading.Thread(target=self.run, name='adc')
+        worker.daemon = True
+        worker.start()
+
+    def close(self):
+        self.stopStick()
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        with self.bus:
+            if self.comparing:
+                self.comparing = False
+                self.adc.stop_adc()
+        if self.detecting:
+            self.gpio.remove_event_detect(self.readyPin)
+            self.detecting = False
+
+    def startStick(self):
+        with self.condition:
+            if self.sampling:
+                return
+            self.sampling = True
+            self.deadline = clock()
+            self.lastMotion = self.deadline
+            self.condition.notify()
+        self.setPeriod(self.activePeriod)
+        if self.readyDriven():
+            self.startContinuous()
+
+    def stopStick(self):
+        with self.condition:
+            if not self.sampling:
+                return
+            self.sampling = False
+            self.condition.notify()
+        if self.readyDriven():
+            with self.bus:
+                if self.guarded:
+                    self.startComparator()
+                else:
+                    self.adc.stop_adc()
+                slot, self.slot = self.slot, None
+            if slot:
+                with self.condition:
+                    self.requests.appendleft(slot)
+                    self.condition.notify()
+
+    # done(value, error) is called from the scheduler once the channel was
+    # converted in a free slot
+    def request(self, channel, done):
+        with self.condition:
+            self.requests.append((channel, done, clock()))
+            self.condition.notify()
+
+    # Blocking convenience around request()
+    def read(self, channel):
+        finished = threading.Event()
+        result = []
+
+        def done(value, error):
+            result.append((value, error))
+            finished.set()
+
+        self.request(channel, done)
+        finished.wait()
+        value, error = result[0]
+        if error:
+            raise error
+        return value
+
+    # alert(value) is called from the GPIO or the scheduler thread whenever
+    # channel converts below low. Quick enough for a brownout when the
+    # comparator can be used, once per interval otherwise.
+    def guard(self, channel, low, alert, interval=GUARD_INTERVAL):
+        with self.condition:
+            self.guarded = (channel, low, alert)
+            self.guardInterval = interval
+            self.guardDue = clock()
+            self.condition.notify()
+        if self.readyDriven() and not self.sampling:
+            with self.bus:
+                self.startComparator()
+
+    # One single-shot conversion of every stick channel
+    def readStick(self):
+        return [self.convert(channel) for channel in self.channels]
+
+    # Same, handed to the callback
+    def sampleStick(self):
+        self.track(self.stick(*self.readStick()))
+
+    def setRates(self, rate, idleRate, quietTime):
+        self.activePeriod = 1.0 / rate
+        self.idlePeriod = 1.0 / idleRate
+        self.quietTime = quietTime
+        self.setPeriod(self.activePeriod)
+
+    # Full rate on motion, idle rate after the quiet time
+    def track(self, moved):
+        now = clock()
+        if moved:
+            self.lastMotion = now
+            if self.period != self.activePeriod:
+                self.setPeriod(self.activePeriod)
+        elif self.period != self.idlePeriod and now - self.lastMotion > self.quietTime:
+            self.setPeriod(self.idlePeriod)
+
+    # Continuous mode gets there through the data rate of the stick channels
+    def setPeriod(self, period):
+        with self.condition:
+            self.period = period
+            self.deadline = min(self.deadline, clock() + period)
+            self.condition.notify()
+        if self.readyDriven():
+            rate = len(self.channels) / period
+            dataRate = min([dataRate for dataRate in CONFIG_DR if dataRate >= rate] or [max(CONFIG_DR)])
+            for channel in self.channels:
+                self.config[channel] = (self.config[channel][0], dataRate)
+
+    def convert(self, channel):
+        gain, dataRate = self.config[channel]
+        with self.bus:
+            begin = clock()
+            value = self.adc.read_adc(channel, gain=gain, data_rate=dataRate)
+            stats.record('adc.convert', clock() - begin)
+            # A single-shot conversion ends continuous mode, pick it up again
+            if self.sampling and self.readyDriven():
+                self.startConversion(self.slot[0] if self.slot else self.channels[self.index])
+            elif self.comparing:
+                self.startComparator()
+            return value
+
+    def serve(self, request):
+        channel, done, queued = request
+        try:
+            value = self.convert(channel)
+        except Exception as e:
+            done(None, e)
+        else:
+            stats.record('adc.request', clock() - queued)
+            done(value, None)
+
+    # Worker: the stick clock when polling, requests whenever there is room
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                polling = self.sampling and not self.readyDriven()
+                now = clock()
+                wakeups = [self.deadline] if polling else []
+                if self.guarded and not self.comparing:
+                    if now >= self.guardDue:
+                        self.guardDue = now + self.guardInterval
+                        self.requests.append((self.guarded[0], self.checkGuard, now))
+                    wakeups.append(self.guardDue)
+                expires = self.readyExpires()
+                if expires is not None:
+                    wakeups.append(expires)
+                if polling and now >= self.deadline:
+                    # Missed deadlines are dropped rather than bunched up
+                    self.deadline = max(self.deadline + self.period, now)
+                    task = self.sampleStick
+                elif expires is not None and now >= expires:
+                    task = self.fallBack
+                elif self.requests and (not self.sampling or polling and self.fits(self.requests[0], now)):
+                    task = lambda request=self.requests.popleft(): self.serve(request)
+                else:
+                    self.condition.wait(min(wakeups) - now if wakeups else None)
+                    continue
+            try:
+                task()
+            except Exception:
+                logging.exception("ADC scheduler")
+
+    def fits(self, request, now):
+        channel, done, queued = request
+        cost = 1.0 / self.config[channel][1] + I2C_OVERHEAD
+        return cost <= self.deadline - now or now - queued > MAX_WAIT
+
+    # When the oldest request waiting for a conversion-ready slot runs out of
+    # time, None unless the stick samples on ALERT/RDY edges. Callers hold
+    # the condition.
+    def readyExpires(self):
+        if not self.sampling or not self.readyDriven():
+            return None
+        waiting = [request[2] for request in (self.slot, self.requests[0] if self.requests else None) if request]
+        return min(waiting) + READY_TIMEOUT if waiting else None
+
+    # No conversion-ready edges: poll from now on, the waiting requests are
+    # converted single-shot as soon as they fit
+    def fallBack(self):
+        logging.error("ADS1015: no ALERT/RDY edges on READY_PIN {} for {}s, polling the ADC instead".format(
+            self.readyPin, READY_TIMEOUT))
+        with self.bus:
+            self.readyLost = True
+            self.comparing = False
+            self.adc.stop_adc()
+            if self.detecting:
+                self.gpio.remove_event_detect(self.readyPin)
+                self.detecting = False
+            slot, self.slot = self.slot, None
+            for channel in self.channels:
+                self.config[channel] = self.configured[channel]
+        with self.condition:
+            if slot:
+                self.requests.appendleft(slot)
+            self.deadline = clock()
+            self.condition.notify()
+
+    # Guard conversions made in software
+    def checkGuard(self, value, error):
+        channel, low, alert = self.guarded
+        if error is None and value < low:
+            alert(value)
+
+    # ALERT/RDY edges: conversion ready while the stick samples, the guard
+    # comparator otherwise. Callers hold the bus lock.
+    def detect(self):
+        if not self.detecting:
+            self.gpio.setup(self.readyPin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+            self.gpio.add_event_detect(self.readyPin, self.gpio.FALLING, callback=self.handleAlert)
+            self.detecting = True
+
+    def handleAlert(self, pin):
+        if self.comparing:
+            self.handleComparator()
+        else:
+            self.handleReady(pin)
+
+    # Continuous conversions of the guarded channel, ALERT is asserted (and
+    # latched) once one falls below the lower threshold. Callers hold the
+    # bus lock.
+    def startComparator(self):
+        channel, low, alert = self.guarded
+        self.detect()
+        self.writeRegister(POINTER_HIGH_THRESHOLD, GUARD_HIGH_THRESHOLD)
+        self.writeRegister(POINTER_LOW_THRESHOLD, (low << 4) & 0xFFFF)
+        self.startConversion(channel, CONFIG_COMP_WINDOW | CONFIG_COMP_LATCHING)
+        self.comparing = True
+
+    def handleComparator(self):
+        with self.bus:
+            if not self.comparing:
+                return
+            # Reading the result releases the latch
+            value = self.adc.get_last_result()
+        channel, low, alert = self.guarded
+        if value < low:
+            alert(value)
+
+    # Continuous conversions, woken up on every conversion-ready edge
+    def startContinuous(self):
+        with self.bus:
+            self.detect()
+            self.comparing = False
+            self.writeRegister(POINTER_HIGH_THRESHOLD, RDY_HIGH_THRESHOLD)
+            self.writeRegister(POINTER_LOW_THRESHOLD, RDY_LOW_THRESHOLD)
+            self.index = 0
+            self.slot = None
+            self.startConversion(self.channels[self.index])
+
+    def handleReady(self, pin):
+        samples = None
+        finished = None
+        with self.bus:
+            if not self.sampling or self.readyLost:
+                return
+            value = self.adc.get_last_result()
+            if self.slot:
+                finished, self.slot = (self.slot, value), None
+            else:
+                self.samples[self.index] = value
+                self.index = (self.index + 1) % len(self.channels)
+                if self.index == 0:
+                    samples = list(self.samples)
+                    # A full stick cycle is done, the next slot may go to a request
+                    with self.condition:
+                        if self.requests:
+                            self.slot = self.requests.popleft()
+            channel = self.slot[0] if self.slot else self.channels[self.index]
+            self.startConversion(channel)
+        if finished:
+            (channel, done, queued), value = finished
+            stats.record('adc.request', clock() - queued)
+            done(value, None)
+        if samples:
+            self.track(self.stick(*samples))
+
+    # Writing the config register in continuous mode restarts the conversion
+    # on the newly selected channel.
+    def startConversion(self, channel, comparator=0):
+        gain, dataRate = self.config[channel]
+        config = CONFIG_MUX_SINGLE | (channel & 0x03) << 12
+        config |= CONFIG_GAIN[gain]
+        config |= CONFIG_MODE_CONTINUOUS
+        config |= CONFIG_DR[dataRate]
+        config |= CONFIG_COMP_QUE_1CONV  # traditional, active low, non latching
+        config |= comparator  # unless the guard asks for a latching window
+        self.writeRegister(POINTER_CONFIG, config)
+
+    # Adafruit_ADS1x15 only exposes blocking helpers for comparator setup
+    # (they sleep for a whole conversion), so talk to the I2C device directly.
+    def writeRegister(self, pointer, value):
+        self.adc._device.writeList(pointer, [(value >> 8) & 0xFF, value & 0xFF])
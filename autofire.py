@@ -0,0 +1,93 @@
+#
+# Generated input: turbo buttons and macros.
+#
+# Turbo takes over a held button and taps it at a fixed rate for as long as
+# it is held. A macro is a list of steps, each pressing some buttons for a
+# while and letting go. Both only schedule timers on the shared timer wheel
+# (see timerwheel.py), the changes go out through the caller's emit(changes)
+# as one input frame per step.
+#
+import threading
+
+from timerwheel import clock
+
+
+class Turbo(object):
+
+    # emit([(event, value), ...]) sends one input frame
+    def __init__(self, wheel, emit, rates=None):
+        self.wheel = wheel
+        self.emit = emit
+        self.rates = dict(rates or {})  # pin: presses per second
+        self.enabled = True
+        self.held = {}  # pin: [timer, event, pressed, half period]
+        self.lock = threading.Lock()
+
+    def configure(self, rates):
+        self.rates = dict(rates)
+
+    def setEnabled(self, enabled):
+        self.enabled = enabled
+
+    # Settled change of a button, True when turbo took the button over.
+    # Emitting under the lock keeps a tap from overtaking the release.
+    def change(self, pin, event, pressed):
+        with self.lock:
+            if pin in self.held:
+                state = self.held.pop(pin)
+                state[0].cancel()
+                if state[2]:
+                    self.emit([(event, 0)])
+                return True
+            if not pressed or not self.enabled or pin not in self.rates:
+                return False
+            half = 0.5 / self.rates[pin]
+            deadline = clock() + half
+            state = [None, event, True, half]
+            state[0] = self.wheel.at(deadline, self.toggle, pin, state, deadline)
+            self.held[pin] = state
+            self.emit([(event, 1)])
+        return True
+
+    # Next deadline from this one, so late wake-ups don't add up
+    def toggle(self, pin, state, deadline):
+        with self.lock:
+            if self.held.get(pin) is not state:
+                return
+            state[2] = not state[2]
+            deadline += state[3]
+            state[0] = self.wheel.at(deadline, self.toggle, pin, state, deadline)
+            self.emit([(state[1], 1 if state[2] else 0)])
+
+
+class MacroPlayer(object):
+
+    def __init__(self, wheel, emit):
+        self.wheel = wheel
+        self.emit = emit
+        self.timers = []
+        self.lock = threading.Lock()
+
+    # steps: [(events, seconds)], events are pressed for that long and then
+    # released for as long again; no events is a pause. A new macro replaces
+    # the one playing.
+    def play(self, steps):
+        with self.lock:
+            self.cancel()
+            start = clock()
+            for events, seconds in steps:
+                if events:
+                    self.timers.append(self.wheel.at(start, self.emit, [(event, 1) for event in events]))
+                    start += seconds
+                    self.timers.append(self.wheel.at(start, self.emit, [(event, 0) for event in events]))
+                start += seconds
+
+    # Callers hold the lock
+    def cancel(self):
+        for timer in self.timers:
+            timer.cancel()
+        self.timers = []
+
+    def stop(self):
+        with self.lock:
+            self.cancel()
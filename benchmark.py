@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+#
+# Input path benchmarks on the simulated hardware backend (see hal.py/sim.py).
+#
+# Runs the monitor's hot paths against scripted GPIO edges, a synthetic stick
+# waveform and a recording uinput sink, then reports throughput and latency
+# percentiles so changes can be measured on any Linux box before they ship.
+#
+#   python benchmark.py                  run every case
+#   python benchmark.py handle_button    run selected cases
+#   python benchmark.py -n 500           iterations per case
+#
+# The ADC cases run their own scheduler with ALERT/RDY wired to READY_PIN.
+#
+import adcsched
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import hal
+
+hal.select('simulated')
+
+import monitor_evdev as monitor
+import osdstate
+import sim
+import timerwheel
+import wireless
+
+timer = getattr(time, 'perf_counter', time.time)
+
+READY_PIN = 24  # free on the default keys.cfg
+
+
+def percentile(samples, pct):
+    index = int(round(pct / 100.0 * (len(samples) - 1)))
+    return samples[index]
+
+
+def measure(name, iterations, setup, call):
+    latencies = []
+    writes = monitor.device.writes
+    start = timer()
+    for i in range(iterations):
+        setup(i)
+        begin = timer()
+        call(i)
+        latencies.append(timer() - begin)
+    elapsed = timer() - start
+    monitor.emitter.flush()
+    return summarize(name, iterations, elapsed, latencies, writes)
+
+
+def summarize(name, iterations, elapsed, latencies, writes):
+    latencies.sort()
+    return {
+        'writes': float(monitor.device.writes - writes) / iterations,
+        'name': name,
+        'iterations': iterations,
+        'throughput': iterations / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1],
+    }
+
+
+# Alternate press/release edges on every button that is not the hotkey
+def benchHandleButton(iterations):
+    pins = [pin for pin in monitor.config.buttons if pin != monitor.config.hotkey]
+
+    def setup(i):
+        pin = pins[(i // 2) % len(pins)]
+        monitor.gpio.levels[pin] = monitor.gpio.LOW if i % 2 == 0 else monitor.gpio.HIGH
+
+    def call(i):
+        monitor.handle_button(pins[(i // 2) % len(pins)])
+
+    return measure('handle_button', iterations, setup, call)
+
+
+# Every button (but the hotkey) pressed at once, latency covers the whole chord
+def benchButtonChord(iterations):
+    pins = [pin for pin in monitor.config.buttons if pin != monitor.config.hotkey]
+    quiet = max([monitor.config.bounceTime] + list(monitor.config.bounceTimes.values())) * 2
+
+    def setup(i):
+        for pin in pins:
+            monitor.gpio.release(pin)
+        time.sleep(quiet)
+
+    def call(i):
+        for pin in pins:
+            monitor.gpio.press(pin)
+
+    return measure('buttonChord', iterations, setup, call)
+
+
+# HOTKEY held, one chord button pressed and let go: bank snapshot plus chord lookup
+def benchHotkeyDispatch(iterations):
+    config = monitor.config
+    pins = [pin for pin in config.buttons if pin in config.hotkeys]
+    monitor.gpio.levels[config.hotkey] = monitor.gpio.LOW
+
+    def setup(i):
+        pin = pins[(i // 2) % len(pins)]
+        monitor.gpio.levels[pin] = monitor.gpio.LOW if i % 2 == 0 else monitor.gpio.HIGH
+
+    def call(i):
+        monitor.checkKeyInputPowerSaving()
+
+    try:
+        return measure('hotkeyDispatch', iterations, setup, call)
+    finally:
+        monitor.hotkeyEngine.update(0)
+        monitor.actionQueue.pending.clear()
+        for pin in pins + [config.hotkey]:
+            monitor.gpio.levels[pin] = monitor.gpio.HIGH
+
+
+# Stick sweeping both axes around the center
+def benchCheckJoystickInput(iterations):
+    center = monitor.config.vref // 2
+    monitor.adc.setWaveform(1, sim.sineWave(center, center - 50, 2.0))
+    monitor.adc.setWaveform(2, sim.sineWave(center, center - 50, 2.0, phase=1.5))
+
+    def setup(i):
+        pass
+
+    def call(i):
+        monitor.checkJoystickInput()
+
+    return measure('checkJoystickInput', iterations, setup, call)
+
+
+def benchUpdateOSD(iterations):
+    def setup(i):
+        pass
+
+    def call(i):
+        monitor.updateOSD(370 + i % 5, 60, 20, 3, 50, 0, i % 2 == 0, False, True)
+
+    return measure('updateOSD', iterations, setup, call)
+
+
+# Periodic refresh with nothing new to show
+def benchUpdateOSDUnchanged(iterations):
+    def setup(i):
+        pass
+
+    def call(i):
+        monitor.updateOSD(370, 60, 20, 3, 50, 0, False, False, True)
+
+    return measure('updateOSDUnchanged', iterations, setup, call)
+
+
+# Turbo-like periodic timers on a timer wheel while another thread feeds the
+# input path at a 1 kHz button/stick rate, latency is how late each timer fired
+def benchTimerJitter(iterations):
+    wheel = timerwheel.TimerWheel(name='benchmark-timers')
+    period = 0.005
+    streams = 8
+    lateness = []
+    done = threading.Event()
+    busy = [True]
+    center = monitor.config.vref // 2
+    monitor.adc.setWaveform(1, sim.sineWave(center, center - 50, 2.0))
+    pins = [pin for pin in monitor.config.buttons if pin != monitor.config.hotkey]
+
+    def load():
+        i = 0
+        while busy[0]:
+            pin = pins[(i // 2) % len(pins)]
+            monitor.gpio.levels[pin] = monitor.gpio.LOW if i % 2 == 0 else monitor.gpio.HIGH
+            monitor.handle_button(pin)
+            monitor.checkJoystickInput()
+            i += 1
+            time.sleep(0.001)
+
+    def tick(deadline):
+        lateness.append(timerwheel.clock() - deadline)
+        if len(lateness) >= iterations:
+            done.set()
+        elif not done.is_set():
+            wheel.at(deadline + period, tick, deadline + period)
+
+    loader = threading.Thread(target=load)
+    loader.start()
+    wheel.start()
+    writes = monitor.device.writes
+    start = timer()
+    now = timerwheel.clock()
+    for stream in range(streams):
+        deadline = now + period * (stream + 1) / streams
+        wheel.at(deadline, tick, deadline)
+    done.wait()
+    elapsed = timer() - start
+    wheel.stop()
+    busy[0] = False
+    loader.join()
+    monitor.emitter.flush()
+    for pin in pins:
+        monitor.gpio.levels[pin] = monitor.gpio.HIGH
+    return summarize('timerJitter', iterations, elapsed, lateness[:iterations], writes)
+
+
+# Scheduler on a simulated ADS1015 that pulses READY_PIN like ALERT/RDY
+def readyScheduler(stick):
+    adc = hal.backend().ADS1015(READY_PIN)
+    scheduler = adcsched.AdcScheduler(adc, stick, gpio=monitor.gpio, readyPin=READY_PIN)
+    scheduler.configure(0, gain=monitor.config.batteryGain, dataRate=monitor.config.batteryDataRate)
+    scheduler.start()
+    return adc, scheduler
+
+
+# Battery reads while the moving stick samples on conversion-ready edges,
+# latency is how long a read waits for its slot
+def benchReadyBattery(iterations):
+    samples = [0]
+
+    def stick(x, y):
+        samples[0] += 1
+        return True
+
+    adc, scheduler = readyScheduler(stick)
+    scheduler.startStick()
+
+    def setup(i):
+        pass
+
+    def call(i):
+        scheduler.read(0)
+
+    try:
+        return measure('readyBattery', iterations, setup, call)
+    finally:
+        scheduler.close()
+        if scheduler.readyLost or not samples[0]:
+            print("readyBattery: no stick samples on ALERT/RDY edges")
+
+
+# Battery dropping below the limit while the ADS1015 comparator watches it,
+# latency is the drop to the ALERT edge reaching the guard
+def benchComparatorBrownout(iterations):
+    low = 1500
+    tripped = threading.Event()
+    adc, scheduler = readyScheduler(lambda x, y: False)
+    scheduler.configure(0, gain=monitor.config.batteryGain, dataRate=1600)
+    scheduler.guard(0, low, lambda value: tripped.set())
+
+    def setup(i):
+        adc.setWaveform(0, sim.constant(low + 400))
+        time.sleep(0.005)
+        tripped.clear()
+
+    def call(i):
+        adc.setWaveform(0, sim.constant(low - 100))
+        tripped.wait()
+
+    try:
+        return measure('comparatorBrownout', iterations, setup, call)
+    finally:
+        scheduler.close()
+
+
+WIRELESS_SAMPLE = (b"Inter-| sta-|   Quality        |   Discarded packets               | Missed | WE\n"
+                   b" face | tus | link level noise |  nwid  crypt   frag  retry   misc | beacon | 22\n"
+                   b" wlan0: 0000   62.  -48.  -256        0      0      0      0      0        0\n")
+
+
+# Every read misses the cache and parses the file again
+def benchReadWifiSignal(iterations):
+    path = os.path.join(tempfile.gettempdir(), 'oneforall-wireless-benchmark')
+    with open(path, 'wb') as sample:
+        sample.write(WIRELESS_SAMPLE)
+    status = monitor.wifiStatus
+    monitor.wifiStatus = wireless.WifiStatus(path, ttl=0)
+
+    def setup(i):
+        pass
+
+    def call(i):
+        monitor.readWifiSignal()
+
+    try:
+        return measure('readWifiSignal', iterations, setup, call)
+    finally:
+        monitor.wifiStatus.close()
+        monitor.wifiStatus = status
+        os.unlink(path)
+
+
+CASES = [
+    ('handle_button', benchHandleButton),
+    ('buttonChord', benchButtonChord),
+    ('hotkeyDispatch', benchHotkeyDispatch),
+    ('checkJoystickInput', benchCheckJoystickInput),
+    ('updateOSD', benchUpdateOSD),
+    ('updateOSDUnchanged', benchUpdateOSDUnchanged),
+    ('readWifiSignal', benchReadWifiSignal),
+    ('timerJitter', benchTimerJitter),
+    ('readyBattery', benchReadyBattery),
+    ('comparatorBrownout', benchComparatorBrownout),
+]
+
+
+def setupMonitor():
+    monitor.initGpio()
+    monitor.initAdc()
+    monitor.initActions()
+    monitor.initHotkeys()
+    monitor.initDevice()
+    monitor.initAutofire()
+    monitor.initButtons()
+    monitor.osd_state = osdstate.OsdState(os.path.join(tempfile.gettempdir(), 'oneforall-osd-benchmark'))
+
+
+def report(result):
+    print("{name:<20} {iterations:>7} {throughput:>12.1f}/s  p50 {p50:>10.1f}us  p90 {p90:>10.1f}us  "
+          "p99 {p99:>10.1f}us  max {max:>10.1f}us  {writes:>6.2f} writes".format(
+              name=result['name'], iterations=result['iterations'], throughput=result['throughput'],
+              p50=result['p50'] * 1e6, p90=result['p90'] * 1e6, p99=result['p99'] * 1e6,
+              max=result['max'] * 1e6, writes=result['writes']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the monitor input path on simulated hardware")
+    parser.add_argument('cases', nargs='*', help="cases to run: " + ", ".join(name for name, _ in CASES))
+    parser.add_argument('-n', '--iterations', type=int, default=200, help="iterations per case")
+    args = parser.parse_args()
+
+    setupMonitor()
+    for name, bench in CASES:
+        if args.cases and name not in args.cases:
+            continue
+        report(bench(args.iterations))
+    monitor.osd_state.close()
+
+
+if __name__ == '__main__':
+    main()
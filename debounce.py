@@ -0,0 +1,95 @@
+#
+# Timestamp based button debouncing.
+#
+# GPIO callbacks only record the edge: the level is sampled right away and
+# nothing ever sleeps. A pin that has been quiet for its settle time reports a
+# change immediately (leading edge), edges arriving while a pin is still
+# bouncing are remembered and the pin is sampled again once it has been quiet
+# for the settle time. A single worker thread handles those deadlines for all
+# pins.
+#
+import threading
+import time
+
+import stats
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+class Debouncer(object):
+
+    # read(pin) samples a pin, changed(pin, level) gets every settled change
+    def __init__(self, pins, read, changed, settle=0.01, settleTimes=None):
+        settleTimes = settleTimes or {}
+        self.read = read
+        self.changed = changed
+        self.settle = dict((pin, settleTimes.get(pin, settle)) for pin in pins)
+        self.levels = dict((pin, read(pin)) for pin in pins)
+        self.lastEdge = dict((pin, float('-inf')) for pin in pins)
+        self.deadlines = {}
+        self.started = {}  # first edge of the current bounce
+        self.running = False
+        self.condition = threading.Condition(threading.RLock())
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        worker = threading.Thread(target=self.run, name='debounce')
+        worker.daemon = True
+        worker.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    # Last settled level of a pin
+    def level(self, pin):
+        return self.levels[pin]
+
+    # Called from the GPIO callback with the level sampled at the edge
+    def edge(self, pin, level, now=None):
+        if now is None:
+            now = clock()
+        with self.condition:
+            quiet = now - self.lastEdge[pin] >= self.settle[pin]
+            self.lastEdge[pin] = now
+            # Check the final level once the contacts stopped bouncing
+            if pin not in self.deadlines:
+                self.started[pin] = now
+                self.condition.notify()
+            else:
+                stats.count('debounce.bounces')
+            self.deadlines[pin] = now + self.settle[pin]
+            if quiet and level != self.levels[pin]:
+                self.commit(pin, level)
+
+    # Sample every pin whose settle time expired, returns the next deadline
+    def poll(self, now=None):
+        if now is None:
+            now = clock()
+        with self.condition:
+            for pin, deadline in list(self.deadlines.items()):
+                if deadline > now:
+                    continue
+                del self.deadlines[pin]
+                level = self.read(pin)
+                if level != self.levels[pin]:
+                    self.commit(pin, level)
+            return min(self.deadlines.values()) if self.deadlines else None
+
+    def commit(self, pin, level):
+        stats.record('debounce', clock() - self.started[pin])
+        self.levels[pin] = level
+        self.changed(pin, level)
+
+    def run(self):
+        with self.condition:
+            while self.running:
+                deadline = self.poll()
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    self.condition.wait(max(0.0, deadline - clock()))
@@ -0,0 +1,76 @@
+#
+# python-evdev output for the hardware backend (see hal.py).
+#
+# Mirrors the python-uinput API the monitor is written against (event codes as
+# (type, code) tuples, Device.emit/syn) on top of evdev.UInput and adds
+# emitFrame(), which packs a whole frame plus its SYN_REPORT into a single
+# write() on the uinput file descriptor.
+#
+import os
+import struct
+import time
+
+from evdev import AbsInfo, UInput, ecodes
+
+# struct input_event: struct timeval, __u16 type, __u16 code, __s32 value
+EVENT_FORMAT = 'llHHi'
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+
+
+class EvdevUinput(object):
+    EV_KEY = ecodes.EV_KEY
+    EV_ABS = ecodes.EV_ABS
+
+    # KEY_*, BTN_* and ABS_* names resolve like the python-uinput constants
+    def __getattr__(self, name):
+        if name.startswith('ABS_') and name in ecodes.ecodes:
+            return (ecodes.EV_ABS, ecodes.ecodes[name])
+        if name.startswith(('KEY_', 'BTN_')) and name in ecodes.ecodes:
+            return (ecodes.EV_KEY, ecodes.ecodes[name])
+        raise AttributeError(name)
+
+    def Device(self, events, name="python-uinput", bustype=0, vendor=0, product=0, version=0):
+        return EvdevDevice(events, name, bustype, vendor, product, version)
+
+
+class EvdevDevice(object):
+
+    def __init__(self, events, name="python-uinput", bustype=0, vendor=0, product=0, version=0):
+        capabilities = {}
+        for event in events:
+            if event[0] == ecodes.EV_ABS:
+                minimum, maximum, fuzz, flat = event[2:6]
+                info = AbsInfo(value=0, min=minimum, max=maximum, fuzz=fuzz, flat=flat, resolution=0)
+                capabilities.setdefault(ecodes.EV_ABS, []).append((event[1], info))
+            else:
+                capabilities.setdefault(event[0], []).append(event[1])
+        self.device = UInput(capabilities, name=name, bustype=bustype or ecodes.BUS_USB,
+                             vendor=vendor or 0x1, product=product or 0x1, version=version)
+        self.fd = self.device.fd
+        self.pending = []
+
+    def emit(self, event, value, syn=True):
+        self.pending.append((event, value))
+        if syn:
+            self.syn()
+
+    def syn(self):
+        pending = self.pending
+        self.pending = []
+        self.emitFrame(pending)
+
+    # One write for every event of the frame and the closing SYN_REPORT
+    def emitFrame(self, events):
+        now = time.time()
+        seconds = int(now)
+        microseconds = int((now - seconds) * 1000000)
+        buffer = bytearray(EVENT_SIZE * (len(events) + 1))
+        offset = 0
+        for event, value in events:
+            struct.pack_into(EVENT_FORMAT, buffer, offset, seconds, microseconds, event[0], event[1], int(value))
+            offset += EVENT_SIZE
+        struct.pack_into(EVENT_FORMAT, buffer, offset, seconds, microseconds, ecodes.EV_SYN, ecodes.SYN_REPORT, 0)
+        os.write(self.fd, buffer)
+
+    def destroy(self):
+        self.device.close()
@@ -0,0 +1,141 @@
+#
+# The monitor's event loop.
+#
+# One asyncio loop owns all periodic and event driven work of the monitor:
+# OSD publishing, battery reads, stick polling and hotkey actions run as
+# tasks on it and only wake up when they have something to do. Blocking
+# hardware I/O (I2C, rfkill, mixer, process spawns) goes through a small
+# executor so the loop itself never stalls.
+#
+# Other threads (GPIO callbacks, the debouncer, the executor) never touch the
+# loop's state directly, they hand work over with call() or set a Trigger.
+# SIGINT and SIGTERM cancel every task and run the cleanups in reverse order.
+#
+import asyncio
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+
+# asyncio.Event that may be set from any thread
+class Trigger(object):
+
+    def __init__(self, daemon):
+        self.daemon = daemon
+        self.event = asyncio.Event()
+
+    def set(self):
+        self.daemon.call(self.event.set)
+
+    def clear(self):
+        self.daemon.call(self.event.clear)
+
+    def isSet(self):
+        return self.event.is_set()
+
+    # Loop thread only, clears right away
+    def reset(self):
+        self.event.clear()
+
+    # Returns False on timeout, does not clear
+    async def wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class Daemon(object):
+
+    def __init__(self, workers=1):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='io')
+        self.tasks = []
+        self.cleanups = []
+        self.readers = []
+        self.stopping = asyncio.Event()
+
+    def trigger(self):
+        return Trigger(self)
+
+    # Run func(*args) on the loop thread, safe from any thread
+    def call(self, func, *args):
+        self.loop.call_soon_threadsafe(func, *args)
+
+    # Run func(*args) on the loop thread after delay seconds, loop thread only
+    def later(self, delay, func, *args):
+        return self.loop.call_later(delay, func, *args)
+
+    # Run blocking func(*args) on the executor and wait for its result
+    async def offload(self, func, *args):
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    # Future settled by another thread calling done(value, error)
+    def pending(self):
+        future = self.loop.create_future()
+
+        def settle(value, error):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(value)
+
+        def done(value=None, error=None):
+            self.call(settle, value, error)
+
+        return future, done
+
+    # Call func() on the loop thread when the signal arrives
+    def onSignal(self, signum, func):
+        self.loop.add_signal_handler(signum, func)
+
+    # Call func() on the loop thread whenever fd is readable
+    def addReader(self, fd, func):
+        self.loop.add_reader(fd, func)
+        self.readers.append(fd)
+
+    # Cleanups run after the tasks are cancelled, last added first
+    def atExit(self, func):
+        self.cleanups.append(func)
+
+    def spawn(self, coroutine, name=None):
+        task = self.loop.create_task(self.guard(coroutine, name))
+        self.tasks.append(task)
+        return task
+
+    # A failing task is logged, it doesn't take the monitor down
+    async def guard(self, coroutine, name):
+        try:
+            await coroutine
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("Task " + str(name) + " failed")
+
+    # Safe from any thread
+    def stop(self):
+        self.call(self.stopping.set)
+
+    # Runs until SIGINT, SIGTERM or stop()
+    def run(self):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, self.stopping.set)
+        try:
+            self.loop.run_until_complete(self.stopping.wait())
+            for task in self.tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*self.tasks, return_exceptions=True))
+        finally:
+            for fd in self.readers:
+                self.loop.remove_reader(fd)
+            for cleanup in reversed(self.cleanups):
+                try:
+                    cleanup()
+                except Exception:
+                    logging.exception("Cleanup failed")
+            self.executor.shutdown(wait=False)
+            self.loop.close()
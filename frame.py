@@ -0,0 +1,108 @@
+#
+# Frame coalesced input emission.
+#
+# Every state change of one scan window is staged into a frame, the frame is
+# then handed to the device in one go followed by a single SYN_REPORT. Chords
+# reach the emulator atomically and a whole frame costs one write when the
+# output backend supports it (see evdevout.py).
+#
+import threading
+import time
+
+import stats
+
+clock = getattr(time, 'monotonic', time.time)
+
+EV_KEY = 0x01
+
+
+class FrameEmitter(object):
+
+    # window is the time in seconds a frame stays open after its first event,
+    # 0 sends every event right away
+    def __init__(self, device, window=0.001):
+        self.device = device
+        self.window = window
+        self.frame = []
+        self.index = {}
+        self.deadline = None
+        self.opened = None  # first change of the frame staged
+        self.running = False
+        self.condition = threading.Condition(threading.RLock())
+
+    def start(self):
+        with self.condition:
+            if self.running or not self.window:
+                return
+            self.running = True
+        worker = threading.Thread(target=self.run, name='frame')
+        worker.daemon = True
+        worker.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.flush()
+
+    # Queue a change, an axis keeps its latest value while a key that flips
+    # twice closes the frame so neither the press nor the release get lost
+    def stage(self, event, value):
+        with self.condition:
+            key = (event[0], event[1])
+            if key in self.index:
+                position = self.index[key]
+                if event[0] == EV_KEY and self.frame[position][1] != value:
+                    self.flush()
+                else:
+                    self.frame[position] = (event, value)
+                    return
+            if not self.frame:
+                self.opened = clock()
+            self.index[key] = len(self.frame)
+            self.frame.append((event, value))
+            if not self.running:
+                self.flush()
+            elif self.deadline is None:
+                self.deadline = clock() + self.window
+                self.condition.notify()
+
+    # Switch to another device, returns the previous one. Staged events go
+    # to the previous device first.
+    def setDevice(self, device):
+        with self.condition:
+            self.flush()
+            previous, self.device = self.device, device
+        return previous
+
+    # Send the staged frame with a single SYN_REPORT
+    def flush(self):
+        with self.condition:
+            frame = self.frame
+            if not frame:
+                return
+            self.frame = []
+            self.index = {}
+            self.deadline = None
+            begin = clock()
+            if hasattr(self.device, 'emitFrame'):
+                self.device.emitFrame(frame)
+            else:
+                for event, value in frame:
+                    self.device.emit(event, value, syn=False)
+                self.device.syn()
+            end = clock()
+            stats.record('emit.write', end - begin)
+            stats.record('emit.frame', end - self.opened)
+
+    def run(self):
+        with self.condition:
+            while self.running:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+                timeout = self.deadline - clock()
+                if timeout > 0:
+                    self.condition.wait(timeout)
+                else:
+                    self.flush()
@@ -0,0 +1,129 @@
+#
+# Battery state from noisy ADC readings.
+#
+# Every reading is a small batch of samples: the median of the batch throws
+# out spikes (a button press or the backlight switching on), an exponential
+# moving average over the batch medians smooths what is left. Filtered values
+# are kept with their time in a ring buffer, the slope over the buffer gives
+# the discharge rate and from there the time to empty.
+#
+# State of charge follows a LiPo discharge curve instead of a straight line,
+# stretched so 0% and 100% land on the configured shutdown and full voltages.
+#
+# The reading interval adapts: slow while the voltage is well above the low
+# battery level, faster close to it and fastest below it, so the ADC is left
+# to the stick during normal play.
+#
+import collections
+import time
+
+clock = getattr(time, 'monotonic', time.time)
+
+# Single cell LiPo under light load, (volts, percent)
+LIPO_CURVE = [
+    (3.27, 0), (3.61, 5), (3.69, 10), (3.71, 15), (3.73, 20), (3.75, 25), (3.77, 30), (3.79, 35), (3.80, 40),
+    (3.82, 45), (3.84, 50), (3.85, 55), (3.87, 60), (3.91, 65), (3.95, 70), (3.98, 75), (4.02, 80), (4.08, 85),
+    (4.11, 90), (4.15, 95), (4.20, 100),
+]
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+# Percent for every whole voltage step between empty and full
+def chargeTable(empty, full, curve=LIPO_CURVE):
+    low, high = curve[0][0], curve[-1][0]
+    table = []
+    for volt in range(empty, full + 1):
+        # Position on the curve's voltage axis
+        position = low + (volt - empty) * (high - low) / float(max(1, full - empty))
+        for (v0, p0), (v1, p1) in zip(curve, curve[1:]):
+            if position <= v1:
+                table.append(int(round(p0 + (position - v0) * (p1 - p0) / (v1 - v0))))
+                break
+        else:
+            table.append(100)
+    return table
+
+
+class FuelGauge(object):
+
+    # Voltages in the monitor's units (centivolts)
+    def __init__(self, empty, low, full, interval=30.0, fastInterval=2.0, margin=10, alpha=0.3, history=64):
+        self.empty = empty
+        self.low = low
+        self.full = full
+        self.interval = interval
+        self.fastInterval = fastInterval
+        self.margin = margin
+        self.alpha = alpha
+        self.table = chargeTable(empty, full)
+        self.samples = collections.deque(maxlen=history)  # (time, filtered volts)
+        self.filtered = None
+
+    # New thresholds, the readings taken so far stay valid
+    def setRange(self, empty, low, full):
+        self.empty = empty
+        self.low = low
+        self.full = full
+        self.table = chargeTable(empty, full)
+
+    # Add one batch of readings, returns the filtered voltage
+    def add(self, batch, now=None):
+        if now is None:
+            now = clock()
+        value = median(batch)
+        if self.filtered is None:
+            self.filtered = float(value)
+        else:
+            self.filtered += self.alpha * (value - self.filtered)
+        self.samples.append((now, self.filtered))
+        return self.voltage()
+
+    def voltage(self):
+        return int(round(self.filtered)) if self.filtered is not None else 0
+
+    def percent(self):
+        if self.filtered is None:
+            return 0
+        volt = self.voltage()
+        if volt <= self.empty:
+            return 0
+        if volt >= self.full:
+            return 100
+        return self.table[volt - self.empty]
+
+    # Least squares slope over the buffer, volts per second
+    def slope(self):
+        if len(self.samples) < 3:
+            return None
+        start = self.samples[0][0]
+        times = [t - start for t, v in self.samples]
+        values = [v for t, v in self.samples]
+        meanTime = sum(times) / len(times)
+        meanValue = sum(values) / len(values)
+        spread = sum((t - meanTime) ** 2 for t in times)
+        if not spread:
+            return None
+        return sum((t - meanTime) * (v - meanValue) for t, v in zip(times, values)) / spread
+
+    # Seconds until the shutdown voltage at the current rate, None while the
+    # voltage isn't falling
+    def timeToEmpty(self):
+        slope = self.slope()
+        if slope is None or slope >= 0:
+            return None
+        return max(0.0, (self.filtered - self.empty) / -slope)
+
+    # Seconds until the next reading
+    def nextInterval(self):
+        if len(self.samples) < 3 or self.filtered <= self.low:
+            return self.fastInterval
+        if self.filtered <= self.low + self.margin:
+            return (self.interval + self.fastInterval) / 4.0
+        return self.interval
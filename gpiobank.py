@@ -0,0 +1,113 @@
+#
+# Whole-bank GPIO reads.
+#
+# The BCM283x level register GPLEV0 holds the state of GPIO 0-31. Mapping
+# /dev/gpiomem once lets every scan read all buttons with a single 32-bit load
+# instead of one library call per pin, and gives a consistent snapshot for
+# hotkey chords. Changed pins are found by XOR-ing against the last snapshot.
+#
+import ctypes
+import mmap
+import os
+import threading
+import time
+
+GPIOMEM = '/dev/gpiomem'
+BLOCK_SIZE = 4096
+GPLEV0 = 0x34
+
+
+def pinMask(pins):
+    mask = 0
+    for pin in pins:
+        if 0 <= pin < 32:
+            mask |= 1 << pin
+    return mask
+
+
+# Buttons are wired active low
+def isPressed(levels, pin):
+    return not (levels >> pin) & 1
+
+
+class GpioBank(object):
+
+    def __init__(self, path=GPIOMEM):
+        fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            self.mem = mmap.mmap(fd, BLOCK_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        # Peripheral registers must be read as whole words, a c_uint32 view
+        # onto the mapping does exactly one aligned 32-bit load per access
+        self.level = ctypes.c_uint32.from_buffer(self.mem, GPLEV0)
+
+    def read(self):
+        return self.level.value
+
+    def close(self):
+        del self.level
+        self.mem.close()
+
+
+# Fallback for boards without /dev/gpiomem, one library call per pin
+class PinBank(object):
+
+    def __init__(self, gpio, pins):
+        self.gpio = gpio
+        self.pins = list(pins)
+        self.others = 0xFFFFFFFF & ~pinMask(self.pins)
+
+    def read(self):
+        levels = self.others
+        for pin in self.pins:
+            if self.gpio.input(pin):
+                levels |= 1 << pin
+        return levels
+
+    def close(self):
+        pass
+
+
+# Polls the bank and reports every changed pin as an edge
+class Scanner(object):
+
+    # edge(pin, level) is called for each pin that changed
+    def __init__(self, bank, pins, edge, rate=500):
+        self.bank = bank
+        self.mask = pinMask(pins)
+        self.edge = edge
+        self.period = 1.0 / rate
+        self.levels = bank.read()
+        self.running = False
+
+    # Level of a pin in the last snapshot
+    def level(self, pin):
+        return (self.levels >> pin) & 1
+
+    def scan(self):
+        levels = self.bank.read()
+        changed = (levels ^ self.levels) & self.mask
+        self.levels = levels
+        while changed:
+            lowest = changed & -changed
+            pin = lowest.bit_length() - 1
+            changed ^= lowest
+            self.edge(pin, (levels >> pin) & 1)
+        return levels
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        worker = threading.Thread(target=self.run, name='scanner')
+        worker.daemon = True
+        worker.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            self.scan()
+            time.sleep(self.period)
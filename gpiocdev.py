@@ -0,0 +1,173 @@
+#
+# Buttons through the GPIO character device (/dev/gpiochipN, uAPI v2).
+#
+# Every button, HOTKEY and the shutdown switch are requested as one set of
+# input lines. The kernel debounces each line and timestamps every edge when
+# it happens (CLOCK_MONOTONIC, the clock time.monotonic() reads), so an edge
+# carries its level and time and nothing has to sample the pin afterwards.
+# Edges of all lines queue up on one file descriptor and are read in bulk.
+#
+# Works with any gpiochip, including the gpio-sim kernel module, so the
+# input pipeline can be exercised on any Linux box.
+#
+import ctypes
+import fcntl
+import os
+import select
+import struct
+import threading
+
+from gpiobank import pinMask
+
+DEFAULT_CHIP = '/dev/gpiochip0'
+CONSUMER = b'oneforall'
+POLL_TIMEOUT = 100  # ms, how long stop() may wait for the reader
+
+# linux/gpio.h
+LINES_MAX = 64
+NUM_ATTRS_MAX = 10
+LINE_FLAG_INPUT = 1 << 2
+LINE_FLAG_EDGE_RISING = 1 << 4
+LINE_FLAG_EDGE_FALLING = 1 << 5
+LINE_FLAG_BIAS_PULL_UP = 1 << 8
+LINE_ATTR_ID_DEBOUNCE = 3
+LINE_EVENT_RISING_EDGE = 1
+EVENT = struct.Struct('=QIIII24x')  # struct gpio_v2_line_event
+EVENT_BUFFER = 64  # edges read per system call
+
+
+class LineAttribute(ctypes.Structure):
+    _fields_ = [('id', ctypes.c_uint32), ('padding', ctypes.c_uint32), ('value', ctypes.c_uint64)]
+
+
+class LineConfigAttribute(ctypes.Structure):
+    _fields_ = [('attr', LineAttribute), ('mask', ctypes.c_uint64)]
+
+
+class LineConfig(ctypes.Structure):
+    _fields_ = [('flags', ctypes.c_uint64), ('num_attrs', ctypes.c_uint32), ('padding', ctypes.c_uint32 * 5),
+                ('attrs', LineConfigAttribute * NUM_ATTRS_MAX)]
+
+
+class LineRequestData(ctypes.Structure):
+    _fields_ = [('offsets', ctypes.c_uint32 * LINES_MAX), ('consumer', ctypes.c_char * 32), ('config', LineConfig),
+                ('num_lines', ctypes.c_uint32), ('event_buffer_size', ctypes.c_uint32),
+                ('padding', ctypes.c_uint32 * 5), ('fd', ctypes.c_int32)]
+
+
+class LineValues(ctypes.Structure):
+    _fields_ = [('bits', ctypes.c_uint64), ('mask', ctypes.c_uint64)]
+
+
+def iowr(number, structure):
+    return (3 << 30) | (ctypes.sizeof(structure) << 16) | (0xB4 << 8) | number
+
+
+GET_LINE_IOCTL = iowr(0x07, LineRequestData)
+LINE_GET_VALUES_IOCTL = iowr(0x0E, LineValues)
+
+
+# Input lines with pull-ups, both edges and kernel debounce. Doubles as a
+# bank (see gpiobank.py): read() snapshots the levels of all lines at once.
+class LineRequest(object):
+
+    # settle: {pin: seconds} kernel debounce of each pin
+    def __init__(self, pins, settle, chip=DEFAULT_CHIP):
+        self.pins = list(pins)
+        self.others = 0xFFFFFFFF & ~pinMask(self.pins)
+        periods = {}
+        for index, pin in enumerate(self.pins):
+            period = int(round(settle.get(pin, 0) * 1e6))
+            if period:
+                periods[period] = periods.get(period, 0) | 1 << index
+        if len(self.pins) > LINES_MAX or len(periods) > NUM_ATTRS_MAX:
+            raise ValueError("{}: at most {} lines and {} debounce times per request".format(
+                chip, LINES_MAX, NUM_ATTRS_MAX))
+
+        request = LineRequestData()
+        request.offsets[:len(self.pins)] = self.pins
+        request.consumer = CONSUMER
+        request.num_lines = len(self.pins)
+        request.config.flags = (LINE_FLAG_INPUT | LINE_FLAG_BIAS_PULL_UP | LINE_FLAG_EDGE_RISING |
+                                LINE_FLAG_EDGE_FALLING)
+        for index, (period, mask) in enumerate(sorted(periods.items())):
+            request.config.attrs[index].attr.id = LINE_ATTR_ID_DEBOUNCE
+            request.config.attrs[index].attr.value = period
+            request.config.attrs[index].mask = mask
+        request.config.num_attrs = len(periods)
+
+        fd = os.open(chip, os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            fcntl.ioctl(fd, GET_LINE_IOCTL, request, True)
+        finally:
+            os.close(fd)
+        self.fd = request.fd
+        self.values = LineValues(mask=(1 << len(self.pins)) - 1)
+
+    def fileno(self):
+        return self.fd
+
+    # Levels of all lines as a GPIO bank word, pins not requested read high
+    def read(self):
+        fcntl.ioctl(self.fd, LINE_GET_VALUES_IOCTL, self.values, True)
+        levels = self.others
+        bits = self.values.bits
+        for index, pin in enumerate(self.pins):
+            if bits >> index & 1:
+                levels |= 1 << pin
+        return levels
+
+    # Queued edges as (pin, level, monotonic seconds), blocks until there is one
+    def events(self):
+        data = os.read(self.fd, EVENT.size * EVENT_BUFFER)
+        edges = []
+        for offset in range(0, len(data), EVENT.size):
+            timestamp, event, line, seqno, lineSeqno = EVENT.unpack_from(data, offset)
+            edges.append((line, 1 if event == LINE_EVENT_RISING_EDGE else 0, timestamp / 1e9))
+        return edges
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+# Reports the edges of a LineRequest from its own thread
+class EdgeReader(object):
+
+    # edge(pin, level, timestamp) is called for every edge, in order
+    def __init__(self, request, edge):
+        self.request = request
+        self.edge = edge
+        levels = request.read()
+        self.levels = dict((pin, (levels >> pin) & 1) for pin in request.pins)
+        self.running = False
+        self.worker = None
+
+    # Level of a pin after the last edge reported
+    def level(self, pin):
+        return self.levels[pin]
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.worker = threading.Thread(target=self.run, name='gpiocdev')
+        self.worker.daemon = True
+        self.worker.start()
+
+    # Returns once the reader is done with the request, it can be closed then
+    def stop(self):
+        self.running = False
+        if self.worker and self.worker is not threading.current_thread():
+            self.worker.join()
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self.request.fileno(), select.POLLIN)
+        while self.running:
+            if not poller.poll(POLL_TIMEOUT):
+                continue
+            for pin, level, timestamp in self.request.events():
+                self.levels[pin] = level
+                self.edge(pin, level, timestamp)
@@ -0,0 +1,93 @@
+#
+# Hardware abstraction for the monitor.
+#
+# The monitor drives three devices: the GPIO header (RPi.GPIO API), the
+# ADS1015 (Adafruit_ADS1x15 API) and the virtual input device (python-uinput
+# API). A backend bundles one implementation of each of them:
+#
+#   hardware   the real libraries, imported lazily so nothing touches the
+#              hardware before the monitor asks for it. Input events go
+#              through python-evdev when it is installed (one write per
+#              frame, see evdevout.py) and python-uinput otherwise
+#   simulated  scripted GPIO edges, synthetic ADC waveforms and a recording
+#              uinput sink (see sim.py), runs on any Linux box. There is no
+#              display for the OSD binary, only the OSD state is published.
+#              The ADC pulses the READY_PIN it is given like ALERT/RDY would
+#
+# The backend is picked with the ONEFORALL_BACKEND environment variable or by
+# calling select() before the monitor is imported. More backends can be added
+# with register().
+#
+import os
+
+BACKEND_ENV = 'ONEFORALL_BACKEND'
+DEFAULT_BACKEND = 'hardware'
+
+
+class HardwareBackend(object):
+    name = 'hardware'
+    osd = True  # start the OSD binary
+
+    def __init__(self):
+        import RPi.GPIO
+        self.gpio = RPi.GPIO
+        self.uinput = self.output()
+
+    def output(self):
+        try:
+            import evdevout
+            return evdevout.EvdevUinput()
+        except ImportError:
+            import uinput
+            return uinput
+
+    # readyPin is where ALERT/RDY is wired, only a simulated ADC drives it
+    def ADS1015(self, readyPin=-1):
+        import Adafruit_ADS1x15
+        return Adafruit_ADS1x15.ADS1015()
+
+    # Whole-bank reads through /dev/gpiomem, per pin reads where it's missing
+    def bank(self, pins):
+        import gpiobank
+        try:
+            return gpiobank.GpioBank()
+        except (IOError, OSError):
+            return gpiobank.PinBank(self.gpio, pins)
+
+
+def hardwareBackend():
+    return HardwareBackend()
+
+
+def simulatedBackend():
+    import sim
+    return sim.SimulatedBackend()
+
+
+backends = {
+    'hardware': hardwareBackend,
+    'simulated': simulatedBackend,
+}
+
+current = None
+
+
+# Make a backend available under the given name, factory takes no arguments
+def register(name, factory):
+    backends[name] = factory
+
+
+def select(name=None):
+    global current
+    if name is None:
+        name = os.environ.get(BACKEND_ENV, DEFAULT_BACKEND)
+    if name not in backends:
+        raise ValueError("Unknown hardware backend: {}".format(name))
+    current = backends[name]()
+    return current
+
+
+def backend():
+    if current is None:
+        select()
+    return current
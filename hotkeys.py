@@ -0,0 +1,79 @@
+#
+# Hotkey chords.
+#
+# The buttons held together with HOTKEY form a chord, identified by the
+# bitmask of their GPIO pins. Chords are looked up in a table compiled from
+# keys.cfg [HOTKEYS] (see settings.py), so every input frame costs a single
+# dict lookup no matter how many hotkeys are defined. A chord fires
+#
+#   press    when it is pressed, or when it is let go before the long press
+#            time if the same chord also has a long action
+#   repeat   when it is pressed, then again and faster and faster while it
+#            is held
+#   long     once it was held for the long press time
+#
+# Repeats and long presses run on the timers of the caller's event loop,
+# nothing sleeps.
+#
+ACCELERATION = 0.8  # each repeat comes this much sooner than the one before
+
+
+class HotkeyEngine(object):
+
+    # bindings: {mask: {mode: (action, value)}}, fire(action, value) runs an
+    # action, later(delay, func) schedules func and returns a handle with
+    # cancel(). Times in seconds.
+    def __init__(self, bindings, fire, later, longPress=0.6, repeatDelay=0.4, repeatInterval=0.2,
+                 repeatMinimum=0.04):
+        self.fire = fire
+        self.later = later
+        self.chord = 0
+        self.binding = None
+        self.timer = None
+        self.interval = repeatInterval
+        self.configure(bindings, longPress, repeatDelay, repeatInterval, repeatMinimum)
+
+    def configure(self, bindings, longPress=0.6, repeatDelay=0.4, repeatInterval=0.2, repeatMinimum=0.04):
+        self.update(0)
+        self.bindings = bindings
+        self.longPress = longPress
+        self.repeatDelay = repeatDelay
+        self.repeatInterval = repeatInterval
+        self.repeatMinimum = repeatMinimum
+
+    # mask of the chord buttons held right now, 0 once HOTKEY is let go
+    def update(self, mask):
+        if mask == self.chord:
+            return
+        self.release()
+        self.chord = mask
+        self.binding = self.bindings.get(mask) if mask else None
+        if not self.binding:
+            return
+        if 'repeat' in self.binding:
+            self.fire(*self.binding['repeat'])
+            self.interval = self.repeatInterval
+            self.timer = self.later(self.repeatDelay, self.repeat)
+        elif 'long' in self.binding:
+            self.timer = self.later(self.longPress, self.held)
+        else:
+            self.fire(*self.binding['press'])
+
+    # The chord changed, a tap on a chord with a long action fires now
+    def release(self):
+        if not self.timer:
+            return
+        self.timer.cancel()
+        self.timer = None
+        if 'long' in self.binding and 'press' in self.binding:
+            self.fire(*self.binding['press'])
+
+    # REPEAT_INTERVAL after the first repeat, shorter every time after that
+    def repeat(self):
+        self.fire(*self.binding['repeat'])
+        self.timer = self.later(self.interval, self.repeat)
+        self.interval = max(self.repeatMinimum, self.interval * ACCELERATION)
+
+    def held(self):
+        self.timer = None
+        self.fire(*self.binding['long'])
@@ -0,0 +1,190 @@
+#
+# Volume control through the ALSA simple mixer API.
+#
+# AlsaMixer keeps one libasound mixer handle open for the life of the
+# monitor, so reading or stepping the volume is a couple of library calls
+# instead of a shell and an amixer process. Every change, including the ones
+# made by emulators or other tools, is reported so the cached volume is
+# always current: watch descriptors() in the event loop and call
+# handleEvents() when one is readable.
+#
+# Percentages follow amixer: rounded on read, rounded up on write.
+#
+# AmixerMixer is the fallback for systems without libasound.
+#
+import ctypes
+import ctypes.util
+import math
+import subprocess
+import threading
+
+SND_MIXER_SCHN_FRONT_LEFT = 0
+
+
+class AlsaError(OSError):
+    pass
+
+
+def loadLibrary():
+    name = ctypes.util.find_library('asound') or 'libasound.so.2'
+    lib = ctypes.CDLL(name)
+    handle = ctypes.c_void_p
+    lib.snd_mixer_open.argtypes = [ctypes.POINTER(handle), ctypes.c_int]
+    lib.snd_mixer_attach.argtypes = [handle, ctypes.c_char_p]
+    lib.snd_mixer_selem_register.argtypes = [handle, ctypes.c_void_p, ctypes.c_void_p]
+    lib.snd_mixer_load.argtypes = [handle]
+    lib.snd_mixer_close.argtypes = [handle]
+    lib.snd_mixer_handle_events.argtypes = [handle]
+    lib.snd_mixer_poll_descriptors_count.argtypes = [handle]
+    lib.snd_mixer_poll_descriptors.argtypes = [handle, ctypes.c_void_p, ctypes.c_uint]
+    lib.snd_mixer_selem_id_malloc.argtypes = [ctypes.POINTER(handle)]
+    lib.snd_mixer_selem_id_free.argtypes = [handle]
+    lib.snd_mixer_selem_id_set_index.argtypes = [handle, ctypes.c_uint]
+    lib.snd_mixer_selem_id_set_name.argtypes = [handle, ctypes.c_char_p]
+    lib.snd_mixer_find_selem.argtypes = [handle, handle]
+    lib.snd_mixer_find_selem.restype = handle
+    lib.snd_mixer_selem_get_playback_volume_range.argtypes = [handle, ctypes.POINTER(ctypes.c_long),
+                                                             ctypes.POINTER(ctypes.c_long)]
+    lib.snd_mixer_selem_get_playback_volume.argtypes = [handle, ctypes.c_int, ctypes.POINTER(ctypes.c_long)]
+    lib.snd_mixer_selem_set_playback_volume_all.argtypes = [handle, ctypes.c_long]
+    lib.snd_strerror.argtypes = [ctypes.c_int]
+    lib.snd_strerror.restype = ctypes.c_char_p
+    return lib
+
+
+class PollFd(ctypes.Structure):
+    _fields_ = [('fd', ctypes.c_int), ('events', ctypes.c_short), ('revents', ctypes.c_short)]
+
+
+class AlsaMixer(object):
+
+    # changed(percent) is called from handleEvents() on outside changes
+    def __init__(self, control='PCM', card='default', changed=None, lib=None):
+        self.lib = lib or loadLibrary()
+        self.changed = changed
+        self.lock = threading.Lock()
+        self.handle = ctypes.c_void_p()
+        self.check(self.lib.snd_mixer_open(ctypes.byref(self.handle), 0), 'open')
+        try:
+            self.check(self.lib.snd_mixer_attach(self.handle, card.encode()), 'attach ' + card)
+            self.check(self.lib.snd_mixer_selem_register(self.handle, None, None), 'register')
+            self.check(self.lib.snd_mixer_load(self.handle), 'load')
+            self.elem = self.findElement(control)
+            low = ctypes.c_long()
+            high = ctypes.c_long()
+            self.lib.snd_mixer_selem_get_playback_volume_range(self.elem, ctypes.byref(low), ctypes.byref(high))
+            self.low = low.value
+            self.range = max(1, high.value - low.value)
+        except AlsaError:
+            self.lib.snd_mixer_close(self.handle)
+            raise
+        self.raw = ctypes.c_long()
+        self.percent = self.read()
+
+    def check(self, result, what):
+        if result < 0:
+            raise AlsaError(-result, "ALSA mixer " + what + ": " + self.lib.snd_strerror(result).decode())
+        return result
+
+    def findElement(self, control):
+        sid = ctypes.c_void_p()
+        self.check(self.lib.snd_mixer_selem_id_malloc(ctypes.byref(sid)), 'selem id')
+        try:
+            self.lib.snd_mixer_selem_id_set_index(sid, 0)
+            self.lib.snd_mixer_selem_id_set_name(sid, control.encode())
+            elem = self.lib.snd_mixer_find_selem(self.handle, sid)
+        finally:
+            self.lib.snd_mixer_selem_id_free(sid)
+        if not elem:
+            raise AlsaError(2, "ALSA mixer control not found: " + control)
+        return elem
+
+    # Current hardware value, callers hold the lock
+    def read(self):
+        self.lib.snd_mixer_selem_get_playback_volume(self.elem, SND_MIXER_SCHN_FRONT_LEFT, ctypes.byref(self.raw))
+        return int(round((self.raw.value - self.low) * 100.0 / self.range))
+
+    # Last known volume in percent, kept current by handleEvents()
+    def volume(self):
+        return self.percent
+
+    def setVolume(self, percent):
+        percent = max(0, min(100, int(percent)))
+        with self.lock:
+            value = int(math.ceil(percent * self.range * 0.01 + self.low))
+            self.check(self.lib.snd_mixer_selem_set_playback_volume_all(self.elem, value), 'set volume')
+            self.percent = percent
+        return percent
+
+    def descriptors(self):
+        with self.lock:
+            count = self.lib.snd_mixer_poll_descriptors_count(self.handle)
+            fds = (PollFd * max(1, count))()
+            count = self.lib.snd_mixer_poll_descriptors(self.handle, fds, count)
+        return [(fds[index].fd, fds[index].events) for index in range(max(0, count))]
+
+    # Call when a descriptor is readable
+    def handleEvents(self):
+        with self.lock:
+            if not self.handle or self.lib.snd_mixer_handle_events(self.handle) < 0:
+                return
+            percent = self.read()
+            if percent == self.percent:
+                return
+            self.percent = percent
+        if self.changed:
+            self.changed(percent)
+
+    def close(self):
+        with self.lock:
+            if self.handle:
+                self.lib.snd_mixer_close(self.handle)
+                self.handle = ctypes.c_void_p()
+
+
+# Same interface through the amixer binary, one process per call and no events
+class AmixerMixer(object):
+
+    def __init__(self, control='PCM', card='default', changed=None):
+        self.control = control
+        self.card = card
+        self.percent = self.read()
+
+    def read(self):
+        try:
+            out = subprocess.check_output(['amixer', '-D', self.card, 'sget', self.control])
+        except (OSError, subprocess.CalledProcessError):
+            return 0
+        for line in out.decode().splitlines():
+            if '[' in line and '%]' in line:
+                return int(line.split('[')[1].split('%')[0])
+        return 0
+
+    def volume(self):
+        return self.percent
+
+    def descriptors(self):
+        return []
+
+    def handleEvents(self):
+        pass
+
+    def setVolume(self, percent):
+        percent = max(0, min(100, int(percent)))
+        try:
+            subprocess.call(['amixer', '-D', self.card, 'sset', '-q', self.control, str(percent) + '%'])
+        except OSError:
+            pass
+        self.percent = percent
+        return percent
+
+    def close(self):
+        pass
+
+
+# libasound when it can be loaded and the control exists, amixer otherwise
+def openMixer(control='PCM', card='default', changed=None):
+    try:
+        return AlsaMixer(control, card, changed)
+    except OSError:
+        return AmixerMixer(control, card, changed)
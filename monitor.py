@@ -19,21 +19,25 @@
 # You should have received a copy of the GNU General Public License
 # along with this repo. If not, see <http://www.gnu.org/licenses/>.
 #
-import Adafruit_ADS1x15
-import RPi.GPIO as gpio
+import hal
 import logging
 import logging.handlers
 import os
+import osdstate
 import re
 import signal
 import sys
 import thread
 import threading
 import time
-import uinput
-from subprocess import Popen, PIPE, check_output, check_call
+from subprocess import Popen, check_output, check_call
 import configparser
 
+# Hardware backends, see hal.py
+backend = hal.backend()
+gpio = backend.gpio
+uinput = backend.uinput
+
 # Batt variables
 voltscale = 118.0  # ADJUST THIS
 currscale = 640.0
@@ -83,7 +87,7 @@ SELECT = int(keys['SELECT'])
 START = int(keys['START'])
 HOTKEY = int(keys['HOTKEY'])
 
-RUN_MINIMAL = general['MINIMAL']
+RUN_MINIMAL = general['MINIMAL'] == 'True'
 
 if config.has_option("GENERAL", "DEBUG"):
     logging.basicConfig(filename=bin_dir + '/osd.log', level=logging.DEBUG)
@@ -163,7 +167,7 @@ if joystickConfig['ENABLE_ON_BOOT'] == 'True':
 
 # TO DO REPLACE A LOT OF OLD CALLS WITH THE CHECK_OUTPUT
 if monitoring_enabled == 'True':
-    adc = Adafruit_ADS1x15.ADS1015()
+    adc = backend.ADS1015()
 else:
     adc = False
 
@@ -222,12 +226,12 @@ device.emit(uinput.ABS_Y, VREF / 2);
 
 # Set up OSD service
 try:
+    osd_state = osdstate.OsdState()
     if joystickConfig['ENABLED'] == False:
-        osd_proc = Popen([osd_path, bin_dir, "nojoystick"], shell=False, stdin=PIPE, stdout=None, stderr=None)
+        osd_proc = Popen([osd_path, bin_dir, "nojoystick", "-s", osd_state.path], shell=False, stdout=None, stderr=None)
     else:
         logging.debug("osd full")
-        osd_proc = Popen([osd_path, bin_dir, "full"], shell=False, stdin=PIPE, stdout=None, stderr=None)
-    osd_in = osd_proc.stdin
+        osd_proc = Popen([osd_path, bin_dir, "full", "-s", osd_state.path], shell=False, stdout=None, stderr=None)
     time.sleep(1)
     osd_poll = osd_proc.poll()
     if (osd_poll):
@@ -238,10 +242,13 @@ except Exception as e:
     sys.exit(1);
 
 
-# Check for shutdown state
+# Check for shutdown state, a single low reading may be a spike so it is
+# confirmed with the median of fresh ones first
 def checkShdn(volt):
     global lowbattery
     global info
+    if volt < batt_shdn:
+        volt = sorted([readVoltage() for i in range(5)])[2]
     if volt < batt_shdn:
         lowbattery = 1
         info = 1
@@ -391,13 +398,8 @@ def doShutdown(channel=None):
 
 # Signals the OSD binary
 def updateOSD(volt=0, bat=0, temp=0, wifi=0, audio=0, lowbattery=0, info=False, charge=False, bluetooth=False):
-    commands = "v" + str(volt) + " b" + str(bat) + " t" + str(temp) + " w" + str(wifi) + " a" + str(
-		audio) + " j" + ("1 " if joystick else "0 ") + " u" + ("1 " if bluetooth else "0 ") + " l" + (
-		"1 " if lowbattery else "0 ") + " " + ("on " if info else "off ") + ("charge" if charge else "ncharge") + "\n"
-    # print commands
-    osd_proc.send_signal(signal.SIGUSR1)
-    osd_in.write(commands)
-    osd_in.flush()
+    osd_state.publish(voltage=volt, battery=bat, temperature=temp, wifi=wifi, audio=audio, joystick=joystick,
+                      bluetooth=bluetooth, low_battery=lowbattery, info=info, charge=charge)
 
 
 # Misc functions
@@ -405,7 +407,7 @@ def clamp(n, minn, maxn):
     return max(min(maxn, n), minn)
 
 
-if RUN_MINIMAL == 'False':
+if not RUN_MINIMAL:
     logging.debug("no minimal")
     condition = threading.Condition()
 
@@ -498,6 +500,7 @@ def checkJoystickInput():
 def exit_gracefully(signum=None, frame=None):
     gpio.cleanup
     osd_proc.terminate()
+    osd_state.close()
     sys.exit(0)
 
 signal.signal(signal.SIGINT, exit_gracefully)
@@ -518,15 +521,15 @@ batteryRead = 0;
 try:
     print "One For All Started"
     while 1:
-        if RUN_MINIMAL == 'False':
+        if not RUN_MINIMAL:
             condition.acquire()
         if adc != False:
             if batteryRead >= 1:
                 volt = readVoltage()
                 bat = getVoltagepercent(volt)
                 batteryRead = 0;
+                checkShdn(volt)
         batteryRead = batteryRead + 1;
-        # checkShdn(volt)
         updateOSD(volt, bat, 20, wifi, volume, lowbattery, showOverlay, charge, bluetooth)
         overrideCounter.wait(10)
         if overrideCounter.is_set():
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # sudo apt-get install python-serial
 #
 # This file originates from Vascofazza's Retropie open OSD project.
@@ -19,21 +19,42 @@
 # You should have received a copy of the GNU General Public License
 # along with this repo. If not, see <http://www.gnu.org/licenses/>.
 #
-import Adafruit_ADS1x15
-import RPi.GPIO as gpio
+import actions
+import adcsched
+import asyncio
+import autofire
 import configparser
+import debounce
+import eventloop
+import frame
+import fuelgauge
+import gpiobank
+import gpiocdev
+import hal
+import hotkeys
 import logging
 import logging.handlers
+import mixer
 import os
-import re
+import osdstate
+import poweroff
+import radio
+import settings
 import signal
+import statsserver
+import stickmap
 import sys
-import thread as thread
+import thermal
 import time
-import uinput
-# from evdev import uinput, UInput, AbsInfo, categorize, ecodes as e
-from subprocess import Popen, PIPE, check_output, check_call
-from threading import Event
+import timerwheel
+import tracer
+import wireless
+from subprocess import Popen
+
+# Hardware backends, see hal.py (ONEFORALL_BACKEND=simulated runs without a handheld)
+backend = hal.backend()
+gpio = backend.gpio
+uinput = backend.uinput
 
 # Batt variables
 voltscale = 118.0  # ADJUST THIS
@@ -45,9 +66,6 @@ dacmax = 4096.0
 
 batt_threshold = 4
 
-temperature_max = 70.0
-temperature_threshold = 5.0
-
 # BT Variables
 bt_state = 'UNKNOWN'
 
@@ -63,95 +81,70 @@ wifi_3bar = 5
 
 bin_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
 osd_path = bin_dir + '/osd/osd'
-rfkill_path = bin_dir + '/rfkill/rfkill'
-
-# Configure buttons
-config = configparser.ConfigParser()
-config.read(bin_dir + '/keys.cfg')
-keys = config['KEYS']
-general = config['GENERAL']
-LEFT = int(keys['LEFT'])
-RIGHT = int(keys['RIGHT'])
-DOWN = int(keys['DOWN'])
-UP = int(keys['UP'])
-BUTTON_A = int(keys['BUTTON_A'])
-BUTTON_B = int(keys['BUTTON_B'])
-BUTTON_X = int(keys['BUTTON_X'])
-BUTTON_Y = int(keys['BUTTON_Y'])
-BUTTON_L1 = int(keys['BUTTON_L1'])
-BUTTON_R1 = int(keys['BUTTON_R1'])
-SELECT = int(keys['SELECT'])
-START = int(keys['START'])
-HOTKEY = int(keys['HOTKEY'])
-
-if config.has_option("GENERAL", "DEBUG") and config['GENERAL']['DEBUG'] == 'True':
-    logging.basicConfig(filename=bin_dir + '/osd.log', level=logging.DEBUG)
-
-SHUTDOWN = int(general['SHUTDOWN_DETECT'])
-
-# Joystick Hardware settings
-joystickConfig = config['JOYSTICK']
-DZONE = int(joystickConfig['DEADZONE'])  # dead zone applied to joystick (mV)
-VREF = int(joystickConfig['VCC'])  # joystick Vcc (mV)
-JOYSTICK_ENABLED = joystickConfig['ENABLED']
-ENABLE_ON_BOOT = joystickConfig['ENABLE_ON_BOOT']
-
-# Battery config
-battery = config['BATTERY']
-monitoring_enabled = battery['ENABLED']
-batt_full = int(battery['FULL_BATT_VOLTAGE'])
-batt_low = int(battery['BATT_LOW_VOLTAGE'])
-batt_shdn = int(battery['BATT_SHUTDOWN_VOLT'])
-
-BUTTONS = [LEFT, RIGHT, DOWN, UP, BUTTON_A, BUTTON_B,
-           BUTTON_X, BUTTON_Y, BUTTON_L1, BUTTON_R1, SELECT, START]
-
-HOTKEYS = [LEFT, RIGHT, DOWN, UP, BUTTON_A]
-
-BOUNCE_TIME = 0.03  # Debounce time in seconds
 
-# GPIO Init
-gpio.setwarnings(False)
-gpio.setmode(gpio.BCM)
-gpio.setup(BUTTONS, gpio.IN, pull_up_down=gpio.PUD_UP)
-
-if not SHUTDOWN == -1:
-    gpio.setup(SHUTDOWN, gpio.IN, pull_up_down=gpio.PUD_UP)
-
-if JOYSTICK_ENABLED == 'True':
-    KEYS = {  # EDIT KEYCODES IN THIS TABLE TO YOUR PREFERENCES:
-        # See /usr/include/linux/input.h for keycode names
-        BUTTON_A: uinput.BTN_A,  # 'A' button
-        BUTTON_B: uinput.BTN_B,  # 'B' button
-        BUTTON_X: uinput.BTN_X,  # 'X' button
-        BUTTON_Y: uinput.BTN_Y,  # 'Y' button
-        BUTTON_L1: uinput.BTN_TL,  # 'L1' button
-        BUTTON_R1: uinput.BTN_TR,  # 'R1' button
-        SELECT: uinput.BTN_SELECT,  # 'Select' button
-        START: uinput.BTN_START,  # 'Start' button
-        UP: uinput.BTN_DPAD_UP,  # Analog up
-        DOWN: uinput.BTN_DPAD_DOWN,  # Analog down
-        LEFT: uinput.BTN_DPAD_LEFT,  # Analog left
-        RIGHT: uinput.BTN_DPAD_RIGHT,  # Analog right
-        10001: uinput.ABS_X + (0, VREF, 0, 0),
-        10002: uinput.ABS_Y + (0, VREF, 0, 0),
-    }
-else:
-    KEYS = {  # EDIT KEYCODES IN THIS TABLE TO YOUR PREFERENCES:
-        # See /usr/include/linux/input.h for keycode names
-        BUTTON_A: uinput.KEY_LEFTCTRL,  # 'A' button
-        BUTTON_B: uinput.KEY_LEFTALT,  # 'B' button
-        BUTTON_X: uinput.KEY_Z,  # 'X' button
-        BUTTON_Y: uinput.KEY_X,  # 'Y' button
-        BUTTON_L1: uinput.KEY_G,  # 'L1' button
-        BUTTON_R1: uinput.KEY_H,  # 'R1' button
-        SELECT: uinput.KEY_SPACE,  # 'Select' button
-        START: uinput.KEY_ENTER,  # 'Start' button
-        UP: uinput.KEY_UP,  # Analog up
-        DOWN: uinput.KEY_DOWN,  # Analog down
-        LEFT: uinput.KEY_LEFT,  # Analog left
-        RIGHT: uinput.KEY_RIGHT,  # Analog right
-    }
+# Configuration, typed and checked once, see settings.py. Changes to keys.cfg
+# are applied while the monitor runs.
+CONFIG_PATH = bin_dir + '/keys.cfg'
+CONFIG_SETTLE = 0.2  # seconds for an editor to finish writing keys.cfg
+config = settings.load(CONFIG_PATH)
+
+LOG_PATH = bin_dir + '/osd.log'
+if config.debug:
+    logging.basicConfig(filename=LOG_PATH, level=logging.DEBUG)
+
+# Input trace, recorded in memory and written to osd.log on SIGUSR1 or a crash
+TRACE_BUTTON = tracer.event("Pin: {}, KeyCode: {}, Pressed: {}")
+TRACE_CHORD = tracer.event("Hotkey chord: {:#x}")
+TRACE_STICK = tracer.event("Stick: ADC {} {} -> {} {}")  # only moves that go out
+
+STICK_CALIBRATION = bin_dir + '/stick.cal'  # measured stick range, written by a SIGUSR2 calibration
+CALIBRATION_TIME = 5  # seconds to sweep the stick during a calibration
+CENTER_SAMPLES = 16
+OSD_HOT_GAP = 0.25  # s between OSD updates at half the thermal scale, longer the hotter
+
+# EDIT KEYCODES IN THESE TABLES TO YOUR PREFERENCES, buttons are named as in [KEYS]
+# See /usr/include/linux/input.h for keycode names
+JOYSTICK_KEYS = {
+    'BUTTON_A': uinput.BTN_A,  # 'A' button
+    'BUTTON_B': uinput.BTN_B,  # 'B' button
+    'BUTTON_X': uinput.BTN_X,  # 'X' button
+    'BUTTON_Y': uinput.BTN_Y,  # 'Y' button
+    'BUTTON_L1': uinput.BTN_TL,  # 'L1' button
+    'BUTTON_R1': uinput.BTN_TR,  # 'R1' button
+    'SELECT': uinput.BTN_SELECT,  # 'Select' button
+    'START': uinput.BTN_START,  # 'Start' button
+    'UP': uinput.BTN_DPAD_UP,  # Analog up
+    'DOWN': uinput.BTN_DPAD_DOWN,  # Analog down
+    'LEFT': uinput.BTN_DPAD_LEFT,  # Analog left
+    'RIGHT': uinput.BTN_DPAD_RIGHT,  # Analog right
+}
+KEYBOARD_KEYS = {
+    'BUTTON_A': uinput.KEY_LEFTCTRL,  # 'A' button
+    'BUTTON_B': uinput.KEY_LEFTALT,  # 'B' button
+    'BUTTON_X': uinput.KEY_Z,  # 'X' button
+    'BUTTON_Y': uinput.KEY_X,  # 'Y' button
+    'BUTTON_L1': uinput.KEY_G,  # 'L1' button
+    'BUTTON_R1': uinput.KEY_H,  # 'R1' button
+    'SELECT': uinput.KEY_SPACE,  # 'Select' button
+    'START': uinput.KEY_ENTER,  # 'Start' button
+    'UP': uinput.KEY_UP,  # Analog up
+    'DOWN': uinput.KEY_DOWN,  # Analog down
+    'LEFT': uinput.KEY_LEFT,  # Analog left
+    'RIGHT': uinput.KEY_RIGHT,  # Analog right
+}
+
+
+# pin -> event for the current settings, the stick axes sit on pins that don't exist
+def keyMap():
+    if not config.joystickEnabled:
+        return config.keyMap(KEYBOARD_KEYS)
+    keys = config.keyMap(JOYSTICK_KEYS)
+    keys[10001] = uinput.ABS_X + (0, config.vref, 0, 0)
+    keys[10002] = uinput.ABS_Y + (0, config.vref, 0, 0)
+    return keys
+
+
+KEYS = keyMap()
 
 # Global Variables
 
@@ -173,274 +166,436 @@ volume = 1
 wifi = 2
 charge = 0
 bat = 0
-last_bat_read = 450
 joystick = False
 showOverlay = False
 lowbattery = 0
-overrideCounter = Event()
+temperature = None
+thermalScale = 1.0  # share of the normal background rates, see thermal.py
+lastStick = None
+stickCenter = (config.vref // 2, config.vref // 2)
+adcScheduler = None
+stickCalibration = None
+stickMap = None
+calibrating = None
+brownoutCheck = None
+shuttingDown = False
+shutdownPipeline = poweroff.ShutdownPipeline(config.shutdownProcesses, budget=config.shutdownBudget)
+fuelGauge = fuelgauge.FuelGauge(config.battShutdown, config.battLow, config.battFull,
+                                interval=config.batteryInterval, fastInterval=config.batteryFastInterval)
+# Event loop owning the periodic and event driven work, see eventloop.py
+daemon = eventloop.Daemon()
+osdChanged = daemon.trigger()
+actionsQueued = daemon.trigger()
+adc = False
+device = None
+emitter = None
+wifiStatus = wireless.WifiStatus(ttl=config.wifiTtl)
+thermalSensor = thermal.Thermal(config.thermalZone, config.thermalInterval)
+thermalPolicy = thermal.ThermalPolicy(config.temperatureMax, config.temperatureThreshold)
+wifiRadio = None
+bluetoothRadio = None
+volumeMixer = None
+actionQueue = None
+hotkeyEngine = None
+inputTimers = None
+turbo = None
+macroPlayer = None
+debouncer = None
+bank = None
+scanner = None
+osd_proc = None
+osd_state = None
+configWatcher = None
+configReload = None
+
+joystick = config.enableOnBoot
+
+
+# GPIO Init
+def initGpio():
+    gpio.setwarnings(False)
+    gpio.setmode(gpio.BCM)
+    # Character device lines get their pull-ups with the request
+    if config.inputMode == 'cdev':
+        return
+    gpio.setup(config.buttons, gpio.IN, pull_up_down=gpio.PUD_UP)
+
+    if not config.shutdownPin == -1:
+        gpio.setup(config.shutdownPin, gpio.IN, pull_up_down=gpio.PUD_UP)
 
-if ENABLE_ON_BOOT == 'True':
-    joystick = True
 
 # TO DO REPLACE A LOT OF OLD CALLS WITH THE CHECK_OUTPUT
-if monitoring_enabled == 'True':
-    adc = Adafruit_ADS1x15.ADS1015()
-else:
-    adc = False
+def initAdc():
+    global adc
+    global adcScheduler
+    if config.monitoring or config.joystickEnabled:
+        adc = backend.ADS1015(config.readyPin)
+        # The scheduler owns the ADC from here on, see adcsched.py
+        adcScheduler = adcsched.AdcScheduler(adc, applyJoystickInput, channels=(1, 2), rate=config.stickActiveRate,
+                                             idleRate=config.stickIdleRate, quietTime=config.stickQuietTime,
+                                             gpio=gpio, readyPin=config.readyPin)
+        configureAdc()
+        adcScheduler.start()
+        if config.joystickEnabled:
+            calibrateStick()
+    else:
+        adc = False
+
+
+# Channel settings and the brownout guard, again whenever they change
+def configureAdc():
+    adcScheduler.configure(0, gain=config.batteryGain, dataRate=config.batteryDataRate)
+    adcScheduler.configure(1, gain=2 / 3, dataRate=config.stickDataRate)
+    adcScheduler.configure(2, gain=2 / 3, dataRate=config.stickDataRate)
+    if config.monitoring:
+        adcScheduler.guard(0, batteryCode(config.battShutdown), brownout, config.batteryGuardInterval)
+
+
+# Wi-Fi and Bluetooth switches, their state is tracked in memory from here on
+def initRadios():
+    global wifiRadio
+    global bluetoothRadio
+    wifiRadio = radio.Radio(radio.TYPE_WLAN)
+    bluetoothRadio = radio.Radio(radio.TYPE_BLUETOOTH)
+
+
+# Keeps the mixer open and follows volume changes made by anyone
+def initMixer():
+    global volumeMixer
+    volumeMixer = mixer.openMixer(config.mixerControl, config.mixerCard, volumeChanged)
+    for fd, events in volumeMixer.descriptors():
+        daemon.addReader(fd, volumeMixer.handleEvents)
+
+
+# Worker for the slow hotkey actions, queued presses are merged
+def initActions():
+    global actionQueue
+    actionQueue = actions.ActionQueue(notify=actionsQueued.set)
+    actionQueue.register('volume', volumeStep, actions.accumulate)
+    actionQueue.register('wifi', toggleWifi, actions.toggle)
+    actionQueue.register('bluetooth', toggleBluetooth, actions.toggle)
+    actionQueue.register('joystick', toggleJoystick, actions.toggle)
+    actionQueue.register('calibrate', requestCalibration)
+    actionQueue.register('shutdown', requestShutdown)
+    actionQueue.register('turbo', toggleTurbo, actions.toggle)
+    actionQueue.register('macro', playMacro)
+
+
+# Chords held with HOTKEY, compiled from [HOTKEYS]
+def initHotkeys():
+    global hotkeyEngine
+    hotkeyEngine = hotkeys.HotkeyEngine(config.bindings, actionQueue.submit, daemon.later, config.longPress,
+                                        config.repeatDelay, config.repeatInterval, config.repeatMinimum)
+
 
 # Create virtual HID for Joystick
-if JOYSTICK_ENABLED == 'True':
-    device = uinput.Device(KEYS.values(), name="OneForAll-GP", version=0x3)
-else:
-    device = uinput.Device(KEYS.values(), name="OneForAll", version=0x3)
+def initDevice():
+    global device
+    global emitter
+    device = createDevice(KEYS)
+    emitter = frame.FrameEmitter(device, window=config.frameWindow)
+    emitter.start()
+
+
+# Turbo buttons and macros, timed by one timer wheel thread
+def initAutofire():
+    global inputTimers
+    global turbo
+    global macroPlayer
+    inputTimers = timerwheel.TimerWheel()
+    turbo = autofire.Turbo(inputTimers, emitFrame, config.turboRates)
+    macroPlayer = autofire.MacroPlayer(inputTimers, emitFrame)
+    inputTimers.start()
+
 
-time.sleep(1)
+# Generated changes go out as one frame
+def emitFrame(changes):
+    for event, value in changes:
+        emitter.stage(event, value)
+    emitter.flush()
+
+
+def createDevice(keys):
+    name = "OneForAll-GP" if config.joystickEnabled else "OneForAll"
+    return uinput.Device(keys.values(), name=name, version=0x3)
 
 
 def hotkeyAction(key):
-    if not gpio.input(HOTKEY):
-        if key in HOTKEYS:
+    if config.hotkey != -1 and not debouncer.level(config.hotkey):
+        if key in config.hotkeys:
             return True
 
     return False
 
 
+# GPIO callback, sample the pin and let the debouncer decide. Never sleeps.
 def handle_button(pin):
+    debouncer.edge(pin, gpio.input(pin))
+
+
+# Changed pin found by the bank scanner
+def handle_scan(pin, level):
+    debouncer.edge(pin, level)
+
+
+# Settled button change from the debouncer
+def hotkeyChanged(pressed):
     global showOverlay
-    key = KEYS[pin]
-    time.sleep(BOUNCE_TIME)
-    state = 0 if gpio.input(pin) else 1
-
-    if pin == HOTKEY:
-        if state == 1:
-            showOverlay = True
-            try:
-                checkKeyInputPowerSaving()
-            except Exception:
-                pass
-        else:
-            showOverlay = False
-            try:
-                checkKeyInputPowerSaving()
-            except Exception:
-                pass
+    showOverlay = pressed
+    checkKeyInputPowerSaving()
+
+
+def handleButtonChange(pin, level):
+    key = KEYS.get(pin)
+    state = 0 if level else 1
+
+    # Keys go straight out, everything touching the monitor state is handed
+    # over to the event loop
+    if pin == config.hotkey:
+        daemon.call(hotkeyChanged, state == 1)
 
     if not hotkeyAction(pin):
-        device.emit(key, state)
-        time.sleep(BOUNCE_TIME)
-        device.syn()
+        if key and not turbo.change(pin, key, state):
+            emitter.stage(key, state)
     else:
-        checkKeyInputPowerSaving()
+        # A turbo button let go during a chord must still stop
+        if key and not state:
+            turbo.change(pin, key, state)
+        daemon.call(checkKeyInputPowerSaving)
 
-    logging.debug("Pin: {}, KeyCode: {}, Event: {}".format(pin, key, 'press' if state else 'release'))
+    tracer.record(TRACE_BUTTON, pin, key[1] if key else 0, state)
 
 
 def handle_shutdown(pin):
-    state = 0 if gpio.input(pin) else 1
-    if (state):
-        logging.info("SHUTDOWN")
-        doShutdown()
+    shutdownChanged(gpio.input(pin))
 
 
-# Initialise Safe shutdown
-if not SHUTDOWN == -1:
-    gpio.add_event_detect(SHUTDOWN, gpio.BOTH, callback=handle_shutdown, bouncetime=1)
+def shutdownChanged(level):
+    if not level:
+        logging.info("SHUTDOWN")
+        daemon.call(shutdown)
+
 
-# Initialise Buttons
-for button in BUTTONS:
-    gpio.add_event_detect(button, gpio.BOTH, callback=handle_button, bouncetime=1)
-    logging.debug("Button: {}".format(button))
+# Edge from the character device, already debounced and timestamped by the kernel
+def handle_line(pin, level, timestamp):
+    if pin == config.shutdownPin:
+        shutdownChanged(level)
+    else:
+        debouncer.edge(pin, level, timestamp)
+
+
+def initButtons():
+    watchButtons()
+
+    # Send centering commands
+    emitter.stage(uinput.ABS_X, config.vref // 2)
+    emitter.stage(uinput.ABS_Y, config.vref // 2)
+    emitter.flush()
+
+
+def watchButtons():
+    global debouncer
+    global bank
+    global scanner
+
+    pins = config.inputPins
+    if config.inputMode == 'cdev':
+        lines = pins + ([config.shutdownPin] if config.shutdownPin != -1 else [])
+        settle = dict((pin, config.bounceTimes.get(pin, config.bounceTime)) for pin in lines)
+        bank = gpiocdev.LineRequest(lines, settle, config.gpioChip)
+        scanner = gpiocdev.EdgeReader(bank, handle_line)
+        # The kernel debounced the edges already, this only tracks the levels
+        debouncer = debounce.Debouncer(pins, scanner.level, handleButtonChange, settle=0)
+        debouncer.start()
+        scanner.start()
+        return
+
+    # Initialise Safe shutdown
+    if not config.shutdownPin == -1:
+        gpio.add_event_detect(config.shutdownPin, gpio.BOTH, callback=handle_shutdown, bouncetime=1)
+
+    # Initialise Buttons
+    if config.hotkey != -1 and config.hotkey not in config.buttons:
+        gpio.setup(config.hotkey, gpio.IN, pull_up_down=gpio.PUD_UP)
+
+    bank = backend.bank(pins)
+
+    if config.inputMode == 'scan':
+        scanner = gpiobank.Scanner(bank, pins, handle_scan, rate=config.scanRate)
+        debouncer = debounce.Debouncer(pins, scanner.level, handleButtonChange,
+                                       settle=config.bounceTime, settleTimes=config.bounceTimes)
+        debouncer.start()
+        scanner.start()
+    else:
+        scanner = None
+        debouncer = debounce.Debouncer(pins, gpio.input, handleButtonChange,
+                                       settle=config.bounceTime, settleTimes=config.bounceTimes)
+        debouncer.start()
 
-if not HOTKEY in BUTTONS:
-    if HOTKEY != -1:
-        gpio.setup(HOTKEY, gpio.IN, pull_up_down=gpio.PUD_UP)
-        gpio.add_event_detect(HOTKEY, gpio.BOTH, callback=handle_button, bouncetime=1)
+        for button in pins:
+            gpio.add_event_detect(button, gpio.BOTH, callback=handle_button, bouncetime=1)
+            logging.debug("Button: {}".format(button))
 
-# Send centering commands
-device.emit(uinput.ABS_X, VREF / 2, syn=False);
-device.emit(uinput.ABS_Y, VREF / 2);
 
-# Set up OSD service
-try:
-    if JOYSTICK_ENABLED == 'False':
-        osd_proc = Popen([osd_path, bin_dir, "nojoystick"], shell=False, stdin=PIPE, stdout=None, stderr=None)
-    else:
-        osd_proc = Popen([osd_path, bin_dir, "full"], shell=False, stdin=PIPE, stdout=None, stderr=None)
-    osd_in = osd_proc.stdin
-    time.sleep(1)
-    osd_poll = osd_proc.poll()
-    if (osd_poll):
-        logging.error("ERROR: Failed to start OSD, got return code [" + str(osd_poll) + "]\n")
-        sys.exit(1)
-except Exception as e:
-    logging.exception("ERROR: Failed start OSD binary");
-    sys.exit(1);
+# Undo watchButtons() for the settings it was called with
+def unwatchButtons(previous):
+    if scanner:
+        scanner.stop()
+    debouncer.stop()
+    if previous.inputMode == 'edge':
+        for button in previous.inputPins:
+            gpio.remove_event_detect(button)
+    if previous.shutdownPin != -1 and previous.inputMode != 'cdev':
+        gpio.remove_event_detect(previous.shutdownPin)
+    bank.close()
 
 
-# Check for shutdown state
+# Set up OSD service
+def startOSD():
+    global osd_proc
+    global osd_state
+    try:
+        osd_state = osdstate.OsdState()
+        if not getattr(backend, 'osd', True):
+            logging.info("No OSD with the " + backend.name + " backend")
+            return
+        if not os.path.exists(osd_path):
+            logging.error("ERROR: No OSD binary at " + osd_path + ", build it with make")
+            sys.exit(1)
+        mode = "full" if config.joystickEnabled else "nojoystick"
+        osd_proc = Popen([osd_path, bin_dir, mode, "-s", osd_state.path], shell=False, stdout=None, stderr=None)
+        time.sleep(1)
+        osd_poll = osd_proc.poll()
+        if (osd_poll):
+            logging.error("ERROR: Failed to start OSD, got return code [" + str(osd_poll) + "]\n")
+            sys.exit(1)
+    except Exception:
+        logging.exception("ERROR: Failed start OSD binary");
+        sys.exit(1);
+
+
+# Check for low battery and shutdown state
 def checkShdn(volt):
     global lowbattery
     global info
-    if volt < batt_shdn:
+    lowbattery = 1 if volt < config.battLow else 0
+    if volt < config.battShutdown:
         lowbattery = 1
         info = 1
-        overrideCounter.set()
-        doShutdown()
+        osdChanged.set()
+        shutdown()
+
 
+# Battery voltage from a raw channel 0 reading, filtering is up to the fuel gauge.
+# The ADS1015 full-scale range shrinks with the gain, 4.09V at gain 1.
+def batteryVoltage(voltVal):
+    return int((float(voltVal) * (settings.BATTERY_FULL_SCALE / config.batteryGain / 2047.0)) * 100)
 
-# Read voltage
-def readVoltage():
-    global last_bat_read;
-    voltVal = adc.read_adc(0, gain=1);
-    volt = int((float(voltVal) * (4.09 / 2047.0)) * 100)
 
-    if volt < 300 or (last_bat_read > 300 and last_bat_read - volt > 6 and not last_bat_read == 450):
-        volt = last_bat_read;
+# Smallest raw channel 0 reading that is still at least volt
+def batteryCode(volt):
+    code = int(volt / 100.0 * 2047.0 * config.batteryGain / settings.BATTERY_FULL_SCALE)
+    while batteryVoltage(code) < volt:
+        code += 1
+    return code
 
-    last_bat_read = volt;
 
-    return volt
+# The ADC saw the battery drop below BATT_SHUTDOWN_VOLT, called from the GPIO
+# or ADC thread. A single conversion may be a spike, so confirm first.
+def brownout(value):
+    daemon.call(confirmBrownout)
 
 
-# Get voltage percent
-def getVoltagepercent(volt):
-    return clamp(int(float(volt - batt_shdn) / float(batt_full - batt_shdn) * 100), 0, 100)
+def confirmBrownout():
+    global brownoutCheck
+    if shuttingDown or brownoutCheck and not brownoutCheck.done():
+        return
+    brownoutCheck = daemon.spawn(checkBrownout(), 'brownout')
 
 
 def readVolumeLevel():
-    process = os.popen("amixer | awk -F'[][]' '/Left:|Mono:/ { print $2 }'")
-    res = process.readline()
-    process.close()
+    return volumeMixer.volume()
 
-    vol = 0;
-    try:
-        vol = int(res.replace("%", "").replace("'C\n", ""))
-    except Exception as e:
-        logging.info("Audio Err    : " + str(e))
 
-    return vol;
+# Volume changed outside the monitor (emulator, amixer, ...)
+def volumeChanged(level):
+    global volume
+    volume = level
+    osdChanged.set()
+
 
+# Flip a radio switch, the OSD shows whatever state the kernel reports back
+def toggleRadio(radioSwitch, name):
+    logging.info(name + "[" + ("ENABLING" if radioSwitch.blocked else "DISABLING") + "]")
+    try:
+        radioSwitch.toggle()
+    except (IOError, OSError) as e:
+        logging.info(name + ": " + str(e))
 
-# Read wifi (Credits: kite's SAIO project) Modified to only read, not set wifi.
+
+# Read wifi (Credits: kite's SAIO project)
 def readModeWifi(toggle=False):
-    ret = 0;
-    wifiVal = not os.path.exists(osd_path + 'wifi')  # int(ser.readline().rstrip('\r\n'))
-    if toggle:
-        wifiVal = not wifiVal
     global wifi_state
-    if (wifiVal):
-        if os.path.exists(osd_path + 'wifi'):
-            os.remove(osd_path + 'wifi')
-        if (wifi_state != 'ON'):
-            wifi_state = 'ON'
-            logging.info("Wifi    [ENABLING]")
-            try:
-                out = check_output(['sudo', rfkill_path, 'unblock', 'wifi'])
-                logging.info("Wifi    [" + str(out) + "]")
-            except Exception as e:
-                logging.info("Wifi    : " + str(e))
-                ret = wifi_warning  # Get signal strength
-
-    else:
-        with open(osd_path + 'wifi', 'a'):
-            n = 1
-        if (wifi_state != 'OFF'):
-            wifi_state = 'OFF'
-            logging.info("Wifi    [DISABLING]")
-            try:
-                out = check_output(['sudo', rfkill_path, 'block', 'wifi'])
-                logging.info("Wifi    [" + str(out) + "]")
-            except Exception as e:
-                logging.info("Wifi    : " + str(e))
-                ret = wifi_error
-        return ret
-    # check signal
-    raw = check_output(['cat', '/proc/net/wireless'])
-    strengthObj = re.search(r'.wlan0: \d*\s*(\d*)\.\s*[-]?(\d*)\.', raw, re.I)
-    if strengthObj:
-        strength = 0
-        if (int(strengthObj.group(1)) > 0):
-            strength = int(strengthObj.group(1))
-        elif (int(strengthObj.group(2)) > 0):
-            strength = int(strengthObj.group(2))
-        logging.info("Wifi    [" + str(strength) + "]strength")
-        if (strength > 55):
-            ret = wifi_3bar
-        elif (strength > 40):
-            ret = wifi_2bar
-        elif (strength > 5):
-            ret = wifi_1bar
-        else:
-            ret = wifi_warning
+    if toggle:
+        toggleRadio(wifiRadio, "Wifi    ")
     else:
-        logging.info("Wifi    [---]strength")
-        ret = wifi_error
-    return ret
+        wifiRadio.sync()
+    if wifiRadio.blocked:
+        wifi_state = 'OFF'
+        return wifi_off
+    wifi_state = 'ON'
+    wifiStatus.invalidate()
+    return readWifiSignal()
+
+
+# Signal bars from the cached link quality, cheap enough for every OSD update
+def readWifiSignal():
+    strength = wifiStatus.strength(config.wifiInterfaces)
+    if strength is None:
+        logging.debug("Wifi    [---]strength")
+        return wifi_error
+    logging.debug("Wifi    [%s]strength", strength)
+    if (strength > 55):
+        return wifi_3bar
+    elif (strength > 40):
+        return wifi_2bar
+    elif (strength > 5):
+        return wifi_1bar
+    return wifi_warning
 
 
 def readModeBluetooth(toggle=False):
-    ret = 0;
-    BtVal = not os.path.exists(osd_path + 'bluetooth')  # int(ser.readline().rstrip('\r\n'))
-    if toggle:
-        BtVal = not BtVal
     global bt_state
-    if (BtVal):
-        if os.path.exists(osd_path + 'bluetooth'):
-            os.remove(osd_path + 'bluetooth')
-        if (bt_state != 'ON'):
-            bt_state = 'ON'
-            logging.info("BT    [ENABLING]")
-            try:
-                out = check_output(['sudo', rfkill_path, 'unblock', 'bluetooth'])
-                logging.info("BT      [" + str(out) + "]")
-            except Exception as e:
-                logging.info("BT    : " + str(e))
-                ret = wifi_warning  # Get signal strength
-
+    if toggle:
+        toggleRadio(bluetoothRadio, "BT      ")
     else:
-        with open(osd_path + 'bluetooth', 'a'):
-            n = 1
-        if (bt_state != 'OFF'):
-            bt_state = 'OFF'
-            logging.info("BT    [DISABLING]")
-            try:
-                out = check_output(['sudo', rfkill_path, 'block', 'bluetooth'])
-                logging.info("BT      [" + str(out) + "]")
-            except Exception as e:
-                logging.info("BT    : " + str(e))
-                ret = wifi_error
-        return ret
-    # check if it's enabled
-    raw = check_output(['hcitool', 'dev'])
-    return True if raw.find("hci0") > -1 else False
-
-
-# Do a shutdown
+        bluetoothRadio.sync()
+    if bluetoothRadio.blocked:
+        bt_state = 'OFF'
+        return False
+    bt_state = 'ON'
+    # check if a controller is up
+    return radio.bluetoothPresent()
+
+
+# Do a shutdown, blocks so it runs on the executor. See poweroff.py
 def doShutdown(channel=None):
-    check_call("sudo killall emulationstation", shell=True)
-    time.sleep(1)
-    check_call("sudo shutdown -h now", shell=True)
-    try:
-        sys.stdout.close()
-    except:
-        pass
-    try:
-        sys.stderr.close()
-    except:
-        pass
-    sys.exit(0)
+    shutdownPipeline.run()
+    daemon.stop()
+
+
+def shutdown():
+    global shuttingDown
+    if shuttingDown:
+        return
+    shuttingDown = True
+    daemon.spawn(daemon.offload(doShutdown), 'shutdown')
 
 
 # Signals the OSD binary
 def updateOSD(volt=0, bat=0, temp=0, wifi=0, audio=0, lowbattery=0, info=False, charge=False, bluetooth=False):
-    commands = "v" + str(volt) + " b" + str(bat) + " t" + str(temp) + " w" + str(wifi) + " a" + str(
-        audio) + " j" + ("1 " if joystick else "0 ") + " u" + ("1 " if bluetooth else "0 ") + " l" + (
-                   "1 " if lowbattery else "0 ") + " " + ("on " if info else "off ") + (
-                   "charge" if charge else "ncharge") + "\n"
-    # print commands
-    osd_proc.send_signal(signal.SIGUSR1)
-    osd_in.write(commands)
-    osd_in.flush()
+    osd_state.publish(voltage=volt, battery=bat, temperature=temp, wifi=wifi, audio=audio, joystick=joystick,
+                      bluetooth=bluetooth, low_battery=lowbattery, info=info, charge=charge)
 
 
 # Misc functions
@@ -448,121 +603,416 @@ def clamp(n, minn, maxn):
     return max(min(maxn, n), minn)
 
 
-def volumeUp():
+# Hotkey actions, run on the executor with the merged intent. steps is
+# the sum of all queued presses, +1 up and -1 down
+def volumeStep(steps):
     global volume
-    volume = min(100, volume + 10)
-    os.system("amixer sset -q 'PCM' " + str(volume) + "%")
+    volume = volumeMixer.setVolume(max(0, min(100, volume + 10 * steps)))
+    osdChanged.set()
 
 
-def volumeDown():
-    global volume
-    volume = max(0, volume - 10)
-    os.system("amixer sset -q 'PCM' " + str(volume) + "%")
+def toggleWifi(value):
+    global wifi
+    wifi = readModeWifi(True)
+    osdChanged.set()
 
 
-def inputReading():
-    global volume
-    global wifi
-    global info
-    global volt
-    global bat
-    global charge
+def toggleBluetooth(value):
+    global bluetooth
+    bluetooth = readModeBluetooth(True)
+    osdChanged.set()
+
+
+def requestCalibration(value):
+    daemon.call(startCalibration)
+
+
+def requestShutdown(value):
+    logging.info("SHUTDOWN")
+    daemon.call(shutdown)
+
+
+def toggleTurbo(value):
+    turbo.setEnabled(not turbo.enabled)
+    logging.info("Turbo   [" + ("ON" if turbo.enabled else "OFF") + "]")
+
+
+# Steps name buttons, the events come from the current key map
+def playMacro(name):
+    steps = [(tuple(KEYS[config.pins[button]] for button in buttons), seconds)
+             for buttons, seconds in config.macros[name]]
+    macroPlayer.play(steps)
+
+
+def toggleJoystick(value):
     global joystick
-    while (1):
-        if joystick == True:
-            checkJoystickInput()
-        time.sleep(.05)
+    joystick = not joystick
+    # Without [JOYSTICK] ENABLED the stick was never calibrated and the
+    # device has no axes
+    if config.joystickEnabled:
+        if joystick:
+            adcScheduler.startStick()
+        else:
+            adcScheduler.stopStick()
+    osdChanged.set()
 
 
-def checkKeyInputPowerSaving():
-    global info
+# Event loop tasks. The battery is converted in the next gaps the ADC
+# scheduler finds between stick samples
+async def readBatteryBatch():
+    futures = []
+    for _ in range(config.batteryBatch):
+        future, done = daemon.pending()
+        adcScheduler.request(0, done)
+        futures.append(future)
+    return await asyncio.gather(*futures)
+
+
+async def readBattery():
+    global volt
+    global bat
+    while True:
+        readings = await readBatteryBatch()
+        volt = fuelGauge.add([batteryVoltage(reading) for reading in readings])
+        bat = fuelGauge.percent()
+        logging.debug("Battery [%s] %s%% %ss left", volt, bat, fuelGauge.timeToEmpty())
+        checkShdn(volt)
+        osdChanged.set()
+        await asyncio.sleep(fuelGauge.nextInterval() / thermalScale)
+
+
+# SoC temperature for the OSD state, background rates follow the thermal
+# policy. The OSD doesn't draw it, so publishing it alone doesn't wake the OSD.
+async def readTemperature():
+    global temperature
+    global thermalScale
+    while True:
+        reading = await daemon.offload(thermalSensor.read)
+        if reading != temperature:
+            temperature = reading
+            osdChanged.set()
+        scale = thermalPolicy.scale(temperature)
+        if scale != thermalScale:
+            logging.info("Thermal [{}C] background work at {:.0%}".format(temperature, scale))
+            thermalScale = scale
+            applyStickRates()
+        await asyncio.sleep(thermalSensor.interval)
+
+
+def applyStickRates():
+    if adcScheduler:
+        adcScheduler.setRates(config.stickActiveRate * thermalScale, config.stickIdleRate * thermalScale,
+                              config.stickQuietTime)
+
+
+# Fresh batch without the fuel gauge's smoothing, which would hide the drop
+async def checkBrownout():
+    readings = await readBatteryBatch()
+    level = batteryVoltage(fuelgauge.median(readings))
+    logging.info("Battery alert, now at [{}]".format(level))
+    if level < config.battShutdown:
+        checkShdn(level)
+
+
+async def runActions():
+    while True:
+        await actionsQueued.wait()
+        actionsQueued.reset()
+        await daemon.offload(actionQueue.drain)
+
+
+# Publishes the HUD state, only wakes up when something changed
+async def publishOSD():
     global wifi
-    global joystick
     global bluetooth
-    global bat
-    global volume
-    global volt
-    global showOverlay
+    while True:
+        osdChanged.reset()
+        if wifi_state == 'ON':
+            wifi = readWifiSignal()
+        # controllers show up a moment after an unblock
+        bluetooth = readModeBluetooth()
+        updateOSD(volt, bat, temperature or 0, wifi, volume, lowbattery, info, charge, bluetooth)
+        if thermalScale < 1:
+            await asyncio.sleep(OSD_HOT_GAP * (1 / thermalScale - 1))
+        await osdChanged.wait()
+
+
+# Only queues the hotkey intent, the actions run on the executor
+def checkKeyInputPowerSaving():
+    global info
 
     info = showOverlay
-    overrideCounter.set()
-
-    # TODO Convert to state
-    if not gpio.input(HOTKEY):
-        if not gpio.input(UP):
-            volumeUp()
-            time.sleep(0.5)
-        elif not gpio.input(DOWN):
-            volumeDown()
-            time.sleep(0.5)
-        elif not gpio.input(LEFT):
-            wifi = readModeWifi(True)
-            time.sleep(0.5)
-        elif not gpio.input(RIGHT):
-            joystick = not joystick
-            time.sleep(0.5)
-        elif not gpio.input(BUTTON_A):
-            bluetooth = readModeBluetooth(True)
-            time.sleep(0.5)
+    osdChanged.set()
 
+    # One snapshot of every button for the whole chord
+    levels = bank.read()
+    chord = ~levels & config.hotkeyMask if gpiobank.isPressed(levels, config.hotkey) else 0
+    tracer.record(TRACE_CHORD, chord)
+    hotkeyEngine.update(chord)
 
+
+# One stick sample outside the scheduler's clock
 def checkJoystickInput():
-    an1 = adc.read_adc(2, gain=2 / 3);
-    an0 = adc.read_adc(1, gain=2 / 3);
+    adcScheduler.sampleStick()
 
-    logging.debug("X: {} | Y: {}".format(an0, an1))
-    logging.debug("Above: {} | Below: {}".format((VREF / 2 + DZONE), (VREF / 2 - DZONE)))
 
-    # Check and apply joystick states
-    if (an0 > ((VREF / 2 + DZONE)) or (an0 < (VREF / 2 - DZONE))) and an0 <= VREF:
-        val = an0 - 100 - 200 * (an0 < VREF / 2 - DZONE) + 200 * (an0 > VREF / 2 + DZONE)
-        device.emit(uinput.ABS_X, val, syn=False)
-    else:
-        # Center the sticks if within deadzone
-        device.emit(uinput.ABS_X, VREF / 2, syn=False)
+# Returns True when the stick moved, the ADC scheduler slows down otherwise
+def applyJoystickInput(an0, an1):
+    global lastStick
 
-    if ((an1 > (VREF / 2 + DZONE)) or (an1 < (VREF / 2 - DZONE))) and an1 <= VREF:
-        valy = an1 + 100 - 200 * (an1 < VREF / 2 - DZONE) + 200 * (an1 > VREF / 2 + DZONE)
-        device.emit(uinput.ABS_Y, valy)
-    else:
-        # Center the sticks if within deadzone
-        device.emit(uinput.ABS_Y, VREF / 2)
+    if calibrating:
+        calibrating.extend((an0, an1))
+
+    if stickMap is None:
+        return False
+
+    # Calibration, deadzone and response curve are all in the table
+    stick = stickMap.lookup(an0, an1)
 
+    # Nothing moved (or just jitter), don't wake up the emulator. Coming back
+    # to the center always goes out.
+    if stick == lastStick:
+        return False
+    if lastStick and stick != stickCenter and abs(stick[0] - lastStick[0]) < config.stickThreshold and \
+            abs(stick[1] - lastStick[1]) < config.stickThreshold:
+        return False
+    lastStick = stick
+    tracer.record(TRACE_STICK, an0, an1, stick[0], stick[1])
 
-def exit_gracefully(signum=None, frame=None):
-    gpio.cleanup
-    osd_proc.terminate()
-    sys.exit(0)
+    # Both axes and any pending buttons go out as one frame
+    emitter.stage(uinput.ABS_X, stick[0])
+    emitter.stage(uinput.ABS_Y, stick[1])
+    emitter.flush()
+    return True
 
 
-signal.signal(signal.SIGINT, exit_gracefully)
-signal.signal(signal.SIGTERM, exit_gracefully)
+def buildStickMap(calibration):
+    return stickmap.StickMap(calibration, deadzone=config.deadzone / (config.vref / 2.0), curve=config.curve,
+                             center=config.vref // 2, reach=config.vref // 2)
 
-# Read Initial States
-volume = readVolumeLevel()
 
-wifi = readModeWifi()
-bluetooth = bluetooth = readModeBluetooth()
+# Rest position measured now, range from the last calibration
+def calibrateStick():
+    global stickCalibration
+    global stickMap
+    try:
+        stickCalibration = stickmap.Calibration.load(STICK_CALIBRATION)
+    except (IOError, OSError, ValueError, KeyError):
+        stickCalibration = stickmap.Calibration.nominal(config.vref)
+    try:
+        stickCalibration.recenter([adcScheduler.readStick() for _ in range(CENTER_SAMPLES)])
+    except (IOError, OSError) as e:
+        logging.info("Stick calibration: " + str(e))
+    stickMap = buildStickMap(stickCalibration)
+
+
+# SIGUSR1: the input trace goes to osd.log, off the loop
+def dumpTrace():
+    daemon.spawn(daemon.offload(tracer.dump, LOG_PATH), 'trace dump')
+
+
+# SIGUSR2: sweep the stick around its full range, then let go of it
+def startCalibration():
+    global calibrating
+    if calibrating or not stickCalibration:
+        return
+    logging.info("Stick calibration: move the stick around its full range, then release it")
+    calibrating = stickCalibration.collapsed()
+    daemon.spawn(finishCalibration(), 'calibration')
+
+
+async def finishCalibration():
+    global calibrating
+    global stickCalibration
+    global stickMap
+    await asyncio.sleep(CALIBRATION_TIME)
+    session, calibrating = calibrating, None
+    stickMap = await daemon.offload(recalibrate, session)
+    stickCalibration = session
+
+
+# Axes that were barely moved keep their previous range
+def recalibrate(session):
+    for axis, previous in zip(session.axes, stickCalibration.axes):
+        if axis[2] - axis[0] < config.vref // 4:
+            axis[0], axis[2] = previous[0], previous[2]
+    session.recenter([adcScheduler.readStick() for _ in range(CENTER_SAMPLES)])
+    try:
+        session.save(STICK_CALIBRATION)
+    except (IOError, OSError) as e:
+        logging.info("Stick calibration: " + str(e))
+    logging.info("Stick calibration: " + str(session.axes))
+    return buildStickMap(session)
+
+
+# Follow keys.cfg, without inotify the settings stay as they were loaded
+def initConfigWatch():
+    global configWatcher
+    try:
+        configWatcher = settings.ConfigWatcher(CONFIG_PATH)
+    except OSError as e:
+        logging.info("keys.cfg is not watched: " + str(e))
+        return
+    daemon.addReader(configWatcher.fileno(), configChanged)
+
 
-if JOYSTICK_ENABLED == 'True':
-    inputReadingThread = thread.start_new_thread(inputReading, ())
+# Editors write in several steps, reload once they are quiet
+def configChanged():
+    global configReload
+    if not configWatcher.changed():
+        return
+    if configReload:
+        configReload.cancel()
+    configReload = daemon.later(CONFIG_SETTLE, reloadConfig)
 
-try:
-    while 1:
+
+def reloadConfig():
+    global config
+    try:
+        loaded = settings.load(CONFIG_PATH)
+    except (IOError, OSError, configparser.Error, settings.ConfigError) as e:
+        logging.error("keys.cfg not applied: " + str(e))
+        return
+    changed = config.diff(loaded)
+    fixed = changed & settings.RESTART
+    if fixed:
+        logging.warning("keys.cfg: " + ", ".join(sorted(fixed)) + " apply after a restart")
+        loaded.keep(config, fixed)
+        changed -= fixed
+    if not changed:
+        return
+    logging.info("keys.cfg: applying " + ", ".join(sorted(changed)))
+    previous, config = config, loaded
+    # The ADC goes first, nothing else changes if it refuses the settings
+    if adcScheduler:
         try:
-            if not adc == False:
-                volt = readVoltage()
-                bat = getVoltagepercent(volt)
-            checkShdn(volt)
-            updateOSD(volt, bat, 20, wifi, volume, lowbattery, info, charge, bluetooth)
-            overrideCounter.wait(10)
-            if overrideCounter.is_set():
-                overrideCounter.clear()
-            runCounter = 0;
-
-        except Exception:
-            logging.info("EXCEPTION")
-            pass
-
-except KeyboardInterrupt:
-    exit_gracefully()
+            configureAdc()
+        except ValueError as e:
+            logging.error("keys.cfg not applied: " + str(e))
+            config = previous
+            configureAdc()
+            return
+    applyConfig(previous, changed)
+
+
+# Bring everything that was set up from previous in line with config
+def applyConfig(previous, changed):
+    global KEYS
+    global device
+    global stickCenter
+    keys = keyMap()
+    # Emulators lose a recreated device, so only when its capabilities changed
+    if set(keys.values()) != set(KEYS.values()):
+        device = createDevice(keys)
+        emitter.setDevice(device).destroy()
+    KEYS = keys
+    if changed & {'pins', 'hotkey', 'shutdownPin', 'inputMode', 'scanRate', 'gpioChip', 'bounceTime',
+                  'bounceTimes'}:
+        unwatchButtons(previous)
+        initGpio()
+        watchButtons()
+    emitter.window = config.frameWindow
+    emitter.start()
+    turbo.configure(config.turboRates)
+    hotkeyEngine.configure(config.bindings, config.longPress, config.repeatDelay, config.repeatInterval,
+                           config.repeatMinimum)
+    wifiStatus.ttl = config.wifiTtl
+    shutdownPipeline.processes = config.shutdownProcesses
+    shutdownPipeline.budget = config.shutdownBudget
+    fuelGauge.setRange(config.battShutdown, config.battLow, config.battFull)
+    fuelGauge.interval = config.batteryInterval
+    fuelGauge.fastInterval = config.batteryFastInterval
+    applyStickRates()
+    thermalSensor.interval = config.thermalInterval
+    if 'thermalZone' in changed:
+        thermalSensor.close()
+        thermalSensor.path = config.thermalZone or thermal.findZone()
+    thermalPolicy.maximum = config.temperatureMax
+    thermalPolicy.threshold = config.temperatureThreshold
+    stickCenter = (config.vref // 2, config.vref // 2)
+    if 'traceSize' in changed:
+        tracer.configure(config.traceSize)
+    if changed & {'deadzone', 'curve', 'vref'} and stickCalibration:
+        daemon.spawn(rebuildStickMap(), 'stick map')
+    osdChanged.set()
+
+
+async def rebuildStickMap():
+    global stickMap
+    stickMap = await daemon.offload(buildStickMap, stickCalibration)
+
+
+# Runs once the event loop stopped
+def cleanup():
+    if scanner:
+        scanner.stop()
+    if debouncer:
+        debouncer.stop()
+    if macroPlayer:
+        macroPlayer.stop()
+    if inputTimers:
+        inputTimers.stop()
+    thermalSensor.close()
+    if emitter:
+        emitter.stop()
+    if adcScheduler:
+        adcScheduler.close()
+    if wifiRadio:
+        wifiRadio.close()
+    if bluetoothRadio:
+        bluetoothRadio.close()
+    if volumeMixer:
+        volumeMixer.close()
+    if configWatcher:
+        configWatcher.close()
+    gpio.cleanup()
+    if osd_proc:
+        osd_proc.terminate()
+    osd_state.close()
+
+
+def main():
+    global volume
+    global wifi
+    global bluetooth
+
+    tracer.configure(config.traceSize)
+    tracer.dumpOnCrash(LOG_PATH)
+    initGpio()
+    initAdc()
+    initRadios()
+    initMixer()
+    initActions()
+    initHotkeys()
+    initDevice()
+    initAutofire()
+    time.sleep(1)
+    initButtons()
+    startOSD()
+    initConfigWatch()
+    daemon.atExit(cleanup)
+
+    # Read Initial States
+    volume = readVolumeLevel()
+
+    wifi = readModeWifi()
+    bluetooth = readModeBluetooth()
+
+    daemon.onSignal(signal.SIGUSR1, dumpTrace)
+    if config.joystickEnabled:
+        daemon.onSignal(signal.SIGUSR2, startCalibration)
+        if joystick:
+            adcScheduler.startStick()
+
+    if config.monitoring:
+        daemon.spawn(readBattery(), 'battery')
+    daemon.spawn(runActions(), 'actions')
+    daemon.spawn(readTemperature(), 'thermal')
+    daemon.spawn(publishOSD(), 'osd')
+    if config.statsSocket:
+        daemon.spawn(statsserver.serve(config.statsSocket), 'stats')
+    daemon.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -25,13 +25,20 @@
 #define _GNU_SOURCE
 
 #include <assert.h>
+#include <fcntl.h>
 #include <stdbool.h>
 #include <stdio.h>
 #include <limits.h>
+#include <sched.h>
+#include <signal.h>
 #include <stdlib.h>
+#include <string.h>
 #include <unistd.h>
 #include <time.h>
 #include <strings.h>
+#include <linux/futex.h>
+#include <sys/mman.h>
+#include <sys/syscall.h>
 #include "font.h"
 #include "imageGraphics.h"
 #include "imageLayer.h"
@@ -40,6 +47,7 @@
 #include <math.h>
 
 #include "bcm_host.h"
+#include "osdstate.h"
 
 //-------------------------------------------------------------------------
 
@@ -52,6 +60,19 @@
 #define JOYSTICK_IMAGE "./resources/joystick.png"
 #define BLUETOOTH_IMAGE "./resources/bluetooth.png"
 #define BATTERY_TH 20
+#define OSD_STATE_PATH "/dev/shm/oneforall-osd"
+#define REFRESH_SECONDS 10
+
+// Layers that need redrawing after a state change
+#define DIRTY_BATTERY (1 << 0)
+#define DIRTY_CHARGE (1 << 1)
+#define DIRTY_WIFI (1 << 2)
+#define DIRTY_AUDIO (1 << 3)
+#define DIRTY_JOYSTICK (1 << 4)
+#define DIRTY_BLUETOOTH (1 << 5)
+#define DIRTY_INFO_IMAGE (1 << 6)
+#define DIRTY_INFO_TEXT (1 << 7)
+#define DIRTY_ALL 0xFF
 #define AUDIO_IMAGES (const char*[5]){"./resources/AUD0.png","./resources/AUD25.png","./resources/AUD50.png","./resources/AUD75.png","./resources/AUD100.png"}
 #define WIFI_IMAGES (const char*[5]){"./resources/wifi_warning.png", "./resources/wifi_error.png", "./resources/wifi_1.png", "./resources/wifi_2.png", "./resources/wifi_3.png"}
 
@@ -64,12 +85,16 @@ static RGBA8_T backgroundColour = { 0, 0, 0, 100 };
 static RGBA8_T textColour = { 255, 255, 255, 255 };
 static RGBA8_T greenColour = { 0, 255, 0, 200 };
 static RGBA8_T redColour = { 255, 0, 0, 200 };
-static int battery = 0, infos = 0, hud = 1, charge = 0, low_battery = 0, audio = 0, wifi = 0, wifi_loaded = 0, voltage = 0, vol_image = 0, infos_loaded = 0, joystick = 0, bluetooth = 0;
+static int battery = 0, infos = 0, charge = 0, low_battery = 0, audio = 0, wifi = 0, voltage = 0, vol_image = 0, infos_loaded = 0, joystick = 0, bluetooth = 0;
 static float temp = 0.f;
 
 void updateInfo(IMAGE_LAYER_T*, char[]);
 void updateInfoText(IMAGE_LAYER_T*, bool);
-void getInput();
+const volatile struct osd_state *openState(const char*);
+bool readState(const volatile struct osd_state*, struct osd_state*);
+void applyState(const struct osd_state*);
+unsigned changedLayers(const struct osd_state*, const struct osd_state*);
+void waitForUpdate(const volatile struct osd_state*, uint32_t, int);
 void clearLayer(IMAGE_LAYER_T*);
 void updateBattery(float, IMAGE_LAYER_T*);
 char *getcwd(char *buf, size_t size);
@@ -79,9 +104,6 @@ signalHandler(int signalNumber)
 {
     switch (signalNumber)
     {
-        case SIGUSR1:
-            getInput();
-            break;
         case SIGINT:
         case SIGTERM:
             
@@ -119,95 +141,106 @@ int getImageIconFromVolume(int vol) {
     return 1;
 }
 
-void getInput()
+const volatile struct osd_state *openState(const char *path)
 {
-    char buffer[100];
-    char *bp = buffer;
-    int c;
-    while(run && '\n' != (c=fgetc(stdin)) && (bp-buffer) < sizeof(buffer))
-        *bp++=c;
-    *bp = 0;//terminator
-#ifndef NDEBUG
-    printf("buffer: %s\n", buffer);
-#endif
-    char *saveptr;
-    char *word;
-    char *str = buffer;
-    while((word = strtok_r(str," ",&saveptr)))
+    int fd = open(path, O_RDONLY);
+    if (fd < 0)
     {
-#ifndef NDEBUG
-        printf("word: %s\n", word);
-#endif
-        str = NULL;
-        if(word[0] == 'b')
-        {
-            //Battery
-            battery = atoi(word+1);
-        }
-        else if(word[0] == 'w')
-        {
-            //wifi
-            wifi= atoi(word+1);
-        }
-        else if(word[0] == 'a')
-               {
-                  //audio
-                  audio= atoi(word+1);
-               }
-        else if(word[0] == 'j')
-               {
-                  joystick= atoi(word+1);
-               }
-        else if(word[0] == 'u')
-               {
-                  bluetooth= atoi(word+1);
-               }
-        else if(word[0] == 'l')
-               {
-                  low_battery= atoi(word+1);
-               }
-        else if(word[0] == 't')
-        {
-            //temperature
-            temp= atof(word+1);
-        }
-        else if(word[0] == 'v')
-        {
-            //voltage
-            voltage= atoi(word+1);
-        }
-        else if(!strcmp(word, "on"))
-        {
-            infos = 1;
-        }
-        else if(!strcmp(word, "off"))
-        {
-            infos = 0;
-        }
-        else if(!strcmp(word, "allon"))
-        {
-            hud = 1;
-        }
-        else if(!strcmp(word, "alloff"))
-        {
-            hud = 1;
-        }
-        else if(!strcmp(word, "charge"))
+        perror("opening OSD state");
+        return NULL;
+    }
+    void *state = mmap(NULL, sizeof(struct osd_state), PROT_READ, MAP_SHARED, fd, 0);
+    close(fd);
+    if (state == MAP_FAILED)
+    {
+        perror("mapping OSD state");
+        return NULL;
+    }
+    const volatile struct osd_state *shared = state;
+    if (shared->magic != OSD_STATE_MAGIC || shared->version != OSD_STATE_VERSION)
+    {
+        fprintf(stderr, "OSD state version mismatch (got %u, want %u)\n", shared->version, OSD_STATE_VERSION);
+        munmap(state, sizeof(struct osd_state));
+        return NULL;
+    }
+    return shared;
+}
+
+// Seqlock read: the counter is odd while the monitor writes, a copy is only
+// consistent if the counter was even and did not move while copying
+bool readState(const volatile struct osd_state *shared, struct osd_state *copy)
+{
+    int tries;
+    for (tries = 0; tries < 100; tries++)
+    {
+        uint32_t seq = __atomic_load_n(&shared->seq, __ATOMIC_ACQUIRE);
+        if (seq & 1)
         {
-            charge = 1;
+            sched_yield();
+            continue;
         }
-        else if(!strcmp(word, "ncharge"))
+        memcpy(copy, (const void*)shared, sizeof(*copy));
+        __atomic_thread_fence(__ATOMIC_ACQUIRE);
+        if (__atomic_load_n(&shared->seq, __ATOMIC_RELAXED) == seq)
         {
-            charge = 0;
+            copy->seq = seq;
+            return true;
         }
-        else if(!strcmp(word,"quit"))
-            run = false;
     }
+    return false;
+}
+
+void applyState(const struct osd_state *state)
+{
+    battery = state->battery;
+    wifi = state->wifi;
+    audio = state->audio;
+    joystick = state->joystick;
+    bluetooth = state->bluetooth;
+    low_battery = state->low_battery;
+    temp = state->temperature;
+    voltage = state->voltage;
+    infos = state->info;
+    charge = state->charge;
 #ifndef NDEBUG
-    printf("out\n");
+    printf("state %u: b%d w%d a%d j%d u%d l%d t%.1f v%d i%d c%d\n", state->seq, battery, wifi, audio,
+           joystick, bluetooth, low_battery, temp, voltage, infos, charge);
 #endif
 }
 
+unsigned changedLayers(const struct osd_state *old, const struct osd_state *state)
+{
+    unsigned dirty = 0;
+    if (old->battery != state->battery)
+        dirty |= DIRTY_BATTERY;
+    if (old->charge != state->charge)
+        dirty |= DIRTY_CHARGE;
+    if (old->wifi != state->wifi)
+        dirty |= DIRTY_WIFI | DIRTY_INFO_TEXT;
+    if (getImageIconFromVolume(old->audio) != getImageIconFromVolume(state->audio))
+        dirty |= DIRTY_AUDIO;
+    if (old->audio != state->audio)
+        dirty |= DIRTY_INFO_TEXT;
+    if (old->joystick != state->joystick)
+        dirty |= DIRTY_JOYSTICK | DIRTY_INFO_TEXT;
+    if (old->bluetooth != state->bluetooth)
+        dirty |= DIRTY_BLUETOOTH | DIRTY_INFO_TEXT;
+    if (old->info != state->info || old->low_battery != state->low_battery)
+        dirty |= DIRTY_INFO_IMAGE;
+    // Text is only drawn while the info screen is up
+    if (!state->info)
+        dirty &= ~DIRTY_INFO_TEXT;
+    return dirty;
+}
+
+// Sleep until the monitor publishes a state newer than seen, a signal
+// arrives or the timeout expires
+void waitForUpdate(const volatile struct osd_state *shared, uint32_t seen, int seconds)
+{
+    struct timespec timeout = { seconds, 0 };
+    syscall(SYS_futex, &shared->seq, FUTEX_WAIT, seen, &timeout, NULL, 0);
+}
+
 void clearLayer(IMAGE_LAYER_T *layer)
 {
     IMAGE_T *image = &(layer->image);
@@ -240,8 +273,9 @@ int main(int argc, char *argv[])
     }
 
     int opt;
+    const char *statePath = OSD_STATE_PATH;
 
-    while ((opt = getopt(argc, argv, "d:")) != -1)
+    while ((opt = getopt(argc, argv, "d:s:")) != -1)
     {
         switch (opt)
         {
@@ -250,37 +284,50 @@ int main(int argc, char *argv[])
             displayNumber = atoi(optarg);
             break;
 
+        case 's':
+
+            statePath = optarg;
+            break;
+
         default:
 
-            fprintf(stderr, "Usage: %s [-d <number>]\n", basename(argv[0]));
+            fprintf(stderr, "Usage: %s <path> <full|nojoystick> [-d <number>] [-s <state>]\n", basename(argv[0]));
             fprintf(stderr, "    -d - Raspberry Pi display number\n");
+            fprintf(stderr, "    -s - shared state file written by the monitor\n");
             exit(EXIT_FAILURE);
             break;
         }
     }
-    
-    if (signal(SIGINT, signalHandler) == SIG_ERR)
+
+    const volatile struct osd_state *sharedState = openState(statePath);
+    if (sharedState == NULL)
     {
-        perror("installing SIGINT signal handler");
         exit(EXIT_FAILURE);
     }
+    struct osd_state state, shown;
+    uint32_t applied = 0;
+    memset(&shown, 0, sizeof(shown));
     
-    //---------------------------------------------------------------------
-    
-    if (signal(SIGTERM, signalHandler) == SIG_ERR)
+    // No SA_RESTART, a signal has to break the futex wait in the main loop
+    struct sigaction action;
+    memset(&action, 0, sizeof(action));
+    action.sa_handler = signalHandler;
+    sigemptyset(&action.sa_mask);
+
+    if (sigaction(SIGINT, &action, NULL) == -1)
     {
-        perror("installing SIGTERM signal handler");
+        perror("installing SIGINT signal handler");
         exit(EXIT_FAILURE);
     }
     
     //---------------------------------------------------------------------
     
-    if (signal(SIGUSR1, signalHandler) == SIG_ERR)
+    if (sigaction(SIGTERM, &action, NULL) == -1)
     {
         perror("installing SIGTERM signal handler");
         exit(EXIT_FAILURE);
     }
-
+    
     //-------------------------------------------------------------------
 
     VC_IMAGE_TYPE_T type = VC_IMAGE_RGBA32;
@@ -438,108 +485,127 @@ int main(int argc, char *argv[])
     result = vc_dispmanx_update_submit_sync(update);
     assert(result == 0);
     
+    unsigned dirty = DIRTY_ALL;
     while (run)
     {
-        float batval = battery/100.f;
+        if (readState(sharedState, &state) && state.seq != applied)
         {
-            updateBattery(batval, &batteryLayer);
+            dirty |= changedLayers(&shown, &state);
+            applyState(&state);
+            shown = state;
+            applied = state.seq;
         }
-        if(charge > 0 && hud)
+        if (dirty & DIRTY_BATTERY)
         {
-            //TODO preload for efficiency
-            if (loadPng(&(cimageLayer.image), CHARGE_IMAGE) == false)
-            {
-                fprintf(stderr, "unable to charge load %s\n", argv[optind]);
-            }
-            changeSourceAndUpdateImageLayer(&cimageLayer);
-            charge = -1;
+            updateBattery(battery/100.f, &batteryLayer);
         }
-        else if(!charge && hud)
+        if (dirty & DIRTY_CHARGE)
         {
-            clearLayer(&cimageLayer);
-            charge = -1;
+            if (charge > 0)
+            {
+                //TODO preload for efficiency
+                if (loadPng(&(cimageLayer.image), CHARGE_IMAGE) == false)
+                {
+                    fprintf(stderr, "unable to charge load %s\n", argv[optind]);
+                }
+                changeSourceAndUpdateImageLayer(&cimageLayer);
+            }
+            else
+            {
+                clearLayer(&cimageLayer);
+            }
         }
-        if(wifi > 0 && hud)
+        if (dirty & DIRTY_WIFI)
         {
-            if (wifi_loaded == 0) {
+            if (wifi > 0)
+            {
                 //TODO preload for efficienty
                 if (loadPng(&(wimageLayer.image), WIFI_IMAGES[wifi-1]) == false)
                 {
                     fprintf(stderr, "unable to wifi load %s\n", argv[optind]);
                 }
                 changeSourceAndUpdateImageLayer(&wimageLayer);
-                wifi_loaded = 1;
+            }
+            else
+            {
+                clearLayer(&wimageLayer);
             }
         }
-        else if (!wifi)
+        if (dirty & DIRTY_AUDIO)
         {
-            clearLayer(&wimageLayer);
-            wifi_loaded = 0;
+            vol_image = getImageIconFromVolume(audio);
+            //TODO preload for efficienty
+            if (loadPng(&(aimageLayer.image), AUDIO_IMAGES[vol_image-1]) == false)
+            {
+                fprintf(stderr, "unable to audio load %s\n", argv[optind]);
+            }
+            changeSourceAndUpdateImageLayer(&aimageLayer);
         }
-         if(audio >= 0)
-                {
-                    vol_image = getImageIconFromVolume(audio);
-                    //TODO preload for efficienty
-                    if (loadPng(&(aimageLayer.image), AUDIO_IMAGES[vol_image-1]) == false)
-                    {
-                        fprintf(stderr, "unable to audio load %s\n", argv[optind]);
-                    }
-                    changeSourceAndUpdateImageLayer(&aimageLayer);
-                    //audio = -1;
-                }
-                else if (!audio)
+        if (dirty & DIRTY_JOYSTICK)
+        {
+            if (joystick > 0)
+            {
+                if (loadPng(&(joystickImageLayer.image), JOYSTICK_IMAGE) == false)
                 {
-                    clearLayer(&aimageLayer);
+                    fprintf(stderr, "unable to joystick load %s\n", argv[optind]);
                 }
-        if (!hud) {
-            clearLayer(&batteryLayer);
-            clearLayer(&wimageLayer);
-                clearLayer(&aimageLayer);
-                clearLayer(&bimageLayer);
-                clearLayer(&cimageLayer);
-        }
-        if(joystick > 0) {
-            if (loadPng(&(joystickImageLayer.image), JOYSTICK_IMAGE) == false) {
-                fprintf(stderr, "unable to joystick load %s\n", argv[optind]);
+                changeSourceAndUpdateImageLayer(&joystickImageLayer);
             }
-            changeSourceAndUpdateImageLayer(&joystickImageLayer);
-        }
-        else if(joystick <= 0) {
-            clearLayer(&joystickImageLayer);
-        }
-        if(bluetooth > 0) {
-            if (loadPng(&(bluetoothImageLayer.image), BLUETOOTH_IMAGE) == false) {
-                fprintf(stderr, "unable to baluetooth load %s\n", argv[optind]);
+            else
+            {
+                clearLayer(&joystickImageLayer);
             }
-            changeSourceAndUpdateImageLayer(&bluetoothImageLayer);
         }
-        else if(bluetooth <= 0) {
-            clearLayer(&bluetoothImageLayer);
-        }
-        if(infos > 0)
+        if (dirty & DIRTY_BLUETOOTH)
         {
-            if (low_battery <= 0) {
-            if (no_joystick) {
-             updateInfo(&infoLayer, INFO_NO_JOYSTICK);
-            } else {
-             updateInfo(&infoLayer, INFO_IMAGE);
+            if (bluetooth > 0)
+            {
+                if (loadPng(&(bluetoothImageLayer.image), BLUETOOTH_IMAGE) == false)
+                {
+                    fprintf(stderr, "unable to baluetooth load %s\n", argv[optind]);
+                }
+                changeSourceAndUpdateImageLayer(&bluetoothImageLayer);
             }
-            updateInfoText(&infoTextLayer, no_joystick);
-            } else {
-                 updateInfo(&infoLayer, LOW_BATTERY_IMAGE);
+            else
+            {
+                clearLayer(&bluetoothImageLayer);
             }
         }
-        else if(infos <= 0)
+        if (dirty & DIRTY_INFO_IMAGE)
         {
-              clearLayer(&infoLayer);
-              clearLayer(&infoTextLayer);
-              infos_loaded = 0;
+            // Switching between the info and low battery screens needs a reload
+            infos_loaded = 0;
         }
-        else
+        if (dirty & (DIRTY_INFO_IMAGE | DIRTY_INFO_TEXT))
         {
-            pause(); //stop thread
+            if (infos > 0)
+            {
+                if (low_battery <= 0)
+                {
+                    if (no_joystick)
+                    {
+                        updateInfo(&infoLayer, INFO_NO_JOYSTICK);
+                    }
+                    else
+                    {
+                        updateInfo(&infoLayer, INFO_IMAGE);
+                    }
+                    updateInfoText(&infoTextLayer, no_joystick);
+                }
+                else
+                {
+                    updateInfo(&infoLayer, LOW_BATTERY_IMAGE);
+                }
+            }
+            else if (dirty & DIRTY_INFO_IMAGE)
+            {
+                clearLayer(&infoLayer);
+                clearLayer(&infoTextLayer);
+            }
         }
-        usleep(10000000); //sleep 10sec
+        // Nothing redraws until the monitor publishes a change
+        dirty = 0;
+        waitForUpdate(sharedState, applied, REFRESH_SECONDS);
     }
     //---------------------------------------------------------------------
 
@@ -0,0 +1,41 @@
+//-------------------------------------------------------------------------
+//
+// Shared state block between the monitor and the OSD.
+//
+// The monitor owns a small memory-mapped file holding the HUD state and is
+// the only writer. Readers use the sequence counter as a seqlock: it is odd
+// while an update is in progress and a copy is only consistent if the counter
+// was even and unchanged around it. After every update the monitor wakes
+// readers with FUTEX_WAKE on the counter, so the OSD can sleep in FUTEX_WAIT
+// until something changes.
+//
+// Keep in sync with osdstate.py.
+//
+//-------------------------------------------------------------------------
+
+#ifndef OSDSTATE_H
+#define OSDSTATE_H
+
+#include <stdint.h>
+
+#define OSD_STATE_MAGIC 0x4F41464F  // "OFAO"
+#define OSD_STATE_VERSION 1
+
+struct osd_state
+{
+    uint32_t magic;
+    uint32_t version;
+    uint32_t seq;
+    int32_t voltage;
+    int32_t battery;
+    float temperature;
+    int32_t wifi;
+    int32_t audio;
+    int32_t joystick;
+    int32_t bluetooth;
+    int32_t low_battery;
+    int32_t info;
+    int32_t charge;
+};
+
+#endif
@@ -0,0 +1,111 @@
+#
+# Shared state block between the monitor and the OSD binary.
+#
+# The HUD state lives in a fixed-layout, versioned block in a memory-mapped
+# file (see osd/osdstate.h). The monitor is the only writer and brackets every
+# update with a sequence counter (odd while writing) so the OSD can take
+# consistent copies without locks, then wakes it with FUTEX_WAKE on that
+# counter. No text is parsed, no signal is sent and the main loop can never
+# block on a full pipe.
+#
+# The last published state is kept: only fields that changed are written and
+# an update that changes nothing is not published at all, so the OSD only
+# wakes up (and redraws the affected layers) when there is something new.
+# Fields the OSD doesn't draw (QUIET_FIELDS) are written without waking it,
+# it picks them up with the next update.
+#
+import ctypes
+import mmap
+import os
+import struct
+import time
+
+import stats
+
+clock = getattr(time, 'monotonic', time.time)
+
+OSD_STATE_PATH = '/dev/shm/oneforall-osd'
+OSD_STATE_MAGIC = 0x4F41464F  # "OFAO"
+OSD_STATE_VERSION = 1
+
+HEADER_FORMAT = '=III'  # magic, version, seq
+FIELDS_FORMAT = '=iifiiiiiii'
+FIELDS = ('voltage', 'battery', 'temperature', 'wifi', 'audio', 'joystick', 'bluetooth', 'low_battery',
+          'info', 'charge')
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+STATE_SIZE = HEADER_SIZE + struct.calcsize(FIELDS_FORMAT)
+FIELD_FORMATS = ['=' + code for code in FIELDS_FORMAT[1:]]
+FIELD_OFFSETS = [HEADER_SIZE + 4 * index for index in range(len(FIELDS))]
+QUIET_FIELDS = ('temperature',)
+LOUD = [name not in QUIET_FIELDS for name in FIELDS]
+SEQ_OFFSET = 8
+
+FUTEX_WAKE = 1
+INT_MAX = 0x7FFFFFFF
+
+# futex(2) syscall numbers by machine
+SYS_FUTEX = {
+    'armv6l': 240,
+    'armv7l': 240,
+    'aarch64': 98,
+    'i686': 240,
+    'x86_64': 202,
+}
+
+
+class OsdState(object):
+
+    def __init__(self, path=OSD_STATE_PATH):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, STATE_SIZE)
+            self.mem = mmap.mmap(fd, STATE_SIZE)
+        finally:
+            os.close(fd)
+        self.seqWord = ctypes.c_uint32.from_buffer(self.mem, SEQ_OFFSET)
+        self.seq = 0
+        self.published = None
+        struct.pack_into(HEADER_FORMAT, self.mem, 0, OSD_STATE_MAGIC, OSD_STATE_VERSION, self.seq)
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.sysFutex = SYS_FUTEX.get(os.uname()[4])
+
+    # Returns False when nothing changed since the last update
+    def publish(self, voltage=0, battery=0, temperature=0, wifi=0, audio=0, joystick=False, bluetooth=False,
+                low_battery=False, info=False, charge=False):
+        values = (int(voltage), int(battery), float(temperature), int(wifi), int(audio), int(joystick),
+                  int(bluetooth), int(low_battery), int(info), int(charge))
+        if values == self.published:
+            return False
+        begin = clock()
+        self.seq += 1
+        self.seqWord.value = self.seq
+        loud = self.published is None
+        for index, value in enumerate(values):
+            if self.published is None or self.published[index] != value:
+                struct.pack_into(FIELD_FORMATS[index], self.mem, FIELD_OFFSETS[index], value)
+                loud = loud or LOUD[index]
+        self.seq += 1
+        self.seqWord.value = self.seq
+        self.published = values
+        if loud:
+            self.wake()
+        stats.record('osd.publish', clock() - begin)
+        return True
+
+    # The syscall is also a full barrier, so a reader that woke up sees the
+    # whole update. A copy torn by the next update is always followed by
+    # another wake up.
+    def wake(self):
+        if self.sysFutex is None:
+            return
+        self.libc.syscall(self.sysFutex, ctypes.c_void_p(ctypes.addressof(self.seqWord)), FUTEX_WAKE,
+                          INT_MAX, None, None, 0)
+
+    def close(self):
+        del self.seqWord
+        self.mem.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,125 @@
+#
+# Bounded shutdown.
+#
+# A shutdown started by the power switch or a failing battery has to finish
+# while there is still voltage left. The pipeline works against one overall
+# budget:
+#
+#   stop      SIGTERM to every emulator and frontend process at once, so they
+#             write save data and gamelists in parallel, wait for them to
+#             exit and SIGKILL whatever is left once the stop share of the
+#             budget is used up
+#   sync      flush the filesystems, can't be cut short
+#   poweroff  hand over to the system
+#
+# Every phase is timed and logged, so the whole path can be checked against
+# the headroom left after the low battery detection.
+#
+import logging
+import os
+import signal
+import subprocess
+import time
+
+clock = getattr(time, 'monotonic', time.time)
+
+PROC = '/proc'
+COMM_LENGTH = 15  # /proc/<pid>/comm is cut to TASK_COMM_LEN - 1
+POLL_INTERVAL = 0.02
+KILL_WAIT = 0.5
+
+
+# Pids of the running processes called any of names
+def findProcesses(names, proc=PROC):
+    names = set(name[:COMM_LENGTH] for name in names)
+    pids = []
+    for entry in os.listdir(proc):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            with open(os.path.join(proc, entry, 'comm')) as comm:
+                name = comm.read().strip()
+        except (IOError, OSError):
+            continue
+        if name in names:
+            pids.append(int(entry))
+    return pids
+
+
+# Zombies count as gone, their parent reaps them whenever it likes
+def alive(pid, proc=PROC):
+    try:
+        with open(os.path.join(proc, str(pid), 'stat')) as stat:
+            return stat.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (IOError, OSError, IndexError):
+        return False
+
+
+# Direct kill(2), through sudo for processes of other users
+def sendSignal(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+    except PermissionError:
+        subprocess.call(['sudo', '-n', 'kill', '-' + str(int(signum)), str(pid)])
+
+
+class ShutdownPipeline(object):
+
+    # processes: names of the emulators and frontends to stop, budget: seconds
+    # for the whole shutdown, stopShare of it goes to the processes
+    def __init__(self, processes, budget=8.0, stopShare=0.75, command=('sudo', 'shutdown', '-h', 'now'),
+                 proc=PROC):
+        self.processes = list(processes)
+        self.budget = budget
+        self.stopShare = stopShare
+        self.command = list(command)
+        self.proc = proc
+        self.deadline = 0.0
+        self.timings = []
+
+    def run(self):
+        start = clock()
+        self.deadline = start + self.budget
+        del self.timings[:]
+        self.phase('stop', self.stop, start + self.budget * self.stopShare)
+        self.phase('sync', os.sync)
+        self.phase('poweroff', self.poweroff)
+        total = clock() - start
+        logging.info("Shutdown took {:.0f}ms of {:.0f}ms".format(total * 1000, self.budget * 1000))
+        return total
+
+    # A failing phase is logged, the next one runs anyway
+    def phase(self, name, func, *args):
+        started = clock()
+        try:
+            func(*args)
+        except Exception:
+            logging.exception("Shutdown " + name + " failed")
+        now = clock()
+        self.timings.append((name, now - started))
+        logging.info("Shutdown {} took {:.0f}ms, {:.0f}ms left".format(name, (now - started) * 1000,
+                                                                       (self.deadline - now) * 1000))
+
+    def stop(self, deadline):
+        pids = findProcesses(self.processes, self.proc)
+        for pid in pids:
+            sendSignal(pid, signal.SIGTERM)
+        pids = self.wait(pids, deadline)
+        if pids:
+            logging.warning("Shutdown: killing " + ", ".join(str(pid) for pid in pids))
+            for pid in pids:
+                sendSignal(pid, signal.SIGKILL)
+            self.wait(pids, min(self.deadline, clock() + KILL_WAIT))
+
+    # Returns the pids still running at the deadline
+    def wait(self, pids, deadline):
+        while True:
+            pids = [pid for pid in pids if alive(pid, self.proc)]
+            if not pids or clock() >= deadline:
+                return pids
+            time.sleep(POLL_INTERVAL)
+
+    def poweroff(self):
+        subprocess.call(self.command)
@@ -0,0 +1,131 @@
+#
+# Radio switches through the kernel rfkill interface.
+#
+# Blocking and unblocking is one 8-byte event written to /dev/rfkill and the
+# current state comes from the events the kernel queues on the same file
+# (one ADD per switch on open, a CHANGE for every later update, whoever made
+# it). The state is kept in memory, so a toggle costs a write and a few
+# non-blocking reads instead of a sudo'ed rfkill binary. /dev/rfkill is
+# usually group writable by netdev; without it the state is read from
+# /sys/class/rfkill instead.
+#
+import errno
+import os
+import struct
+
+RFKILL_DEVICE = '/dev/rfkill'
+RFKILL_SYSFS = '/sys/class/rfkill'
+BLUETOOTH_SYSFS = '/sys/class/bluetooth'
+
+# struct rfkill_event: idx, type, op, soft, hard
+EVENT_FORMAT = '=IBBBB'
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+
+TYPE_ALL = 0
+TYPE_WLAN = 1
+TYPE_BLUETOOTH = 2
+
+OP_ADD = 0
+OP_DEL = 1
+OP_CHANGE = 2
+OP_CHANGE_ALL = 3
+
+# Names used in /sys/class/rfkill/*/type
+TYPE_NAMES = {
+    TYPE_WLAN: 'wlan',
+    TYPE_BLUETOOTH: 'bluetooth',
+}
+
+
+def readValue(path):
+    with open(path) as value:
+        return value.read().strip()
+
+
+# Any Bluetooth controller registered with the kernel (what hcitool dev lists)
+def bluetoothPresent(path=BLUETOOTH_SYSFS):
+    try:
+        return any(name.startswith('hci') for name in os.listdir(path))
+    except OSError:
+        return False
+
+
+class Radio(object):
+
+    def __init__(self, type, device=RFKILL_DEVICE, sysfs=RFKILL_SYSFS):
+        self.type = type
+        self.device = device
+        self.sysfs = sysfs
+        self.switches = {}  # idx: (soft, hard)
+        self.fd = None
+        try:
+            self.fd = os.open(device, os.O_RDWR | os.O_NONBLOCK)
+        except OSError:
+            self.readSysfs()
+        self.sync()
+
+    # True when every switch of this type is blocked, False without switches
+    @property
+    def blocked(self):
+        return bool(self.switches) and all(soft or hard for soft, hard in self.switches.values())
+
+    # Hard blocked switches can't be unblocked from software
+    @property
+    def hardBlocked(self):
+        return any(hard for soft, hard in self.switches.values())
+
+    # Apply the events queued by the kernel since the last call
+    def sync(self):
+        if self.fd is None:
+            return
+        while True:
+            try:
+                data = os.read(self.fd, EVENT_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            if len(data) < EVENT_SIZE:
+                return
+            idx, type, op, soft, hard = struct.unpack(EVENT_FORMAT, data)
+            if type != self.type:
+                continue
+            if op == OP_DEL:
+                self.switches.pop(idx, None)
+            else:
+                self.switches[idx] = (soft, hard)
+
+    # Raises OSError when /dev/rfkill is not writable
+    def setBlocked(self, blocked):
+        if self.fd is None:
+            raise OSError(errno.EACCES, "Cannot write " + self.device)
+        os.write(self.fd, struct.pack(EVENT_FORMAT, 0, self.type, OP_CHANGE_ALL, int(blocked), 0))
+        # The kernel queues the resulting CHANGE events, which override this
+        for idx, (soft, hard) in list(self.switches.items()):
+            self.switches[idx] = (int(blocked), hard)
+        self.sync()
+        return self.blocked
+
+    def toggle(self):
+        return self.setBlocked(not self.blocked)
+
+    def readSysfs(self):
+        try:
+            names = os.listdir(self.sysfs)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.sysfs, name)
+            try:
+                if readValue(os.path.join(path, 'type')) != TYPE_NAMES.get(self.type):
+                    continue
+                idx = int(readValue(os.path.join(path, 'index')))
+                self.switches[idx] = (int(readValue(os.path.join(path, 'soft'))),
+                                      int(readValue(os.path.join(path, 'hard'))))
+            except (IOError, OSError, ValueError):
+                continue
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
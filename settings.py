@@ -0,0 +1,348 @@
+#
+# Typed monitor configuration.
+#
+# keys.cfg is read once into a Settings object: every option is converted to
+# its type and checked when the file is loaded, never on the input path, and
+# the button section is compiled into the tables the monitor dispatches on
+# (pin -> key event, hotkey chords, pins to watch).
+#
+# ConfigWatcher reports changes of the file through inotify, so the monitor
+# can load it again and apply the differences while it runs. The directory
+# is watched rather than the file, editors that save by renaming a new file
+# over the old one are seen as well.
+#
+import configparser
+import ctypes
+import ctypes.util
+import os
+import struct
+
+import adcsched
+
+BUTTON_NAMES = ('LEFT', 'RIGHT', 'DOWN', 'UP', 'BUTTON_A', 'BUTTON_B', 'BUTTON_X', 'BUTTON_Y', 'BUTTON_L1',
+                'BUTTON_R1', 'SELECT', 'START')
+
+# [HOTKEYS] when keys.cfg has none: buttons held with HOTKEY = action [value] [mode],
+# several actions for the same buttons are separated by commas
+DEFAULT_HOTKEYS = (
+    ('UP', 'volume 1 repeat'),
+    ('DOWN', 'volume -1 repeat'),
+    ('LEFT', 'wifi'),
+    ('RIGHT', 'joystick'),
+    ('BUTTON_A', 'bluetooth'),
+)
+HOTKEY_ACTIONS = ('volume', 'wifi', 'bluetooth', 'joystick', 'calibrate', 'shutdown', 'turbo', 'macro')
+HOTKEY_MODES = ('press', 'repeat', 'long')
+
+MAX_PIN = 27  # BCM numbering of the 40 pin header
+BATTERY_FULL_SCALE = 4.09  # V read as 2047 on the battery channel at gain 1, halved by every doubling
+MAX_TURBO_RATE = 30  # presses per second, faster than most games read their input
+INPUT_MODES = ('edge', 'scan', 'cdev')
+MAX_DEBOUNCE_TIMES = 10  # line attributes of one GPIO character device request
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def boolean(value):
+    try:
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+    except KeyError:
+        raise ValueError("not a boolean: " + value)
+
+
+def milliseconds(value):
+    return int(value) / 1000.0
+
+
+def names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+# 'BUTTON_A+UP', 'volume -1 repeat' -> (('BUTTON_A', 'UP'), 'volume', -1, 'repeat')
+def hotkey(buttons, definition):
+    buttons = tuple(sorted(set(name.strip().upper() for name in buttons.split('+'))))
+    for name in buttons:
+        if name not in BUTTON_NAMES:
+            raise ValueError("unknown button " + name)
+    words = definition.split()
+    if not words or words[0] not in HOTKEY_ACTIONS:
+        raise ValueError("action must be one of " + ", ".join(HOTKEY_ACTIONS))
+    action, words = words[0], words[1:]
+    mode = 'press'
+    if words and words[-1] in HOTKEY_MODES:
+        mode = words.pop()
+    if len(words) > 1:
+        raise ValueError("expected action [value] [" + "|".join(HOTKEY_MODES) + "]")
+    if action == 'macro':
+        if not words:
+            raise ValueError("macro needs a name")
+        value = words[0].lower()
+    else:
+        value = int(words[0]) if words else True
+    return buttons, action, value, mode
+
+
+# 'BUTTON_A+UP:80, wait:100, BUTTON_B' -> [(('BUTTON_A', 'UP'), 0.08), ((), 0.1), (('BUTTON_B',), hold)]
+def macro(definition, hold):
+    steps = []
+    for step in definition.split(','):
+        buttons, _, duration = step.strip().partition(':')
+        seconds = milliseconds(duration) if duration else hold
+        if buttons.strip().lower() == 'wait':
+            steps.append(((), seconds))
+            continue
+        names = tuple(name.strip().upper() for name in buttons.split('+'))
+        for name in names:
+            if name not in BUTTON_NAMES:
+                raise ValueError("unknown button " + name)
+        steps.append((names, seconds))
+    return steps
+
+
+# (section, option, attribute, type, default), options without a default
+# are required
+OPTIONS = [
+    ('GENERAL', 'SHUTDOWN_DETECT', 'shutdownPin', int, None),
+    ('GENERAL', 'DEBUG', 'debug', boolean, 'False'),
+    ('GENERAL', 'FRAME_WINDOW', 'frameWindow', milliseconds, '1'),
+    ('GENERAL', 'INPUT_MODE', 'inputMode', str, 'edge'),
+    ('GENERAL', 'SCAN_RATE', 'scanRate', int, '500'),
+    ('GENERAL', 'GPIO_CHIP', 'gpioChip', str, '/dev/gpiochip0'),
+    ('GENERAL', 'WIFI_INTERFACES', 'wifiInterfaces', names, 'wlan0'),
+    ('GENERAL', 'WIFI_TTL', 'wifiTtl', float, '5'),
+    ('GENERAL', 'MIXER_CONTROL', 'mixerControl', str, 'PCM'),
+    ('GENERAL', 'MIXER_CARD', 'mixerCard', str, 'default'),
+    ('GENERAL', 'SHUTDOWN_PROCESSES', 'shutdownProcesses', names, 'retroarch,emulationstation'),
+    ('GENERAL', 'SHUTDOWN_BUDGET', 'shutdownBudget', float, '8'),
+    ('GENERAL', 'LONG_PRESS', 'longPress', milliseconds, '600'),
+    ('GENERAL', 'REPEAT_DELAY', 'repeatDelay', milliseconds, '400'),
+    ('GENERAL', 'REPEAT_INTERVAL', 'repeatInterval', milliseconds, '200'),
+    ('GENERAL', 'REPEAT_MINIMUM', 'repeatMinimum', milliseconds, '40'),
+    ('GENERAL', 'MACRO_HOLD', 'macroHold', milliseconds, '50'),
+    ('GENERAL', 'TRACE_SIZE', 'traceSize', int, '4096'),
+    ('GENERAL', 'STATS_SOCKET', 'statsSocket', str, '/run/oneforall-stats.sock'),
+    ('KEYS', 'HOTKEY', 'hotkey', int, None),
+    ('DEBOUNCE', 'DEFAULT', 'bounceTime', milliseconds, '10'),
+    ('JOYSTICK', 'ENABLED', 'joystickEnabled', boolean, None),
+    ('JOYSTICK', 'ENABLE_ON_BOOT', 'enableOnBoot', boolean, None),
+    ('JOYSTICK', 'DEADZONE', 'deadzone', int, None),
+    ('JOYSTICK', 'CURVE', 'curve', float, '1.0'),
+    ('JOYSTICK', 'VCC', 'vref', int, None),
+    ('JOYSTICK', 'READY_PIN', 'readyPin', int, '-1'),
+    ('JOYSTICK', 'DATA_RATE', 'stickDataRate', int, '1600'),
+    ('JOYSTICK', 'ACTIVE_RATE', 'stickActiveRate', int, '200'),
+    ('JOYSTICK', 'IDLE_RATE', 'stickIdleRate', int, '20'),
+    ('JOYSTICK', 'QUIET_TIME', 'stickQuietTime', float, '2'),
+    ('JOYSTICK', 'THRESHOLD', 'stickThreshold', int, '8'),
+    ('BATTERY', 'ENABLED', 'monitoring', boolean, None),
+    ('BATTERY', 'FULL_BATT_VOLTAGE', 'battFull', int, None),
+    ('BATTERY', 'BATT_LOW_VOLTAGE', 'battLow', int, None),
+    ('BATTERY', 'BATT_SHUTDOWN_VOLT', 'battShutdown', int, None),
+    ('BATTERY', 'INTERVAL', 'batteryInterval', float, '30'),
+    ('BATTERY', 'FAST_INTERVAL', 'batteryFastInterval', float, '2'),
+    ('BATTERY', 'BATCH', 'batteryBatch', int, '5'),
+    ('BATTERY', 'DATA_RATE', 'batteryDataRate', int, '250'),
+    ('BATTERY', 'GAIN', 'batteryGain', int, '1'),
+    ('BATTERY', 'GUARD_INTERVAL', 'batteryGuardInterval', float, '0.5'),
+    ('THERMAL', 'ZONE', 'thermalZone', str, ''),
+    ('THERMAL', 'INTERVAL', 'thermalInterval', float, '5'),
+    ('THERMAL', 'MAX', 'temperatureMax', float, '70'),
+    ('THERMAL', 'THRESHOLD', 'temperatureThreshold', float, '5'),
+]
+
+# Only read while the monitor starts up
+RESTART = frozenset(['debug', 'mixerControl', 'mixerCard', 'joystickEnabled', 'enableOnBoot',
+                     'readyPin', 'monitoring', 'statsSocket'])
+
+
+class Settings(object):
+
+    def __init__(self, parser):
+        for section, option, attribute, cast, default in OPTIONS:
+            raw = parser.get(section, option, fallback=default)
+            if raw is None:
+                raise ConfigError("[{}] {} is missing".format(section, option))
+            try:
+                setattr(self, attribute, cast(raw.strip()))
+            except ValueError as e:
+                raise ConfigError("[{}] {}: {}".format(section, option, e))
+        self.pins = {}
+        for name in BUTTON_NAMES:
+            try:
+                self.pins[name] = int(parser.get('KEYS', name))
+            except (configparser.Error, ValueError) as e:
+                raise ConfigError("[KEYS] {}: {}".format(name, e))
+        self.bounceTimes = {}
+        if parser.has_section('DEBOUNCE'):
+            for name, value in parser.items('DEBOUNCE'):
+                name = name.upper()
+                if name in self.pins:
+                    try:
+                        self.bounceTimes[self.pins[name]] = milliseconds(value)
+                    except ValueError as e:
+                        raise ConfigError("[DEBOUNCE] {}: {}".format(name, e))
+        definitions = parser.items('HOTKEYS') if parser.has_section('HOTKEYS') else DEFAULT_HOTKEYS
+        self.hotkeyDefinitions = []
+        for buttons, definition in definitions:
+            try:
+                for part in definition.split(','):
+                    self.hotkeyDefinitions.append(hotkey(buttons, part))
+            except ValueError as e:
+                raise ConfigError("[HOTKEYS] {}: {}".format(buttons.upper(), e))
+        self.turboRates = {}
+        if parser.has_section('TURBO'):
+            for name, value in parser.items('TURBO'):
+                if name.upper() not in self.pins:
+                    raise ConfigError("[TURBO] {}: unknown button".format(name.upper()))
+                try:
+                    self.turboRates[self.pins[name.upper()]] = float(value)
+                except ValueError as e:
+                    raise ConfigError("[TURBO] {}: {}".format(name.upper(), e))
+        self.macros = {}
+        if parser.has_section('MACROS'):
+            for name, definition in parser.items('MACROS'):
+                try:
+                    self.macros[name] = macro(definition, self.macroHold)
+                except ValueError as e:
+                    raise ConfigError("[MACROS] {}: {}".format(name, e))
+        self.validate()
+        self.compile()
+
+    def validate(self):
+        pins = list(self.pins.values())
+        for name, pin in self.pins.items():
+            if not 0 <= pin <= MAX_PIN:
+                raise ConfigError("[KEYS] {}: no such GPIO {}".format(name, pin))
+        if len(set(pins)) != len(pins):
+            raise ConfigError("[KEYS] the same GPIO is used for two buttons")
+        for name in ('hotkey', 'shutdownPin', 'readyPin'):
+            if not -1 <= getattr(self, name) <= MAX_PIN:
+                raise ConfigError("{}: no such GPIO {}".format(name, getattr(self, name)))
+        if self.inputMode not in INPUT_MODES:
+            raise ConfigError("[GENERAL] INPUT_MODE must be one of " + ", ".join(INPUT_MODES))
+        if self.inputMode == 'cdev' and len(set([self.bounceTime] + list(self.bounceTimes.values()))) > \
+                MAX_DEBOUNCE_TIMES:
+            raise ConfigError("[DEBOUNCE] cdev input takes at most {} different times".format(MAX_DEBOUNCE_TIMES))
+        for name in ('scanRate', 'stickActiveRate', 'stickIdleRate', 'batteryBatch', 'vref'):
+            if getattr(self, name) <= 0:
+                raise ConfigError("{} must be positive".format(name))
+        if self.thermalInterval <= 0 or self.temperatureThreshold < 0:
+            raise ConfigError("[THERMAL] needs a positive INTERVAL and a THRESHOLD of 0 or more")
+        if self.traceSize < 0:
+            raise ConfigError("[GENERAL] TRACE_SIZE can't be negative")
+        if not 0 <= self.deadzone < self.vref // 2:
+            raise ConfigError("[JOYSTICK] DEADZONE must be below VCC / 2")
+        for name, option in (('stickDataRate', '[JOYSTICK] DATA_RATE'), ('batteryDataRate', '[BATTERY] DATA_RATE')):
+            if getattr(self, name) not in adcsched.CONFIG_DR:
+                rates = ", ".join(str(rate) for rate in sorted(adcsched.CONFIG_DR))
+                raise ConfigError("{} must be one of {}".format(option, rates))
+        if self.batteryGain not in adcsched.CONFIG_GAIN:
+            raise ConfigError("[BATTERY] GAIN must be one of 1, 2, 4, 8, 16")
+        if self.battFull / 100.0 > BATTERY_FULL_SCALE / self.batteryGain:
+            raise ConfigError("[BATTERY] GAIN {} reads at most {:.2f}V, less than FULL_BATT_VOLTAGE".format(
+                self.batteryGain, BATTERY_FULL_SCALE / self.batteryGain))
+        if not self.battShutdown < self.battLow < self.battFull:
+            raise ConfigError("[BATTERY] needs BATT_SHUTDOWN_VOLT < BATT_LOW_VOLTAGE < FULL_BATT_VOLTAGE")
+        modes = {}
+        for buttons, action, value, mode in self.hotkeyDefinitions:
+            if self.hotkey in [self.pins[name] for name in buttons]:
+                raise ConfigError("[HOTKEYS] {}: HOTKEY itself can't be part of a chord".format("+".join(buttons)))
+            modes.setdefault(buttons, []).append(mode)
+            if action == 'macro' and value not in self.macros:
+                raise ConfigError("[HOTKEYS] {}: no macro {} in [MACROS]".format("+".join(buttons), value))
+        for pin, rate in self.turboRates.items():
+            if not 0 < rate <= MAX_TURBO_RATE:
+                raise ConfigError("[TURBO] GPIO {}: rate must be above 0 and at most {}".format(pin, MAX_TURBO_RATE))
+        for buttons, used in modes.items():
+            if len(set(used)) != len(used) or 'repeat' in used and len(used) > 1:
+                raise ConfigError("[HOTKEYS] {}: one action per mode, repeat alone".format("+".join(buttons)))
+
+    # Dispatch tables, everything derived from the pins
+    def compile(self):
+        self.buttons = [self.pins[name] for name in BUTTON_NAMES]
+        self.inputPins = list(self.buttons)
+        if self.hotkey != -1 and self.hotkey not in self.buttons:
+            self.inputPins.append(self.hotkey)
+        # {chord pin mask: {mode: (action, value)}}
+        self.bindings = {}
+        self.hotkeyMask = 0
+        for buttons, action, value, mode in self.hotkeyDefinitions:
+            mask = 0
+            for name in buttons:
+                mask |= 1 << self.pins[name]
+            self.bindings.setdefault(mask, {})[mode] = (action, value)
+            self.hotkeyMask |= mask
+        self.hotkeys = frozenset(pin for pin in self.buttons if self.hotkeyMask >> pin & 1)
+
+    # {pin: event} from {button name: event}
+    def keyMap(self, events):
+        return dict((self.pins[name], event) for name, event in events.items())
+
+    # Option attributes whose value differs in other
+    def diff(self, other):
+        fields = [attribute for section, option, attribute, cast, default in OPTIONS]
+        fields += ['pins', 'bounceTimes', 'hotkeyDefinitions', 'turboRates', 'macros']
+        return set(name for name in fields if getattr(self, name) != getattr(other, name))
+
+    # Take over values that can't change while the monitor runs
+    def keep(self, other, fields):
+        for name in fields:
+            setattr(self, name, getattr(other, name))
+
+
+def load(path):
+    parser = configparser.ConfigParser()
+    with open(path) as source:
+        parser.read_file(source, path)
+    return Settings(parser)
+
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct('iIII')
+
+
+class ConfigWatcher(object):
+
+    def __init__(self, path):
+        self.directory, name = os.path.split(os.path.abspath(path))
+        self.name = name.encode()
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, "inotify_init1: " + os.strerror(error))
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, self.directory.encode(), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, "inotify_add_watch " + self.directory + ": " + os.strerror(error))
+
+    def fileno(self):
+        return self.fd
+
+    # Reads every pending event, True if one was about the config file
+    def changed(self):
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+                changed = changed or name == self.name
+                offset += EVENT.size + length
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
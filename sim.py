@@ -0,0 +1,349 @@
+#
+# Simulated hardware backend, see hal.py.
+#
+# Implements just enough of RPi.GPIO, Adafruit_ADS1x15 and python-uinput for
+# the monitor to run on a plain Linux box:
+#
+#   SimGpio     pin levels driven by scripts, edge callbacks fired on change
+#   SimAdc      ADS1015 whose channels follow synthetic waveforms, converting
+#               at the configured data rate in continuous mode
+#   SimUinput   uinput module whose devices record every event they get
+#
+import gpiobank
+import math
+import threading
+import time
+
+
+# Waveforms, functions of time (seconds) returning a raw ADC code
+def constant(value):
+    return lambda t: value
+
+
+def sineWave(center, amplitude, hz, phase=0.0):
+    return lambda t: center + amplitude * math.sin(2 * math.pi * hz * t + phase)
+
+
+class SimGpio(object):
+    BCM = 11
+    BOARD = 10
+    IN = 1
+    OUT = 0
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.levels = {}
+        self.callbacks = {}
+        self.lock = threading.RLock()
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=PUD_OFF, initial=None):
+        channels = channel if isinstance(channel, (list, tuple)) else [channel]
+        for pin in channels:
+            if initial is not None:
+                self.levels[pin] = initial
+            elif pull_up_down == self.PUD_DOWN:
+                self.levels.setdefault(pin, self.LOW)
+            else:
+                self.levels.setdefault(pin, self.HIGH)
+
+    def input(self, channel):
+        return self.levels.get(channel, self.HIGH)
+
+    def output(self, channel, value):
+        self.setLevel(channel, value)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        self.callbacks[channel] = (edge, callback)
+
+    def remove_event_detect(self, channel):
+        self.callbacks.pop(channel, None)
+
+    def cleanup(self, channel=None):
+        if channel is None:
+            self.callbacks.clear()
+        else:
+            self.remove_event_detect(channel)
+
+    # Drive a pin, edge callbacks run synchronously in the calling thread
+    def setLevel(self, pin, level):
+        with self.lock:
+            previous = self.levels.get(pin, self.HIGH)
+            self.levels[pin] = level
+            if previous == level or pin not in self.callbacks:
+                return
+            edge, callback = self.callbacks[pin]
+        if callback is None:
+            return
+        if edge == self.BOTH or (edge == self.RISING) == bool(level):
+            callback(pin)
+
+    # Buttons are wired active low
+    def press(self, pin):
+        self.setLevel(pin, self.LOW)
+
+    def release(self, pin):
+        self.setLevel(pin, self.HIGH)
+
+    # Play a list of (delay, pin, level) steps, delays in seconds
+    def play(self, script, realtime=True):
+        for delay, pin, level in script:
+            if realtime and delay > 0:
+                time.sleep(delay)
+            self.setLevel(pin, level)
+
+
+# I2C register file behind SimAdc, mirrors Adafruit_GPIO.I2C.Device
+class SimI2CDevice(object):
+
+    def __init__(self, adc):
+        self.adc = adc
+
+    def writeList(self, register, data):
+        self.adc.writeRegister(register, (data[0] << 8) | data[1])
+
+    def readList(self, register, length):
+        value = self.adc.registers[register]
+        return [(value >> 8) & 0xFF, value & 0xFF][:length]
+
+
+# ADS1015 samples per second by the DR field of the config register
+DATA_RATES = (128, 250, 490, 920, 1600, 2400, 3300, 3300)
+
+
+def signed16(value):
+    return value - 0x10000 if value & 0x8000 else value
+
+
+class SimAdc(object):
+    CONFIG_DEFAULT = 0x8583  # single shot, powered down
+
+    def __init__(self, gpio=None, readyPin=-1, conversionTime=0.0):
+        self.gpio = gpio
+        self.readyPin = readyPin
+        self.conversionTime = conversionTime
+        self.waveforms = {
+            0: constant(1900),  # about 3.8V on the battery divider
+            1: constant(800),  # centered stick with VCC=1600
+            2: constant(800),
+            3: constant(0),
+        }
+        self.registers = {0: 0, 1: self.CONFIG_DEFAULT, 2: 0x8000, 3: 0x7FFF}
+        self.conversions = 0
+        self.latched = False
+        self.clocking = False
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self._device = SimI2CDevice(self)
+
+    def setWaveform(self, channel, waveform):
+        self.waveforms[channel] = waveform
+
+    def sample(self, channel):
+        value = int(self.waveforms[channel](time.time() - self.start))
+        return max(0, min(2047, value))
+
+    def channel(self):
+        return ((self.registers[1] >> 12) & 0x07) - 4
+
+    def writeRegister(self, register, value):
+        self.registers[register] = value
+        if register == 1 and not value & 0x0100:
+            self.startClock()
+
+    # Continuous mode converts at the data rate until single shot is selected
+    def startClock(self):
+        with self.lock:
+            if self.clocking:
+                return
+            self.clocking = True
+        clock = threading.Thread(target=self.runClock, name='simadc')
+        clock.daemon = True
+        clock.start()
+
+    def runClock(self):
+        while True:
+            with self.lock:
+                config = self.registers[1]
+                if config & 0x0100:
+                    self.clocking = False
+                    return
+            time.sleep(1.0 / DATA_RATES[(config >> 5) & 0x07])
+            if not self.registers[1] & 0x0100:
+                self.convert()
+
+    # Finish one conversion of the selected channel, pulse ALERT/RDY when it
+    # is configured as a conversion-ready output, drive it from the
+    # comparator otherwise.
+    def convert(self):
+        channel = self.channel()
+        if self.conversionTime:
+            time.sleep(self.conversionTime)
+        self.conversions += 1
+        self.registers[0] = (self.sample(channel) << 4) & 0xFFFF
+        if self.registers[1] & 0x0003 == 0x0003 or not self.gpio or self.readyPin == -1:
+            return
+        ready = self.registers[3] & 0x8000 and not self.registers[2] & 0x8000
+        if ready:
+            self.gpio.setLevel(self.readyPin, self.gpio.LOW)
+            self.gpio.setLevel(self.readyPin, self.gpio.HIGH)
+        else:
+            self.compare()
+
+    # Active low ALERT, the queue is treated as a single conversion
+    def compare(self):
+        value, low, high = [signed16(self.registers[register]) for register in (0, 2, 3)]
+        config = self.registers[1]
+        if config & 0x0010:
+            alert = value < low or value > high
+        elif value > high:
+            alert = True
+        elif value < low:
+            alert = False
+        else:
+            alert = self.gpio.input(self.readyPin) == self.gpio.LOW
+        if config & 0x0004:
+            alert = alert or self.latched
+            self.latched = alert
+        self.gpio.setLevel(self.readyPin, self.gpio.LOW if alert else self.gpio.HIGH)
+
+    def configure(self, channel, continuous, comparator=False):
+        config = 0x4000 | (channel & 0x03) << 12
+        if not continuous:
+            config |= 0x0100
+        if not comparator:
+            config |= 0x0003
+        self.writeRegister(1, config)
+
+    def read_adc(self, channel, gain=1, data_rate=None):
+        self.configure(channel, False)
+        self.convert()
+        return self.get_last_result()
+
+    def start_adc(self, channel, gain=1, data_rate=None):
+        self.configure(channel, True)
+        self.convert()
+        return self.get_last_result()
+
+    def start_adc_comparator(self, channel, high_threshold, low_threshold, gain=1, data_rate=None,
+                             active_low=True, traditional=True, latching=False, num_readings=1):
+        self.registers[3] = high_threshold & 0xFFFF
+        self.registers[2] = low_threshold & 0xFFFF
+        self.configure(channel, True, comparator=True)
+        self.convert()
+        return self.get_last_result()
+
+    def stop_adc(self):
+        self.writeRegister(1, self.CONFIG_DEFAULT)
+
+    # Also releases a latched ALERT
+    def get_last_result(self):
+        if self.latched:
+            self.latched = False
+            self.gpio.setLevel(self.readyPin, self.gpio.HIGH)
+        return self.registers[0] >> 4
+
+
+class SimDevice(object):
+
+    def __init__(self, events, name="python-uinput", bustype=0, vendor=0, product=0, version=0):
+        self.capabilities = list(events)
+        self.name = name
+        self.events = []  # (timestamp, type, code, value)
+        self.writes = 0
+
+    def emit(self, event, value, syn=True):
+        self.writes += 1
+        self.events.append((time.time(), event[0], event[1], value))
+        if syn:
+            self.syn()
+
+    def syn(self):
+        self.writes += 1
+        self.events.append((time.time(), 0x00, 0x00, 0))
+
+    def emitFrame(self, events):
+        self.writes += 1
+        now = time.time()
+        for event, value in events:
+            self.events.append((now, event[0], event[1], value))
+        self.events.append((now, 0x00, 0x00, 0))
+
+    def emit_click(self, event, syn=True):
+        self.emit(event, 1)
+        self.emit(event, 0, syn)
+
+    def destroy(self):
+        pass
+
+    def clear(self):
+        del self.events[:]
+        self.writes = 0
+
+
+# Event codes from linux/input-event-codes.h, as (type, code) like python-uinput
+class SimUinput(object):
+    EV_KEY = 0x01
+    EV_ABS = 0x03
+
+    ABS_X = (EV_ABS, 0x00)
+    ABS_Y = (EV_ABS, 0x01)
+
+    KEY_ENTER = (EV_KEY, 28)
+    KEY_LEFTCTRL = (EV_KEY, 29)
+    KEY_G = (EV_KEY, 34)
+    KEY_H = (EV_KEY, 35)
+    KEY_Z = (EV_KEY, 44)
+    KEY_X = (EV_KEY, 45)
+    KEY_LEFTALT = (EV_KEY, 56)
+    KEY_SPACE = (EV_KEY, 57)
+    KEY_UP = (EV_KEY, 103)
+    KEY_LEFT = (EV_KEY, 105)
+    KEY_RIGHT = (EV_KEY, 106)
+    KEY_DOWN = (EV_KEY, 108)
+
+    BTN_A = (EV_KEY, 0x130)
+    BTN_B = (EV_KEY, 0x131)
+    BTN_X = (EV_KEY, 0x133)
+    BTN_Y = (EV_KEY, 0x134)
+    BTN_TL = (EV_KEY, 0x136)
+    BTN_TR = (EV_KEY, 0x137)
+    BTN_SELECT = (EV_KEY, 0x13a)
+    BTN_START = (EV_KEY, 0x13b)
+    BTN_DPAD_UP = (EV_KEY, 0x220)
+    BTN_DPAD_DOWN = (EV_KEY, 0x221)
+    BTN_DPAD_LEFT = (EV_KEY, 0x222)
+    BTN_DPAD_RIGHT = (EV_KEY, 0x223)
+
+    Device = SimDevice
+
+
+class SimulatedBackend(object):
+    name = 'simulated'
+    osd = False
+
+    def __init__(self, readyPin=-1):
+        self.gpio = SimGpio()
+        self.uinput = SimUinput()
+        self.readyPin = readyPin
+        self.adcs = []
+
+    def ADS1015(self, readyPin=None):
+        adc = SimAdc(self.gpio, self.readyPin if readyPin is None else readyPin)
+        self.adcs.append(adc)
+        return adc
+
+    def bank(self, pins):
+        return gpiobank.PinBank(self.gpio, pins)
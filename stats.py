@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+# Hot path instrumentation.
+#
+# Each stage of the monitor records its latency into a histogram with fixed
+# buckets (1-2-5 steps from 10us to 10s) and bumps counters for events
+# worth knowing about. Recording is a bisect and a few additions with no
+# lock: two threads recording at the same moment may lose a sample, never
+# slow each other down.
+#
+#   debounce        first edge of a button to its settled change
+#   emit.frame      first change staged to the frame written to uinput
+#   emit.write      the uinput write alone
+#   adc.request     a conversion requested to its result
+#   adc.convert     a single-shot conversion on the bus
+#   action.<name>   hotkey pressed to its action finished (mixer, rfkill...)
+#   osd.publish     HUD state written and the OSD woken up
+#
+# The monitor answers every connection to its stats socket (STATS_SOCKET in
+# keys.cfg, see statsserver.py) with a JSON snapshot, run this file to print
+# it:
+#
+#   python3 stats.py [--json] [socket]
+#
+# Plain Python 2 compatible, the legacy monitor imports it through osdstate.
+#
+import argparse
+import bisect
+import json
+import socket
+import sys
+import time
+
+clock = getattr(time, 'monotonic', time.time)
+
+DEFAULT_SOCKET = '/run/oneforall-stats.sock'
+BOUNDS = tuple(mantissa * 10.0 ** exponent for exponent in range(-5, 1) for mantissa in (1, 2, 5)) + (10.0,)
+
+
+class Histogram(object):
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last bucket takes everything slower
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    # Upper bound of the bucket holding the pct percentile, at most the maximum
+    def percentile(self, pct, count):
+        rank = pct / 100.0 * count
+        seen = 0
+        for index, bucketCount in enumerate(self.counts):
+            seen += bucketCount
+            if seen >= rank and bucketCount:
+                return min(self.bounds[index], self.maximum) if index < len(self.bounds) else self.maximum
+        return 0.0
+
+    def snapshot(self):
+        counts = list(self.counts)
+        count = sum(counts)
+        return {
+            'count': count,
+            'mean': self.total / count if count else 0.0,
+            'max': self.maximum,
+            'p50': self.percentile(50, count),
+            'p90': self.percentile(90, count),
+            'p99': self.percentile(99, count),
+            'buckets': [[bound, bucketCount] for bound, bucketCount in zip(self.bounds + (None,), counts)
+                        if bucketCount],
+        }
+
+
+started = clock()
+histograms = {}
+counters = {}
+
+
+def record(name, seconds):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms.setdefault(name, Histogram())
+    histogram.record(seconds)
+
+
+def count(name, amount=1):
+    counters[name] = counters.get(name, 0) + amount
+
+
+def snapshot():
+    return {
+        'uptime': clock() - started,
+        'counters': dict(counters),
+        'histograms': dict((name, histogram.snapshot()) for name, histogram in list(histograms.items())),
+    }
+
+
+def reset():
+    global started
+    started = clock()
+    histograms.clear()
+    counters.clear()
+
+
+def fetch(path=DEFAULT_SOCKET):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        data = b''
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                return json.loads(data.decode())
+            data += chunk
+    finally:
+        client.close()
+
+
+def report(snap):
+    print("uptime {:.0f}s".format(snap['uptime']))
+    print("{:<20} {:>9} {:>10} {:>10} {:>10} {:>10} {:>10}".format('stage', 'count', 'mean', 'p50', 'p90', 'p99',
+                                                                  'max'))
+    for name, histogram in sorted(snap['histograms'].items()):
+        print("{:<20} {:>9} {:>8.1f}us {:>8.1f}us {:>8.1f}us {:>8.1f}us {:>8.1f}us".format(
+            name, histogram['count'], histogram['mean'] * 1e6, histogram['p50'] * 1e6, histogram['p90'] * 1e6,
+            histogram['p99'] * 1e6, histogram['max'] * 1e6))
+    for name, value in sorted(snap['counters'].items()):
+        print("{:<20} {:>9}".format(name, value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the latency stats of the running monitor")
+    parser.add_argument('socket', nargs='?', default=DEFAULT_SOCKET, help="stats socket of the monitor")
+    parser.add_argument('--json', action='store_true', help="print the raw snapshot")
+    args = parser.parse_args()
+    try:
+        snap = fetch(args.socket)
+    except (IOError, OSError) as e:
+        sys.exit("Can't read stats from {}: {}".format(args.socket, e))
+    if args.json:
+        print(json.dumps(snap, indent=2, sort_keys=True))
+    else:
+        report(snap)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+#
+# The stats socket of the monitor.
+#
+# Every connection to the UNIX socket is answered with a JSON snapshot of the
+# latency histograms and counters (see stats.py) and closed. Runs as a task
+# on the monitor's event loop; kept apart from stats.py so the recorder stays
+# importable by the Python 2 monitor.
+#
+import asyncio
+import json
+import os
+
+import stats
+
+
+# Serves snapshots until cancelled
+async def serve(path=stats.DEFAULT_SOCKET):
+    if os.path.exists(path):
+        os.unlink(path)  # left behind by a monitor that didn't get to clean up
+    server = await asyncio.start_unix_server(answer, path)
+    os.chmod(path, 0o666)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        os.unlink(path)
+
+
+async def answer(reader, writer):
+    try:
+        writer.write(json.dumps(stats.snapshot(), sort_keys=True).encode() + b'\n')
+        await writer.drain()
+    finally:
+        writer.close()
@@ -0,0 +1,116 @@
+#
+# Calibrated analog stick response.
+#
+# Every raw ADC code of an axis is mapped once, through that axis' measured
+# low/center/high points, to a step in [-STEPS, STEPS]. Two packed arrays,
+# one per output axis and indexed by the pair of steps, hold the final output
+# with the radial deadzone and the response curve already applied (about
+# 260KB together). Mapping a sample is four lookups, no floating point or
+# branches on the input path.
+#
+# Calibration records where the stick actually rests and how far it really
+# travels, so units with different pots and drift all end up with the same
+# response. It is kept as JSON next to the monitor.
+#
+import json
+import math
+from array import array
+
+ADC_CODES = 4096  # 12-bit conversion results, negative ones wrap to the top half
+ADC_MAX = 2047
+STEPS = 128  # axis resolution of the response table, per side
+SIZE = 2 * STEPS + 1
+
+
+class Calibration(object):
+
+    # axes: [low, center, high] raw codes per axis
+    def __init__(self, axes):
+        self.axes = [list(axis) for axis in axes]
+
+    # Nominal stick: centered at VCC / 2 with the full VCC range
+    @classmethod
+    def nominal(cls, vref, count=2):
+        return cls([[0, vref // 2, min(vref, ADC_MAX)] for _ in range(count)])
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as source:
+            return cls(json.load(source)['axes'])
+
+    def save(self, path):
+        with open(path, 'w') as target:
+            json.dump({'axes': self.axes}, target)
+
+    # Rest position from samples taken with the stick released
+    def recenter(self, samples):
+        for index, axis in enumerate(self.axes):
+            values = sorted(sample[index] for sample in samples)
+            axis[1] = values[len(values) // 2]
+
+    # Widen the range to include a sample
+    def extend(self, sample):
+        for axis, value in zip(self.axes, sample):
+            if value < axis[0]:
+                axis[0] = value
+            elif value > axis[2]:
+                axis[2] = value
+
+    # Range collection starts from the rest position
+    def collapsed(self):
+        return Calibration([[center, center, center] for low, center, high in self.axes])
+
+
+def signedCode(code):
+    return code - ADC_CODES if code > ADC_MAX else code
+
+
+# Raw code -> offset into the response table, stride is the table row length
+def axisTable(low, center, high, stride):
+    table = []
+    for code in range(ADC_CODES):
+        value = signedCode(code) - center
+        if value >= 0:
+            step = int(round(value * STEPS / float(max(1, high - center))))
+        else:
+            step = int(round(value * STEPS / float(max(1, center - low))))
+        table.append((max(-STEPS, min(STEPS, step)) + STEPS) * stride)
+    return table
+
+
+# X and Y output for every pair of steps, one quadrant computed and mirrored
+def responseTable(deadzone, curve, center, reach):
+    xs = array('H', [center]) * (SIZE * SIZE)
+    ys = array('H', [center]) * (SIZE * SIZE)
+    for i in range(STEPS + 1):
+        for j in range(STEPS + 1):
+            x = i / float(STEPS)
+            y = j / float(STEPS)
+            radius = math.hypot(x, y)
+            if radius <= deadzone:
+                continue
+            magnitude = min(1.0, (radius - deadzone) / (1.0 - deadzone)) ** curve
+            dx = int(round(x / radius * magnitude * reach))
+            dy = int(round(y / radius * magnitude * reach))
+            for sx, sy in ((1, 1), (-1, 1), (1, -1), (-1, -1)):
+                index = (STEPS + sx * i) * SIZE + STEPS + sy * j
+                xs[index] = center + sx * dx
+                ys[index] = center + sy * dy
+    return xs, ys
+
+
+class StickMap(object):
+
+    # deadzone is a fraction of the full deflection, curve an exponent on the
+    # deflection past it (1 linear, above 1 finer near the center). Outputs
+    # range over center +/- reach.
+    def __init__(self, calibration, deadzone=0.0, curve=1.0, center=800, reach=800):
+        deadzone = max(0.0, min(0.95, deadzone))
+        xAxis, yAxis = calibration.axes[:2]
+        self.xTable = axisTable(xAxis[0], xAxis[1], xAxis[2], SIZE)
+        self.yTable = axisTable(yAxis[0], yAxis[1], yAxis[2], 1)
+        self.xs, self.ys = responseTable(deadzone, curve, center, reach)
+
+    def lookup(self, x, y):
+        index = self.xTable[x & 0xFFF] + self.yTable[y & 0xFFF]
+        return self.xs[index], self.ys[index]
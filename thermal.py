@@ -0,0 +1,95 @@
+#
+# SoC temperature and the thermal policy built on it.
+#
+# The temperature comes from a thermal zone in /sys/class/thermal (the one
+# named cpu-thermal on a Pi, the first zone otherwise). The file is kept open
+# and re-read into the same buffer, at most once per interval; everyone else
+# gets the cached value.
+#
+# ThermalPolicy turns the temperature into a scale for the monitor's
+# background work: 1 (full rate) while the SoC is more than the threshold
+# below its maximum, falling linearly to MIN_SCALE at the maximum and above.
+# Stick sampling, OSD refreshes and battery reads slow down by that scale so
+# the daemon isn't what pushes the SoC into throttling the emulator.
+#
+import glob
+import io
+import os
+import time
+
+THERMAL_ROOT = '/sys/class/thermal'
+PREFERRED_ZONES = ('cpu-thermal', 'soc-thermal', 'x86_pkg_temp')
+MIN_SCALE = 0.25
+SCALE_STEP = 0.05  # the scale moves in steps, not with every tenth of a degree
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+# temp file of the SoC's thermal zone, None without one
+def findZone(root=THERMAL_ROOT):
+    zones = sorted(glob.glob(os.path.join(root, 'thermal_zone*')), key=lambda zone: int(zone.rsplit('zone', 1)[1]))
+    names = {}
+    for zone in zones:
+        try:
+            with open(os.path.join(zone, 'type')) as source:
+                names[source.read().strip()] = zone
+        except (IOError, OSError):
+            continue
+    for name in PREFERRED_ZONES:
+        if name in names:
+            return os.path.join(names[name], 'temp')
+    return os.path.join(zones[0], 'temp') if zones else None
+
+
+class Thermal(object):
+
+    # path of a thermal zone temp file, found automatically when empty
+    def __init__(self, path=None, interval=5.0):
+        self.path = path or findZone()
+        self.interval = interval
+        self.buffer = bytearray(32)
+        self.file = None
+        self.value = None
+        self.expires = float('-inf')
+
+    # Degrees Celsius, None when there is no sensor to read
+    def read(self):
+        now = clock()
+        if now < self.expires or not self.path:
+            return self.value
+        self.expires = now + self.interval
+        try:
+            if self.file is None:
+                self.file = io.open(self.path, 'rb', buffering=0)
+            else:
+                self.file.seek(0)
+            length = self.file.readinto(self.buffer)
+            self.value = int(self.buffer[:length]) / 1000.0  # millidegrees
+        except (IOError, OSError, ValueError):
+            self.close()
+            self.value = None
+        return self.value
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ThermalPolicy(object):
+
+    def __init__(self, maximum=70.0, threshold=5.0):
+        self.maximum = maximum
+        self.threshold = threshold
+
+    # Share of the normal rates to run at
+    def scale(self, temperature):
+        if temperature is None:
+            return 1.0
+        over = temperature - (self.maximum - self.threshold)
+        if over <= 0:
+            return 1.0
+        if over >= self.threshold:
+            return MIN_SCALE
+        steps = round((1.0 - (1.0 - MIN_SCALE) * over / self.threshold) / SCALE_STEP)
+        return round(steps * SCALE_STEP, 2)
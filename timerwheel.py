@@ -0,0 +1,137 @@
+#
+# Hashed timer wheel for generated input.
+#
+# Every timer of the input pipeline (turbo buttons, macro steps) lives in one
+# wheel of buckets, TICK seconds each, served by a single thread. Adding or
+# cancelling a timer costs the same however many are running; a timer more
+# than one turn away stays in its bucket until its turn comes up.
+#
+# The thread sleeps until the earliest deadline in the next occupied bucket
+# and fires timers against the real clock, so a late wake-up delays one
+# firing but never shifts the ones after it. Periodic users schedule the next
+# deadline from the previous deadline, not from when their callback ran.
+#
+import logging
+import threading
+import time
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+class Timer(object):
+
+    def __init__(self, deadline, func, args):
+        self.deadline = deadline
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    # Cheap and safe from any thread, the entry is dropped when its bucket
+    # comes up
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel(object):
+
+    def __init__(self, tick=0.001, slots=256, name='timers'):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.name = name
+        self.origin = clock()
+        self.current = 0  # buckets before this one are done
+        self.count = 0
+        self.running = False
+        self.condition = threading.Condition()
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        worker = threading.Thread(target=self.run, name=self.name)
+        worker.daemon = True
+        worker.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    # func(*args) on the wheel thread once the clock reaches deadline
+    def at(self, deadline, func, *args):
+        timer = Timer(deadline, func, args)
+        with self.condition:
+            tick = max(self.current, int((deadline - self.origin) / self.tick))
+            self.slots[tick % len(self.slots)].append((tick, timer))
+            self.count += 1
+            self.condition.notify()
+        return timer
+
+    def after(self, delay, func, *args):
+        return self.at(clock() + delay, func, *args)
+
+    def run(self):
+        with self.condition:
+            while self.running:
+                now = clock()
+                due = self.collect(now)
+                if not due:
+                    self.condition.wait(self.timeout(now))
+                    continue
+                self.condition.release()
+                try:
+                    for timer in due:
+                        if not timer.cancelled:
+                            self.fire(timer)
+                finally:
+                    self.condition.acquire()
+
+    def fire(self, timer):
+        try:
+            timer.func(*timer.args)
+        except Exception:
+            logging.exception("Timer " + self.name)
+
+    # Timers due by now, in deadline order. Callers hold the lock.
+    def collect(self, now):
+        last = int((now - self.origin) / self.tick)
+        if not self.count:
+            self.current = max(self.current, last)
+            return []
+        due = []
+        size = len(self.slots)
+        while True:
+            index = self.current % size
+            bucket = self.slots[index]
+            if bucket:
+                keep = []
+                for entry in bucket:
+                    tick, timer = entry
+                    if timer.cancelled:
+                        self.count -= 1
+                    elif tick <= self.current and timer.deadline <= now:
+                        self.count -= 1
+                        due.append(timer)
+                    else:
+                        keep.append(entry)
+                self.slots[index] = keep
+            if self.current >= last:
+                break
+            self.current += 1
+        due.sort(key=lambda timer: timer.deadline)
+        return due
+
+    # Seconds until the earliest deadline of the next occupied bucket, None
+    # while the wheel is empty. Callers hold the lock.
+    def timeout(self, now):
+        if not self.count:
+            return None
+        size = len(self.slots)
+        for offset in range(size):
+            tick = self.current + offset
+            deadlines = [timer.deadline for start, timer in self.slots[tick % size] if start == tick]
+            if deadlines:
+                return max(0.0, min(deadlines) - now)
+        # Only timers a turn or more away
+        return max(0.0, self.origin + (self.current + size) * self.tick - now)
@@ -0,0 +1,91 @@
+#
+# Post-mortem traces of the input path.
+#
+# Hot paths record fixed-size binary records (a sequence number, a timestamp,
+# an event id and up to four integers) into a ring buffer allocated once. No
+# string is built and nothing is written anywhere while the monitor runs: a
+# record is one struct.pack_into. The event's format string is applied only
+# when the buffer is dumped, on demand (SIGUSR1) or when the monitor
+# crashes, so the last few thousand input events before a glitch can be read
+# from osd.log afterwards.
+#
+# Threads record without a lock: slots are handed out by an itertools
+# counter, which the GIL advances atomically, and the dump puts the records
+# back in order by their sequence numbers.
+#
+import itertools
+import struct
+import sys
+import threading
+import time
+
+clock = getattr(time, 'monotonic', time.time)
+
+RECORD = struct.Struct('=QdHxxiiii')  # sequence, time, event, arguments
+DEFAULT_SIZE = 4096  # records, about 160KB
+
+formats = []
+ring = (bytearray(), 0)  # buffer and its size in records, swapped as one
+sequence = itertools.count(1)
+
+
+# Register an event, returns its id. format gets the record's arguments.
+def event(format):
+    formats.append(format)
+    return len(formats) - 1
+
+
+# Allocate a buffer for size records, 0 turns tracing off. Drops the trace.
+def configure(records=DEFAULT_SIZE):
+    global ring
+    global sequence
+    sequence = itertools.count(1)
+    ring = (bytearray(RECORD.size * records), records)
+
+
+def record(event, a=0, b=0, c=0, d=0):
+    buffer, size = ring
+    if not size:
+        return
+    number = next(sequence)
+    RECORD.pack_into(buffer, (number % size) * RECORD.size, number, clock(), event, a, b, c, d)
+
+
+# Records in the order they were made, oldest first
+def records():
+    buffer = ring[0]
+    entries = [RECORD.unpack_from(buffer, offset) for offset in range(0, len(buffer), RECORD.size)]
+    return sorted(entry for entry in entries if entry[0])
+
+
+def dump(path):
+    entries = records()
+    now = clock()
+    wall = time.time()
+    with open(path, 'a') as log:
+        log.write("--- trace, {} records ---\n".format(len(entries)))
+        for number, stamp, event, a, b, c, d in entries:
+            moment = wall - (now - stamp)
+            log.write("{}.{:03d} {}\n".format(time.strftime('%H:%M:%S', time.localtime(moment)),
+                                              int(moment % 1 * 1000), formats[event].format(a, b, c, d)))
+        log.write("--- end of trace ---\n")
+
+
+# Dump the trace to path when an exception ends the program or one of its
+# threads, then carry on as before
+def dumpOnCrash(path):
+    previous = sys.excepthook
+
+    def crashed(*info):
+        dump(path)
+        previous(*info)
+
+    sys.excepthook = crashed
+    if hasattr(threading, 'excepthook'):
+        previousThread = threading.excepthook
+
+        def threadCrashed(args):
+            dump(path)
+            previousThread(args)
+
+        threading.excepthook = threadCrashed
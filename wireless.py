@@ -0,0 +1,87 @@
+#
+# Wi-Fi link quality straight from /proc/net/wireless.
+#
+# The file is kept open and re-read into the same buffer, parsed with a
+# precompiled pattern and the result is cached for a configurable time, so
+# showing current signal bars costs no process spawns and, most of the time,
+# no syscalls at all.
+#
+import io
+import re
+import time
+
+WIRELESS_PATH = '/proc/net/wireless'
+
+clock = getattr(time, 'monotonic', time.time)
+
+#  wlan0: 0000   70.  -40.  -256        0      0      0      0      0        0
+LINE = re.compile(br'^\s*([^\s:]+):\s+[0-9a-fA-F]+\s+(-?\d+)\.?\s+(-?\d+)\.?\s+(-?\d+)\.?', re.M)
+
+
+class WifiStatus(object):
+
+    def __init__(self, path=WIRELESS_PATH, ttl=5.0, bufferSize=4096):
+        self.path = path
+        self.ttl = ttl
+        self.buffer = bytearray(bufferSize)
+        self.file = None
+        self.links = {}
+        self.expires = float('-inf')
+
+    # {interface: (link, level, noise)} for every wireless interface
+    def read(self):
+        now = clock()
+        if now < self.expires:
+            return self.links
+        self.expires = now + self.ttl
+        try:
+            length = self.fill()
+        except (IOError, OSError):
+            self.close()
+            self.links = {}
+            return self.links
+        links = {}
+        for match in LINE.finditer(self.buffer, 0, length):
+            name = match.group(1).decode('ascii')
+            links[name] = (int(match.group(2)), int(match.group(3)), int(match.group(4)))
+        self.links = links
+        return links
+
+    # Signal strength (0-100) of the best of the given interfaces, None when
+    # none of them is up
+    def strength(self, interfaces=('wlan0',)):
+        links = self.read()
+        best = None
+        for interface in interfaces:
+            if interface not in links:
+                continue
+            link, level, noise = links[interface]
+            strength = 0
+            if link > 0:
+                strength = link
+            elif abs(level) > 0:
+                strength = abs(level)
+            best = strength if best is None else max(best, strength)
+        return best
+
+    def invalidate(self):
+        self.expires = float('-inf')
+
+    def fill(self):
+        if self.file is None:
+            self.file = io.open(self.path, 'rb', buffering=0)
+        else:
+            self.file.seek(0)
+        length = 0
+        while True:
+            if length == len(self.buffer):
+                self.buffer.extend(bytearray(len(self.buffer)))
+            count = self.file.readinto(memoryview(self.buffer)[length:])
+            if not count:
+                return length
+            length += count
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None